@@ -2,4 +2,5 @@ from .agent import Agent
 from .human import Human
 from .alphabeta import AlphaBeta
 from .mcts import Mcts
-from .alphafour import AlphaFour
\ No newline at end of file
+from .alphafour import AlphaFour
+from .solver import Solver
@@ -2,7 +2,17 @@ import numpy as np
 
 
 class Agent(object):
-    """Generic Agent class. To be used as a parent class for different implementations."""
+    """Generic Agent class. To be used as a parent class for different implementations.
+
+    Agents that search record a SearchStats for each move in `stats`, and pass it to
+    `on_stats` if it's set. If `profiler` is set to an object with start and stop
+    methods, such as a sampling profiler, it's started when an agent begins choosing a
+    move and stopped when it's done, so only time spent searching is profiled.
+    """
+
+    stats = None  # SearchStats of the last move
+    on_stats = None  # Function called with the SearchStats of each move
+    profiler = None  # Profiler to run while choosing each move
 
     def __init__(self) -> None:
         pass
@@ -12,3 +22,17 @@ class Agent(object):
 
     def handle_invalid_move(self) -> None:
         raise NotImplementedError
+
+    def begin_move(self) -> None:
+        """Called by agents when they start choosing a move."""
+        if self.profiler is not None:
+            self.profiler.start()
+
+    def end_move(self, stats) -> None:
+        """Called by agents with the SearchStats of a move once it's been chosen."""
+        if self.profiler is not None:
+            self.profiler.stop()
+
+        self.stats = stats
+        if self.on_stats is not None:
+            self.on_stats(stats)
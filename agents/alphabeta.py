@@ -1,18 +1,95 @@
 import numpy as np
 from agents import Agent
+from agents.evaluation import ThreatEvaluator
+from agents.position import Position
+from agents.stats import SearchStats
+from agents.transposition import EXACT, LOWER, UPPER, TranspositionTable
 from connectboard import ConnectBoard
+from symmetry import canonical_hash, mirror_column
+from concurrent.futures import ThreadPoolExecutor, wait
 import time
-import math
+
+
+class SearchTimeout(Exception):
+    """Exception thrown when a search runs past its deadline."""
+
+    pass
 
 
 class AlphaBeta(Agent):
     """Agent that implements minimax with alpha-beta pruning to select its next move."""
 
+    EVALUATIONS = ("threats", "windows")
+
+    def __init__(
+        self,
+        tt_size_mb: float = 16,
+        max_time: float = None,
+        max_depth: int = None,
+        killer_moves: bool = True,
+        history_heuristic: bool = True,
+        evaluation: str = "threats",
+        workers: int = 1,
+    ) -> None:
+        """Initializes the agent.
+
+        Args:
+            tt_size_mb (float, optional): Memory budget of the transposition table in
+                megabytes. Use 0 to search without a transposition table.
+            max_time (float, optional): Time budget per move in seconds. Defaults to None,
+                which searches to max_depth regardless of time.
+            max_depth (int, optional): Deepest search to run. Defaults to 5 without a time
+                budget, and to the number of open squares with one.
+            killer_moves (bool, optional): Whether to search moves that recently caused a cutoff
+                at the same ply before other moves.
+            history_heuristic (bool, optional): Whether to break ties in move ordering using how
+                often each move has caused a cutoff.
+            evaluation (str, optional): Static evaluation to use. "threats" scores boards with a
+                ThreatEvaluator, which is updated incrementally as the search makes and unmakes
+                moves. "windows" scores every board from scratch with get_static_values.
+            workers (int, optional): Number of threads to search with. With more than one,
+                the root moves are split between worker threads, see split_root_search.
+                The threads only run at the same time on free-threaded builds of Python,
+                and take turns holding the GIL on others.
+
+        Raises:
+            ValueError: If evaluation is not one of EVALUATIONS.
+        """
+        if evaluation not in AlphaBeta.EVALUATIONS:
+            raise ValueError("Unknown evaluation: {}".format(evaluation))
+
+        self.tt = TranspositionTable(tt_size_mb) if tt_size_mb else None
+        self.max_time = max_time
+        if max_depth is None:
+            max_depth = 5 if max_time is None else 42
+        self.max_depth = max_depth
+        self.killer_moves = killer_moves
+        self.history_heuristic = history_heuristic
+        self.evaluation = evaluation
+        self.evaluator = ThreatEvaluator() if evaluation == "threats" else None
+        self.workers = workers
+        self._helpers = None  # Agents searching for each worker thread, created on first use
+        self._pool = None
+        self._deadline = np.inf
+        self.nodes = 0  # Number of nodes searched during the last move
+        self.cutoffs = 0  # Number of beta cutoffs during the last move
+        self._phase_times = {"generate": 0.0, "evaluate": 0.0, "order": 0.0}
+
+        # Move ordering tables. Two killer columns per ply, and a history score per
+        # player and square that is halved before each move to age out old cutoffs.
+        self._killers = [[-1, -1] for _ in range(43)]
+        self._history = [[0.0] * 42, [0.0] * 42]
+
     def get_move(self, game_board: np.ndarray) -> np.ndarray:
         """Recursively runs minimax to determine the best move to make.
 
         Recursively runs minimax algorithm with alpha-beta pruning starting at the current game state.
-        This player is assumed to be maximizing.
+        This player is assumed to be maximizing. Uses iterative deepening, searching to depth 1, 2, 3...
+        until max_depth is reached or the time budget runs out. Each search starts with the principal
+        variation of the previous one, and the move from the deepest completed search is returned.
+
+        Statistics of the search are recorded in `stats`, with the time spent generating moves,
+        evaluating boards and ordering moves at each node split out.
 
         Args:
             game_board (np.ndarray): current board with a 1 for current player, -1 for
@@ -22,116 +99,465 @@ class AlphaBeta(Agent):
             An ndarray representing the move, with a 1 in the row,col of the new
             piece, and all other entries zero.
         """
+        self.begin_move()
+        if self.tt is not None:
+            self.tt.new_search()
+            tt_probes = (self.tt.probes, self.tt.hits)
+        if self.evaluator is not None:
+            self.evaluator.reset(game_board)
+        for agent in [self] + (self._helpers or []):
+            agent._history = [[h / 2 for h in row] for row in agent._history]
+        self.nodes = 0
+        self.cutoffs = 0
+        self._phase_times = {"generate": 0.0, "evaluate": 0.0, "order": 0.0}
 
         start = time.time()
-        move_val, move = self.alpha_beta(game_board, depth=5)
-        end = time.time()
+        max_depth = min(self.max_depth, int((game_board == 0).sum()))
+        position = Position(game_board)
+        pv = []
+
+        for depth in range(1, max_depth + 1):
+            # Always finish the depth 1 search so there is a move to return
+            if self.max_time is not None and depth > 1:
+                self._deadline = start + self.max_time
+
+            try:
+                if self.workers > 1:
+                    move_val, col = self.split_root_search(game_board, depth, pv)
+                else:
+                    move_val, col = self.alpha_beta(position, depth=depth, pv=pv)
+            except SearchTimeout:
+                break
+            finally:
+                self._deadline = np.inf
 
-        print(
-            "Found optimal move with value: {}, in {}s".format(move_val, (end - start))
+            completed_depth = depth
+            pv = self.get_principal_variation(game_board, depth, col)
+
+            # No point searching deeper once a forced win or loss is found
+            if np.isinf(move_val):
+                break
+
+        # The table's counters cover every search it was used for, so take this move's share
+        tt_hit_rate = None
+        if self.tt is not None:
+            probes = self.tt.probes - tt_probes[0]
+            tt_hit_rate = (self.tt.hits - tt_probes[1]) / probes if probes else 0.0
+
+        self.end_move(
+            SearchStats(
+                "AlphaBeta",
+                move=pv[0],
+                value=move_val,
+                time=time.time() - start,
+                nodes=self.nodes,
+                depth=completed_depth,
+                cutoffs=self.cutoffs,
+                tt_hit_rate=tt_hit_rate,
+                phase_times=self._phase_times,
+                pv=pv,
+            )
         )
+
+        move = np.zeros((6, 7))
+        move[np.flatnonzero(game_board[:, pv[0]] == 0)[-1], pv[0]] = 1
         return move
 
+    def get_principal_variation(
+        self, game_board: np.ndarray, depth: int, col: int
+    ) -> list[int]:
+        """Returns the columns of the expected line of play after a search of game_board.
+
+        Starts with the best move found by the search and follows the best moves stored in
+        the transposition table from there.
+
+        Args:
+            game_board (np.ndarray): The board the search started from, with the maximizing
+                player as 1.
+            depth (int): The depth that was searched.
+            col (int): Column of the best move found by the search.
+
+        Returns:
+            List of up to depth columns, starting with col.
+        """
+        pv = [col]
+        if self.tt is None:
+            return pv
+
+        position = Position(game_board)
+        position.play(col)
+
+        while len(pv) < depth and position.winner() is None:
+            entry = self.probe(position.key, position.mirror_key)
+            if entry is None or entry[3] < 0 or not position.can_play(entry[3]):
+                break
+
+            position.play(entry[3])
+            pv.append(entry[3])
+
+        return pv
+
     def alpha_beta(
         self,
-        game_board: np.ndarray,
+        position: Position,
         alpha: float = -np.inf,
         beta: float = np.inf,
         depth: int = np.inf,
-        max_player: bool = True,
-    ) -> (int, np.ndarray):
-        """Perform minimax with alpha-beta pruning to determine best move to take from current game_board.
+        pv: list[int] = None,
+    ) -> (int, int):
+        """Perform minimax with alpha-beta pruning to determine best move to take from position.
 
         Performs minimax starting at the current position and ending after looking depth moves ahead, or when all leaf
-        nodes are end_game states.
+        nodes are end_game states. Moves are played on position and taken back again, so it's left as it was
+        found, unless the search times out.
 
         TODO: If multiple winning moves, it picks the first one. Change so agent chooses the quickest win.
 
         Args:
-            game_board (np.ndarray): 2D array representing the current pieces as 1 or -1 if they
-                are for the maximizing or minimizing player respectively.
+            position (Position): The position to search. Player 0 in position is the maximizing player.
             alpha (float, optional): The best score achieved by the maximizing player. Defaults to -np.inf,
                 the worst possible value for the maximizing player.
             beta (float, optional): The best score achieved by the minimizing player. Defaults to np.inf.
             depth (int, optional): The number of layers to check using minimax. Defualt is np.inf which will
                 check all layers.
-            max_player (bool, optional): Indicates whether the turn at the root node belongs to the minimizing or
-                maximizing player. Default is True, meaning the maximizing player is next to move.
+            pv (list[int], optional): Columns of the principal variation from a previous search, starting at
+                position. The first move is searched before all others.
 
         Returns:
             move_val (int): The optimal value of this node.
-            move (np.ndarray): A 6x7 numpy array with a 1 in the spot of the move to take from the current
-                node that will result in the optimal value.
+            col (int): The column of the move to take from the current node that will result in the optimal
+                value, or -1 at leaf nodes.
         """
-        legal_moves = ConnectBoard.get_legal_moves(game_board)
-
-        if legal_moves.size == 0 or depth == 0:
+        if time.time() > self._deadline:
+            raise SearchTimeout
+        self.nodes += 1
+        phase_times = self._phase_times
+        player = position.player
+        max_player = player == 0
+
+        t0 = time.perf_counter()
+        move_cols = position.legal_moves()
+        heights = position.heights
+        move_cells = [(5 - heights[col]) * 7 + col for col in move_cols]
+        t1 = time.perf_counter()
+        phase_times["generate"] += t1 - t0
+
+        if not move_cols or depth == 0:
             # Leaf node, perform static value checking.
-            return self.get_static_value(game_board), None
-
-        next_states = (
-            game_board + legal_moves if max_player else game_board - legal_moves
-        )
-        best_move = legal_moves[0]
-
-        while next_states.size > 0:
-            best_idx = self.get_most_valuable(next_states, max_player)
-            state = next_states[best_idx]
-            next_states = np.delete(next_states, best_idx, 0)
-
-            # Only recurse farther if the current state is not an end game state
-            if math.isinf(self.get_static_value(state)):
-                val = self.get_static_value(state)
+            if self.evaluator is not None:
+                value = self.evaluator.value(player)
+            else:
+                value = self.get_static_value(position.board)
+            phase_times["evaluate"] += time.perf_counter() - t1
+            return value, -1
+
+        tt_move = -1
+        if self.tt is not None:
+            key, mirror_key = position.key, position.mirror_key
+            entry = self.probe(key, mirror_key)
+            if entry is not None:
+                tt_val, tt_depth, bound, tt_move = entry
+                if tt_depth >= depth and tt_move in move_cols:
+                    if bound == EXACT:
+                        return tt_val, tt_move
+                    elif bound == LOWER:
+                        alpha = max(alpha, tt_val)
+                    else:
+                        beta = min(beta, tt_val)
+
+                    if alpha >= beta:
+                        return tt_val, tt_move
+
+        alpha_orig, beta_orig = alpha, beta
+        ply = position.ply
+        best_idx = 0
+
+        # Score every child once, from the point of view of the player to move
+        t0 = time.perf_counter()
+        scores = self.child_scores(position, move_cells)
+        t1 = time.perf_counter()
+
+        # Search the principal variation, or else the best move from the transposition table, first
+        first_move = pv[0] if pv else tt_move
+        order = self.order_moves(scores, move_cells, player, ply, first_move)
+        phase_times["evaluate"] += t1 - t0
+        phase_times["order"] += time.perf_counter() - t1
+
+        for idx in order:
+            cell = move_cells[idx]
+            col = move_cols[idx]
+
+            # Only recurse farther if the current move doesn't win the game
+            if scores[idx] == np.inf:
+                val = np.inf if max_player else -np.inf
             else:
+                # The position and evaluator aren't restored if the search times out, but
+                # both are rebuilt before the next one
+                if self.evaluator is not None:
+                    self.evaluator.play(cell, player)
+                position.play(col)
+
                 val, _ = self.alpha_beta(
-                    state,
+                    position,
                     alpha=alpha,
                     beta=beta,
                     depth=depth - 1,
-                    max_player=not max_player,
+                    pv=pv[1:] if pv and pv[0] == col else None,
                 )
 
+                position.undo()
+                if self.evaluator is not None:
+                    self.evaluator.undo(cell, player)
+
             if max_player and val > alpha:
                 alpha = val
-                best_move = legal_moves[best_idx]
+                best_idx = idx
             elif not max_player and val < beta:
-                best_move = legal_moves[best_idx]
                 beta = val
+                best_idx = idx
 
-            legal_moves = np.delete(legal_moves, best_idx, 0)
-
-            if beta < alpha:
+            if alpha >= beta:
+                self.cutoffs += 1
+                self.update_ordering(col, cell, player, ply, depth)
                 break
 
-        if max_player:
-            return alpha, best_move
+        val = alpha if max_player else beta
+
+        if self.tt is not None:
+            if val <= alpha_orig:
+                bound = UPPER
+            elif val >= beta_orig:
+                bound = LOWER
+            else:
+                bound = EXACT
+            self.store(key, mirror_key, val, depth, bound, move_cols[best_idx])
+
+        return val, move_cols[best_idx]
+
+    def split_root_search(
+        self, game_board: np.ndarray, depth: int, pv: list[int] = None
+    ) -> (float, int):
+        """Searches game_board to depth, with the root moves split between worker threads.
+
+        The first root move in search order is searched on its own, and its value is the
+        bound the other moves have to beat. The rest are dealt out to the workers in turn.
+        Each worker searches its moves one after another on its own Position with its own
+        helper agent, raising its bound as it finds better moves, and every worker shares
+        this agent's transposition table. Only moves that beat the bound they were
+        searched with get exact values, and the best of them has the value a single
+        threaded search would find. The move can differ between moves of equal value,
+        since the workers fill the transposition table in a different order.
+
+        Args:
+            game_board (np.ndarray): The board to search, with the maximizing player as 1.
+            depth (int): The number of moves to look ahead.
+            pv (list[int], optional): Principal variation from a previous search.
+
+        Returns:
+            move_val (float): The value of the best move.
+            col (int): The column of the best move.
+
+        Raises:
+            SearchTimeout: If any worker runs past the deadline.
+        """
+        if self._helpers is None:
+            self._helpers = [
+                AlphaBeta(
+                    tt_size_mb=0,
+                    killer_moves=self.killer_moves,
+                    history_heuristic=self.history_heuristic,
+                    evaluation=self.evaluation,
+                )
+                for _ in range(self.workers)
+            ]
+            for helper in self._helpers:
+                helper.tt = self.tt
+            self._pool = ThreadPoolExecutor(self.workers)
+
+        position = Position(game_board)
+        move_cols = position.legal_moves()
+        move_cells = [position.cell(col) for col in move_cols]
+        scores = self.child_scores(position, move_cells)
+        first_move = pv[0] if pv else -1
+        order = self.order_moves(scores, move_cells, 0, position.ply, first_move)
+        moves = [move_cols[idx] for idx in order]
+
+        def search(agent, cols, alpha):
+            # Returns the (value, column) of each move in cols that beat alpha
+            agent._deadline = self._deadline
+            if agent.evaluator is not None:
+                agent.evaluator.reset(game_board)
+            child = Position(game_board)
+            results = []
+
+            for col in cols:
+                if child.is_winning_move(col):
+                    results.append((np.inf, col))
+                    break
+
+                cell = child.play(col)
+                if agent.evaluator is not None:
+                    agent.evaluator.play(cell, 0)
+
+                val, _ = agent.alpha_beta(
+                    child,
+                    alpha=alpha,
+                    depth=depth - 1,
+                    pv=pv[1:] if pv and pv[0] == col else None,
+                )
+
+                child.undo()
+                if agent.evaluator is not None:
+                    agent.evaluator.undo(cell, 0)
+
+                if val > alpha:
+                    alpha = val
+                    results.append((val, col))
+
+            return results
+
+        results = search(self, moves[:1], -np.inf)
+        move_val, col = results[0] if results else (-np.inf, move_cols[0])
+        if move_val == np.inf:
+            return move_val, col
+
+        for helper in self._helpers:
+            helper.nodes = helper.cutoffs = 0
+            helper._phase_times = dict.fromkeys(self._phase_times, 0.0)
+
+        futures = [
+            self._pool.submit(search, helper, moves[1 + i :: self.workers], move_val)
+            for i, helper in enumerate(self._helpers)
+        ]
+        wait(futures)
+
+        for helper in self._helpers:
+            self.nodes += helper.nodes
+            self.cutoffs += helper.cutoffs
+            for phase, seconds in helper._phase_times.items():
+                self._phase_times[phase] += seconds
+
+        # Ties go to the move searched first, like in alpha_beta
+        rank = {col: i for i, col in enumerate(moves)}
+        for future in futures:
+            for val, c in future.result():
+                if val > move_val or (val == move_val and rank[c] < rank[col]):
+                    move_val, col = val, c
+
+        return move_val, col
+
+    def child_scores(self, position: Position, move_cells: list[int]) -> list[float]:
+        """Returns the static value after each move, from the point of view of the player to move.
+
+        Args:
+            position (Position): The position the moves are played from.
+            move_cells (list[int]): Flat board index of each move.
+
+        Returns:
+            List with the value of each move.
+        """
+        if self.evaluator is not None:
+            scores = self.evaluator.child_values(move_cells, position.player)
         else:
-            return beta, best_move
+            # Boards are only copied for the windows evaluation, which scores them all at once
+            n = len(move_cells)
+            next_states = np.repeat(position.board.reshape(1, 42), n, axis=0)
+            next_states[np.arange(n), move_cells] = 1 if position.player == 0 else -1
+            scores = self.get_static_values(next_states).tolist()
 
-    def get_most_valuable(self, states: np.ndarray, max_player: bool) -> int:
-        """Return the index of next_states corresponding to the best static value for current player.
+        if position.player == 1:
+            scores = [-score for score in scores]
+        return scores
+
+    def probe(self, key: int, mirror_key: int) -> tuple:
+        """Looks up a position in the transposition table by its canonical hash.
+
+        Returns:
+            The entry from TranspositionTable.probe, with its move translated back from the
+            mirror image if that's how the position was stored, or None.
+        """
+        tt_key, mirrored = canonical_hash(key, mirror_key)
+        entry = self.tt.probe(tt_key)
+        if entry is None or not mirrored or entry[3] < 0:
+            return entry
+
+        value, depth, bound, move = entry
+        return value, depth, bound, mirror_column(move)
+
+    def store(
+        self, key: int, mirror_key: int, value: float, depth: int, bound: int, move: int
+    ) -> None:
+        """Stores a position in the transposition table under its canonical hash."""
+        tt_key, mirrored = canonical_hash(key, mirror_key)
+        self.tt.store(tt_key, value, depth, bound, mirror_column(move) if mirrored else move)
+
+    def order_moves(
+        self,
+        scores: list[float],
+        move_cells: list[int],
+        player: int,
+        ply: int,
+        first_move: int = -1,
+    ) -> list[int]:
+        """Returns the order to search the children of a node in, best first.
+
+        Moves are sorted by, in order of priority: whether they're first_move, whether they're
+        a killer move at this ply, their static score, their history score, their distance
+        from the center column, and finally their index, with later moves first.
 
         Args:
-            states (np.ndarray): Numpy array of 6x7 board states. Maximizing player is 1,minimizing
-                player is -1.
-            max_player (bool): If max_player is true, return the index with maximum static value,
-                if false, return the index that minimizes static value.
+            scores (list[float]): Static value of each child from the point of view of the
+                player making the move.
+            move_cells (list[int]): Flat board index of each move.
+            player (int): 0 for the maximizing player, 1 for the minimizing player.
+            ply (int): Number of pieces on the board before the move.
+            first_move (int, optional): Column to search first, or -1 for none.
+
+        Returns:
+            List of indices into scores, in the order they should be searched.
         """
+        killers = self._killers[ply] if self.killer_moves else ()
+        history = self._history[player]
+
+        keys = []
+        for idx, cell in enumerate(move_cells):
+            col = cell % 7
+            priority = 2 * (col == first_move) + (col in killers)
+            keys.append((priority, scores[idx], history[cell], -abs(col - 3), idx))
+        keys.sort(reverse=True)
 
-        idx = 0
-        best_val = self.get_static_value(states[0])
+        return [key[-1] for key in keys]
 
-        for i in range(1, states.shape[0]):
-            val = self.get_static_value(states[i])
+    def update_ordering(self, col: int, cell: int, player: int, ply: int, depth: int) -> None:
+        """Records a move that caused a beta cutoff in the killer and history tables."""
+        if self.killer_moves and self._killers[ply][0] != col:
+            self._killers[ply][1] = self._killers[ply][0]
+            self._killers[ply][0] = col
 
-            if max_player and val > best_val:
-                idx = i
-                best_val = val
-            elif val < best_val:
-                idx = i
-                best_val = val
+        if self.history_heuristic:
+            self._history[player][cell] += depth * depth
 
-        return idx
+    def get_static_values(self, states: np.ndarray) -> np.ndarray:
+        """Returns the static value of each of the given boards.
+
+        Vectorized version of get_static_value, which scores every board in a single batch.
+
+        Args:
+            states (np.ndarray): Numpy array of 6x7 board states. Maximizing player is 1, minimizing
+                player is -1.
+
+        Returns:
+            values (np.ndarray): The static value of each board.
+        """
+        windows = states.reshape(-1, 42)[:, ConnectBoard.WINDOW_INDICES].reshape(-1, 69, 4)
+        uncontested = windows.min(axis=2) != -windows.max(axis=2)
+        window_sums = np.where(uncontested, windows.sum(axis=2), 0)
+
+        values = (window_sums * abs(window_sums)).sum(axis=1)
+        values[(window_sums == -4).any(axis=1)] = -np.inf
+        values[(window_sums == 4).any(axis=1)] = np.inf
+
+        return values
 
     def get_static_value(self, game_board: np.ndarray) -> float:
         """Returns the static value of game_board.
@@ -147,19 +573,7 @@ class AlphaBeta(Agent):
         Returns:
             value (float): The static value of the current position.
         """
-        windows = game_board.flatten()[ConnectBoard.WINDOW_INDICES].reshape(-1, 4)
-        uncontested_windows = windows[windows.min(axis=1) != -windows.max(axis=1)]
-        if uncontested_windows.size == 0:
-            return 0
-
-        window_sums = uncontested_windows.sum(axis=1)
-
-        if window_sums.max() == 4:
-            return np.inf
-        elif window_sums.min() == -4:
-            return -np.inf
-        else:
-            return (abs(window_sums) * window_sums ** 2 / window_sums).sum()
+        return self.get_static_values(game_board[np.newaxis])[0]
 
     def handle_invalid_move(self) -> None:
         # Throw exception during development
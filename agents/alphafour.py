@@ -3,108 +3,230 @@ from agents import Agent
 import time
 import math
 from random import choice
-from time import time
+from agents.cache import EvaluationCache
+from agents.evaluator import BatchEvaluator
+from agents.network import Network
+from agents.position import Position
+from agents.stats import SearchStats
+from agents.tree import Tree, UNFINISHED
 from connectboard import ConnectBoard
 
 
 class Model(object):
     """The actual AlphaFour Neural Network.
 
+    Runs a Network loaded from exported weights. Without weights it falls back to
+    random values and uniform policies.
+
     TODO: All the challenging stuff
     """
 
-    def value(self, state):
-        # FIXME: Implement the NN
-        return 2 * np.random.rand() - 1
+    def __init__(self, weights_path: str = None) -> None:
+        """Initializes the model.
 
-    def policy(self, state):
-        # FIXME: Implement the NN
-        return np.full(7, 1 / 7)
-
-
-class Node(object):
-    """Node object used in MCTS."""
-
-    def __init__(self, state):
-        self.state = state  # Current state
-        self.P = np.zeros(7)  # Probability of taking each action from this state
-        self.W = np.zeros(7)  # Total value of next state from N visits
-        self.N = np.zeros(7)  # Number of times each action was taken
-        self.children = None  # Children of this Node
-
-    def add_children(self, moves):
-        """Add a child for each of the given moves."""
-        self.children = [None for _ in range(7)]
-
-        # Boolean for which columns have a legal move
-        col_has_move = moves.sum(axis=0).sum(axis=0)
-
-        move_idx = 0
-        for i in range(7):
-            if col_has_move[i]:
-                next_state = AlphaFour.next_game_state(self.state, moves[move_idx])
-                self.children[i] = Node(next_state)
-                move_idx += 1
-
-    def ucb_score(self, exploration_constant: float) -> np.array:
-        """Return the UCB score of each edge from this node."""
-        ucb = np.where(
-            self.N > 0,
-            self.W / self.N + exploration_constant * self.P / (1 + self.N),
-            np.inf,
-        )
+        Args:
+            weights_path (str, optional): Weights to load, see Network.load. Defaults to
+                None, for the untrained fallback.
+        """
+        self.network = Network.load(weights_path) if weights_path else None
+
+    def evaluate(self, states: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the policy and value of each of a batch of game states."""
+        if self.network is not None:
+            return self.network.evaluate(states)
+
+        return np.full((len(states), 7), 1 / 7), 2 * np.random.rand(len(states)) - 1
 
-        # Avoid invalid moves by setting UCB to -inf for None children
-        ucb = np.where(self.children is not None, ucb, -np.inf)
+    def value(self, state):
+        return self.evaluate(state[np.newaxis])[1][0]
 
-        return ucb
+    def policy(self, state):
+        return self.evaluate(state[np.newaxis])[0][0]
 
 
 class AlphaFour(Agent):
     """Agent that implements a lightweight version of the AlphaZero/AlphaGo algorithm.
 
+    The search tree is stored in a Tree, with node values from the point of view of the
+    player who moved into the node. Boards are not stored. Each simulation plays the
+    moves down the tree on a single Position, and takes them back once the leaf has been
+    read. The reachable part of the tree is kept between moves.
+
     TODO:
-        - Store subtree so I don't have to rebuild every time
         - General performance boosts. Pretty slow going right now
     """
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        max_nodes: int = None,
+        reuse_tree: bool = True,
+        batch_size: int = 8,
+        evaluator: BatchEvaluator = None,
+        weights_path: str = None,
+        cache_size: int = 2 ** 16,
+    ) -> None:
+        """Initializes the agent.
+
+        Args:
+            max_nodes (int, optional): Maximum size of the search tree. Defaults to None, for
+                no limit. Once full, leaves are evaluated without being expanded.
+            reuse_tree (bool, optional): Whether to keep the part of the search tree that's
+                still reachable between moves.
+            batch_size (int, optional): Number of leaves to collect before evaluating them
+                with the network in one batch.
+            evaluator (BatchEvaluator, optional): Evaluator to send leaves to. Can be shared
+                between agents searching in different threads. Defaults to a new evaluator
+                of this agent's model.
+            weights_path (str, optional): Network weights for the model, see Network.load.
+                Not used if evaluator is given.
+            cache_size (int, optional): Number of network evaluations to cache, which are
+                kept between moves. Use 0 for no cache. Not used if evaluator is given.
+        """
         self._EXPLORATION_CONSTANT = 1
         self._NUM_MCTS = 100
-        self.model = Model()
+        self.max_nodes = max_nodes
+        self.reuse_tree = reuse_tree
+        self.batch_size = batch_size
+        self.model = Model(weights_path) if evaluator is None else evaluator.model
+        if evaluator is None:
+            cache = EvaluationCache(cache_size) if cache_size else None
+            evaluator = BatchEvaluator(self.model, batch_size=batch_size, cache=cache)
+        self.evaluator = evaluator
+
+        # Tree from the last search, and the board it was searched from
+        self._tree = None
+        self._root_board = None
+
+        # Deepest leaf and time spent in each phase during the last move
+        self._max_depth = 0
+        self._phase_times = dict.fromkeys(("select", "evaluate", "expand", "backprop"), 0.0)
+
+    def select(self, tree: Tree, position: Position) -> int:
+        """Descends from the root to a leaf, choosing the child with the best UCB score at each node.
 
-    def select(self, node: Node) -> tuple[Node, list[(Node, int)]]:
-        """
+        Args:
+            tree (Tree): The search tree.
+            position (Position): Position at the root. The moves to the leaf are played on it.
+
+        Returns:
+            The id of the leaf.
         """
-        path = []  # For storing nodes we traverse along the way
+        node = 0
 
         # Loop until we hit a leaf node
-        while node.children is not None:
+        while tree.num_children[node]:
             # UCB score as defined in AlphaGo Zero paper. Use infinity for unvisited nodes
             # see: "Mastering the game of Go without human knowledge"
-            ucb = node.ucb_score(self._EXPLORATION_CONSTANT)
-            next_move = np.argmax(ucb)
+            children = tree.children(node)
+            ucb = self.ucb_score(
+                tree.value[children], tree.visits[children], tree.prior[children]
+            )
+
+            # Take best move
+            node = children.start + int(np.argmax(ucb))
+            position.play(int(tree.move[node]))
+
+        return node
+
+    def ucb_score(self, W: np.ndarray, N: np.ndarray, P: np.ndarray) -> np.ndarray:
+        """Return the UCB score of each child, given their total value, visits and prior."""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(
+                N > 0, W / N + self._EXPLORATION_CONSTANT * P / (1 + N), np.inf
+            )
+
+    def expand(
+        self,
+        tree: Tree,
+        node: int,
+        moves: list[int],
+        results: list[int],
+        policy: np.ndarray,
+    ) -> None:
+        """Adds the children of node to the tree, with priors from the network's policy.
+
+        Args:
+            tree (Tree): The search tree.
+            node (int): Id of the leaf to expand.
+            moves (list[int]): Columns that aren't full at node.
+            results (list[int]): Result of each move, see Position.move_results.
+            policy (np.ndarray): Prior probability of each column predicted by the network.
+        """
 
-            path.append((node, next_move))
+        # Renormalize the priors over the legal moves
+        priors = policy[moves]
+        if priors.sum() > 0:
+            priors = priors / priors.sum()
+        else:
+            priors = np.full(len(moves), 1 / len(moves))
 
-            # Take best move and add to path
-            node = node.children[next_move]
+        tree.add_children(node, moves, priors, results)
 
-        return node, path
+    def simulate_batch(self, tree: Tree, position: Position, num_simulations: int) -> int:
+        """Runs up to batch_size simulations, evaluating all of their leaves in one batch.
 
-    def expand_and_sim(self, node: Node) -> float:
-        # Combined expand and simulate. We add children to this node, and assign
-        # the value of the node and prior probabilities of possible actions
-        node.add_children(ConnectBoard.get_legal_moves(node.state[0] + node.state[1]))
-        node.P = self.model.policy(node.state)  # Add prior probabilities
-        node.W = self.model.value(node.state)  # Add predicted value of state
-        return node.W
+        Leaves are selected one after another, with a virtual loss added along the path to
+        each so the next selection is steered towards a different leaf. Leaves where the
+        game is over are backed up right away. Collection stops early if a leaf that's
+        already waiting is selected again. The moves to each leaf are played on position,
+        and taken back once its network input and legal moves have been read.
 
-    def back_propagate(self, path: list[(Node, int)], reward: int) -> None:
-        # Work backwards through path and propagate reward
-        for i, (node, action) in enumerate(path[::-1]):
-            node.N[action] += 1
-            node.W[action] += reward * (-1) ** (i + 1)
+        Args:
+            tree (Tree): The search tree.
+            position (Position): Position at the root of tree.
+            num_simulations (int): Most simulations to run.
+
+        Returns:
+            The number of simulations run: leaves evaluated or backed up, not counting
+            a leaf that was selected again while already waiting.
+        """
+        pending = []  # (leaf, moves, results) of each leaf waiting for the network
+        states = []  # Network input of each pending leaf
+        simulations = 0
+        phase_times = self._phase_times
+
+        t0 = time.perf_counter()
+        while len(pending) < self.batch_size and simulations < num_simulations:
+            leaf = self.select(tree, position)
+            if any(leaf == p[0] for p in pending):
+                # Already waiting for the network, so it isn't a new simulation
+                position.rewind()
+                break
+
+            simulations += 1
+            self._max_depth = max(self._max_depth, len(position.history))
+
+            if tree.result[leaf] != UNFINISHED:
+                # If the game is over at leaf it has no children. Back prop
+                tree.back_propagate(leaf, tree.result[leaf])
+            else:
+                tree.add_virtual_loss(leaf)
+                moves = [col for col in range(7) if position.can_play(col)]
+                pending.append((leaf, moves, position.move_results(moves)))
+                states.append(self.get_game_state(position.state()))
+            position.rewind()
+        t1 = time.perf_counter()
+        phase_times["select"] += t1 - t0
+
+        if not pending:
+            return simulations
+
+        policies, values = self.evaluator.evaluate(np.array(states))
+        t2 = time.perf_counter()
+        phase_times["evaluate"] += t2 - t1
+
+        for (leaf, moves, results), policy, value in zip(pending, policies, values):
+            tree.remove_virtual_loss(leaf)
+            t3 = time.perf_counter()
+            self.expand(tree, leaf, moves, results, policy)
+            t4 = time.perf_counter()
+
+            # The network predicts the value for the player to move
+            tree.back_propagate(leaf, -value)
+            phase_times["expand"] += t4 - t3
+            phase_times["backprop"] += time.perf_counter() - t4
+
+        return simulations
 
     def get_move(self, game_board: np.ndarray) -> np.ndarray:
         """Returns the best move for AlphaFour to take from the current state.
@@ -121,55 +243,95 @@ class AlphaFour(Agent):
             An ndarray representing the move, with a 1 in the row,col of the new
             piece, and all other entries zero.
         """
-        raise NotImplementedError
+        move, _ = self.get_move_with_prob(self.get_game_state(game_board))
+        return move
 
     def get_move_with_prob(self, game_state: np.ndarray) -> tuple[np.ndarray, np.array]:
         """Returns the best move along with the probabilities of each possible move.
 
         Runs the same MCTS as above, using the trained neural net to predict prior
-        probabilities and state values. After the simulations, this returns the optimal
+        probabilities and state values. Leaves are evaluated in batches of up to
+        batch_size. After the simulations, this returns the optimal
         move (most visited) and the probabilities for each of the 7 possible next moves.
-        If any columns are full, the probability for that column is 0.
+        If any columns are full, the probability for that column is 0. Statistics of the
+        search are recorded in `stats`.
 
         Args:
-            TODO:
+            game_state (np.ndarray): The current game state, in the format returned by
+                get_game_state.
 
         Returns:
-            TODO:
+            move (np.ndarray): A 6x7 array with a 1 in the row,col of the new piece, and
+                all other entries zero.
+            probs (np.ndarray): The fraction of root visits that went to each column.
         """
-        timing = []
-        root = Node(game_state)
-
-        for i in range(self._NUM_MCTS):
-            leaf, path = self.select(root)
-
-            winner = ConnectBoard.get_winner(leaf.state[0] - leaf.state[1])
-            if winner is not None:
-                # If leaf has static value it has no children. Back prop
-                self.back_propagate(path, winner)
-            else:
-                # Leaf has children. Expand and simulate
-                value = self.expand_and_sim(leaf)
-                if path:
-                    self.back_propagate(path, value)
-
-        visits = root.N
-
-        # Mask out invalid moves
-        col_has_move = (
-            ConnectBoard.get_legal_moves(root.state[0] + root.state[1])
-            .sum(axis=0)
-            .sum(axis=0)
-            .astype(bool)
+        self.begin_move()
+        start = time.time()
+        cache = self.evaluator.cache
+        cache_lookups = (cache.hits, cache.misses) if cache is not None else None
+        self._max_depth = 0
+        self._phase_times = dict.fromkeys(self._phase_times, 0.0)
+
+        root_board = (game_state[0] - game_state[1]).astype(float)
+        root_heights = (root_board != 0).sum(axis=0)
+        tree = self.get_tree(root_board)
+        position = Position(root_board)
+
+        simulations = 0
+        while simulations < self._NUM_MCTS:
+            simulations += self.simulate_batch(
+                tree, position, self._NUM_MCTS - simulations
+            )
+
+        # Visits of each column, with 0 for full columns
+        children = tree.children(0)
+        probs = np.zeros(7)
+        probs[tree.move[children]] = tree.visits[children]
+        probs /= probs.sum()
+
+        action = int(probs.argmax())
+        move = np.zeros((6, 7))
+        move[5 - root_heights[action], action] = 1
+
+        cache_hit_rate = None
+        if cache is not None:
+            hits = cache.hits - cache_lookups[0]
+            lookups = hits + cache.misses - cache_lookups[1]
+            cache_hit_rate = hits / lookups if lookups else 0.0
+
+        child = children.start + int(np.flatnonzero(tree.move[children] == action)[0])
+        self.end_move(
+            SearchStats(
+                "AlphaFour",
+                move=action,
+                value=float(tree.value[child] / tree.visits[child]),
+                time=time.time() - start,
+                nodes=len(tree),
+                depth=self._max_depth,
+                simulations=simulations,
+                cache_hit_rate=cache_hit_rate,
+                phase_times=self._phase_times,
+                pv=tree.principal_variation(),
+            )
         )
-        visits[~col_has_move] = 0
+        return move, probs
+
+    def get_tree(self, game_board: np.ndarray) -> Tree:
+        """Returns the tree to search game_board with.
 
-        action = visits.argmax()
-        new_state = root.children[action].state
+        If game_board is one or two moves on from the last search, and those moves are in
+        the last search tree, the subtree they lead to is reused. Otherwise a new tree is
+        started.
+        """
+        moves = None
+        if self.reuse_tree and self._tree is not None:
+            moves = ConnectBoard.find_moves(self._root_board, game_board)
 
-        move = (new_state[0] - game_state[0]) + (new_state[1] - game_state[1])
+        if moves is None or not self._tree.advance(moves):
+            self._tree = Tree(max_nodes=self.max_nodes)
+        self._root_board = game_board.copy()
 
-        return move, root.P
+        return self._tree
 
     def handle_invalid_move(self) -> None:
         # Throw exception during development
@@ -0,0 +1,86 @@
+import struct
+import numpy as np
+from bitboard import BitBoard
+from symmetry import canonical_key
+
+
+class OpeningBook(object):
+    """Table of solved scores for every position in the first few plies of a game.
+
+    The book is stored in a compact binary file: a 16 byte header followed by the
+    sorted position keys (uint64) and their scores (int8). Positions are stored under
+    their canonical key, see symmetry.canonical_key, so a position and its mirror image
+    share an entry. The file is memory mapped
+    rather than read, so loading is instant and only the pages touched by lookups are
+    ever read from disk. Lookups binary search the keys.
+    """
+
+    MAGIC = b"C4BK"
+    VERSION = 2
+    HEADER = struct.Struct("<4sHHQ")  # Magic, version, plies, number of entries
+
+    def __init__(self, keys: np.ndarray, scores: np.ndarray, plies: int) -> None:
+        """Initializes a book from sorted keys and their scores."""
+        self.keys = keys
+        self.scores = scores
+        self.plies = plies
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def get(self, position: BitBoard) -> int:
+        """Returns the score of position, or None if it's not in the book."""
+        if position.moves > self.plies or not len(self.keys):
+            return None
+
+        key, _ = canonical_key(position.key())
+        idx = int(np.searchsorted(self.keys, key))
+        if idx < len(self.keys) and int(self.keys[idx]) == key:
+            return int(self.scores[idx])
+
+        return None
+
+    @staticmethod
+    def load(path: str) -> "OpeningBook":
+        """Memory maps the book saved at path.
+
+        Raises:
+            ValueError: If the file is not an opening book.
+        """
+        with open(path, "rb") as f:
+            magic, version, plies, count = OpeningBook.HEADER.unpack(
+                f.read(OpeningBook.HEADER.size)
+            )
+
+        if magic != OpeningBook.MAGIC or version != OpeningBook.VERSION:
+            raise ValueError("{} is not a valid opening book".format(path))
+
+        offset = OpeningBook.HEADER.size
+        keys = np.memmap(path, dtype="<u8", mode="r", offset=offset, shape=(count,))
+        scores = np.memmap(
+            path, dtype=np.int8, mode="r", offset=offset + 8 * count, shape=(count,)
+        )
+
+        return OpeningBook(keys, scores, plies)
+
+    @staticmethod
+    def save(path: str, book: dict, plies: int) -> None:
+        """Writes a book to path.
+
+        Args:
+            path (str): File to write.
+            book (dict): Mapping of canonical position key to score.
+            plies (int): Number of plies covered by the book.
+        """
+        keys = np.fromiter(book.keys(), dtype="<u8", count=len(book))
+        scores = np.fromiter(book.values(), dtype=np.int8, count=len(book))
+        order = np.argsort(keys)
+
+        with open(path, "wb") as f:
+            f.write(
+                OpeningBook.HEADER.pack(
+                    OpeningBook.MAGIC, OpeningBook.VERSION, plies, len(book)
+                )
+            )
+            f.write(keys[order].tobytes())
+            f.write(scores[order].tobytes())
@@ -0,0 +1,238 @@
+import numpy as np
+from multiprocessing import shared_memory
+from symmetry import canonical_state_keys
+
+# Value of a slot's last use for empty slots
+_EMPTY = 0
+
+# Multiplier used to spread keys over sets. Keys only differ in their low bits between
+# positions with different pieces in the first column, so they can't be used directly.
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+class EvaluationCache(object):
+    """Fixed size cache of network evaluations, keyed by position.
+
+    Positions are keyed by their canonical BitBoard key (see symmetry.canonical_state_keys),
+    so a position and its mirror image share an entry. Policies are stored for the
+    canonical orientation and mirrored back on lookup.
+
+    The cache is set associative: each key maps to a set of `ways` slots, and a new entry
+    replaces the least recently used slot in its set. Everything is stored in flat numpy
+    arrays, so a batch of states is looked up with a few vectorized operations, and the
+    arrays can live in shared memory so self-play worker processes share their entries.
+
+    Shared caches have no locking. Each slot has a version, which a writer makes odd
+    before changing the slot and even again once it's done. A lookup reads the version
+    before and after copying an entry, and treats the entry as a miss if the version was
+    odd or changed, so a reader racing a writer never gets a mix of two entries.
+
+    Attributes:
+        hits (int): Number of lookups answered from the cache by this process.
+        misses (int): Number of lookups that weren't in the cache.
+        evictions (int): Number of entries this process replaced with a different position.
+    """
+
+    def __init__(
+        self, capacity: int = 2 ** 16, ways: int = 8, name: str = None
+    ) -> None:
+        """Creates a cache, or attaches to a shared one.
+
+        Args:
+            capacity (int, optional): Number of entries, rounded down to a power of 2 number
+                of sets. Ignored when attaching to an existing shared cache.
+            ways (int, optional): Number of entries per set.
+            name (str, optional): Name of a shared cache to attach to, see create_shared.
+                Defaults to None, for a cache private to this process.
+        """
+        self._shm = None
+        if name is not None:
+            self._shm = shared_memory.SharedMemory(name=name)
+            header = np.frombuffer(self._shm.buf, np.uint64, 2)
+            num_sets, ways = int(header[0]), int(header[1])
+            del header
+        else:
+            num_sets = 1 << (max(1, capacity // ways).bit_length() - 1)
+
+        self.num_sets = num_sets
+        self.ways = ways
+        self._set_shift = np.uint64(64 - (num_sets.bit_length() - 1))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        size = num_sets * ways
+        if self._shm is not None:
+            buf = self._shm.buf
+        else:
+            buf = bytearray(EvaluationCache.nbytes_for(size))
+
+        # Header holds the number of sets, the ways and the use counter
+        self._header = np.frombuffer(buf, np.uint64, 3)
+        offset = self._header.nbytes
+        arrays = []
+        for dtype, shape in (
+            (np.uint64, (num_sets, ways)),  # Version of each slot
+            (np.uint64, (num_sets, ways)),  # Keys
+            (np.uint64, (num_sets, ways)),  # Last use of each slot
+            (np.float32, (num_sets, ways)),  # Values
+            (np.float32, (num_sets, ways, 7)),  # Policies
+        ):
+            array = np.frombuffer(buf, dtype, int(np.prod(shape)), offset).reshape(shape)
+            offset += array.nbytes
+            arrays.append(array)
+        self._versions, self._keys, self._last_used, self._values, self._policies = arrays
+
+        if self._shm is None:
+            self._header[:2] = num_sets, ways
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self._last_used != _EMPTY))
+
+    @property
+    def capacity(self) -> int:
+        return self.num_sets * self.ways
+
+    @property
+    def name(self) -> str:
+        """Name of the shared memory holding the cache, or None for a private cache."""
+        return self._shm.name if self._shm is not None else None
+
+    def lookup(self, keys: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Looks up a batch of canonical keys.
+
+        Returns:
+            found (np.ndarray): Whether each key was in the cache.
+            policies (np.ndarray): Cached policy of each key, for the canonical orientation.
+                Rows for keys that weren't found are undefined.
+            values (np.ndarray): Cached value of each key.
+        """
+        sets = self._sets(keys)
+        rows = np.arange(len(keys))
+
+        versions = self._versions[sets]
+        matches = (self._keys[sets] == keys[:, np.newaxis]) & (
+            self._last_used[sets] != _EMPTY
+        )
+        way = matches.argmax(axis=1)
+        policies = self._policies[sets, way]
+        values = self._values[sets, way]
+
+        # Only keep entries that no writer touched while they were being copied
+        version = versions[rows, way]
+        found = (
+            matches[rows, way]
+            & (version % 2 == 0)
+            & (self._versions[sets, way] == version)
+        )
+
+        self._header[2] += 1
+        self._last_used[sets[found], way[found]] = self._header[2]
+        self.hits += int(found.sum())
+        self.misses += len(keys) - int(found.sum())
+
+        return found, policies, values
+
+    def insert(self, keys: np.ndarray, policies: np.ndarray, values: np.ndarray) -> None:
+        """Adds entries for canonical keys, replacing the least recently used in each set."""
+        for key, s, policy, value in zip(keys, self._sets(keys), policies, values):
+            matches = np.flatnonzero(self._keys[s] == key)
+            way = matches[0] if matches.size else int(self._last_used[s].argmin())
+
+            if self._last_used[s, way] != _EMPTY and self._keys[s, way] != key:
+                self.evictions += 1
+
+            # The version is odd while the slot is written, so readers ignore it
+            self._versions[s, way] += 1
+            self._keys[s, way] = key
+            self._policies[s, way] = policy
+            self._values[s, way] = value
+            self._header[2] += 1
+            self._last_used[s, way] = self._header[2]
+            self._versions[s, way] += 1
+
+    def evaluate(self, evaluate, states: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the policy and value of each state, only calling evaluate for misses.
+
+        Args:
+            evaluate: Function that takes an array of game states, and returns an array of
+                policies and an array of values, such as Model.evaluate.
+            states (np.ndarray): Array of game states, in the format returned by
+                AlphaFour.get_game_state.
+
+        Returns:
+            policies (np.ndarray): Prior probability of each column, for each state.
+            values (np.ndarray): Value of each state for the player to move.
+        """
+        keys, mirrored = canonical_state_keys(states)
+        found, policies, values = self.lookup(keys)
+
+        missing = np.flatnonzero(~found)
+        if missing.size:
+            new_policies, new_values = evaluate(states[missing])
+            new_policies[mirrored[missing]] = new_policies[mirrored[missing], ::-1]
+            self.insert(keys[missing], new_policies, new_values)
+
+            policies[missing] = new_policies
+            values[missing] = new_values
+
+        # Mirror canonical policies back to each state's own orientation
+        policies[mirrored] = policies[mirrored, ::-1]
+        return policies, values
+
+    def _sets(self, keys: np.ndarray) -> np.ndarray:
+        """Returns the set each key is stored in, from the top bits of a multiplicative hash."""
+        if self.num_sets == 1:
+            return np.zeros(len(keys), dtype=np.intp)
+        return ((keys * _HASH_MULTIPLIER) >> self._set_shift).astype(np.intp)
+
+    def hit_rate(self) -> float:
+        """Returns the fraction of lookups found in the cache."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+    def stats(self) -> dict:
+        """Returns the cache counters and occupancy."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hit_rate(),
+            "size": len(self),
+            "capacity": self.capacity,
+        }
+
+    def clear(self) -> None:
+        self._last_used[:] = _EMPTY
+
+    def close(self) -> None:
+        """Detaches from shared memory. The cache can't be used afterwards."""
+        if self._shm is not None:
+            # The arrays have to be released before the memory can be closed
+            self._header = self._versions = self._keys = self._last_used = None
+            self._values = self._policies = None
+            self._shm.close()
+
+    def unlink(self) -> None:
+        """Frees the shared memory once every process has closed it."""
+        if self._shm is not None:
+            self._shm.unlink()
+
+    @staticmethod
+    def nbytes_for(size: int) -> int:
+        """Returns the bytes needed by a cache with size entries."""
+        return 3 * 8 + size * (8 + 8 + 8 + 4 + 4 * 7)
+
+    @staticmethod
+    def create_shared(capacity: int = 2 ** 16, ways: int = 8) -> "EvaluationCache":
+        """Creates a cache in shared memory. Other processes attach with its name."""
+        num_sets = 1 << (max(1, capacity // ways).bit_length() - 1)
+        shm = shared_memory.SharedMemory(
+            create=True, size=EvaluationCache.nbytes_for(num_sets * ways)
+        )
+        header = np.frombuffer(shm.buf, np.uint64, 3)
+        header[:] = num_sets, ways, 0
+        del header
+        shm.close()
+
+        return EvaluationCache(name=shm.name)
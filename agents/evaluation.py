@@ -0,0 +1,196 @@
+import numpy as np
+from connectboard import ConnectBoard
+
+# Cells of each 4-in-a-row window, and the windows through each cell
+WINDOWS = ConnectBoard.WINDOW_INDICES.reshape(-1, 4).tolist()
+CELL_WINDOWS = [
+    [w for w, cells in enumerate(WINDOWS) if cell in cells] for cell in range(42)
+]
+
+# Score of a window holding n pieces of one player and none of the other, and the
+# change in score when that player adds a piece to it
+WINDOW_SCORES = [0, 1, 4, 9]
+WINDOW_GAINS = [b - a for a, b in zip(WINDOW_SCORES, WINDOW_SCORES[1:])]
+
+# Score of an open square that would complete four in a row for a player. Under the
+# zugzwang of Connect Four, the player who moved first can usually force play on the
+# odd rows (counted from the bottom), and the second player on the even rows, so
+# threats on those rows are worth much more.
+GOOD_THREAT = 24
+BAD_THREAT = 4
+
+# Score of a position where the player to move can win, or can't stop their opponent
+# winning, on the next move. Less than a won game so real wins are preferred.
+FORCED_WIN = 10000
+
+
+class ThreatEvaluator(object):
+    """Static evaluation of a board, updated incrementally as moves are made and unmade.
+
+    Keeps the number of pieces each player has in every 4-in-a-row window, and scores
+    the board from a lookup table of window counts. Squares that would complete a window
+    are tracked as threats and scored by whether their row suits the player who owns
+    them. Positions where the player to move wins, or loses to two threats they can't
+    both block, on the next move are scored as forced wins.
+
+    Each move only touches the (at most 13) windows through its square, so play and undo
+    take a handful of operations on plain Python ints and lists.
+
+    Players are numbered 0 for the pieces stored as 1 (the maximizing player) and 1 for
+    the pieces stored as -1, and scores are from player 0's point of view.
+    """
+
+    def __init__(self, game_board: np.ndarray = None) -> None:
+        self.reset(np.zeros((6, 7)) if game_board is None else game_board)
+
+    def reset(self, game_board: np.ndarray) -> None:
+        """Sets up the evaluator for game_board, with 1 for player 0 and -1 for player 1.
+
+        Whichever player has more pieces, or player 0 if they have the same number, is
+        taken to have moved first.
+        """
+        self.cells = [0] * 42
+        self.heights = [0] * 7
+        self.counts = ([0] * len(WINDOWS), [0] * len(WINDOWS))
+        self.threats = ([0] * 42, [0] * 42)
+        self.score = 0  # Sum of the window scores
+        self.threat_score = 0  # Sum of the threat scores
+        self.winner = None
+        self._stack = []
+
+        # Threat score of each square for each player. Row r of the array is row 6 - r
+        # counted from 1 at the bottom, so odd rows from the bottom are odd in the array.
+        ones = int((game_board == 1).sum())
+        first = 0 if ones >= int((game_board == -1).sum()) else 1
+        self._threat_values = ([0] * 42, [0] * 42)
+        for cell in range(42):
+            odd = (cell // 7) % 2 == 1
+            for player in (0, 1):
+                good = odd == (player == first)
+                value = GOOD_THREAT if good else BAD_THREAT
+                self._threat_values[player][cell] = value if player == 0 else -value
+
+        # Play the pieces from the bottom row up, so each lands on the one below it
+        for row in range(5, -1, -1):
+            for col in range(7):
+                if game_board[row, col] != 0:
+                    self.play(row * 7 + col, 0 if game_board[row, col] == 1 else 1)
+        self._stack = []
+
+    def play(self, cell: int, player: int) -> None:
+        """Adds a piece for player at cell, which must be the lowest open square in its column."""
+        counts, other_counts = self.counts[player], self.counts[1 - player]
+        sign = 1 if player == 0 else -1
+        changes = []  # Threats added (1) or removed (-1), to reverse in undo
+        self._stack.append((self.score, self.threat_score, self.winner, changes))
+
+        score = self.score
+        for w in CELL_WINDOWS[cell]:
+            n = counts[w]
+            other = other_counts[w]
+            counts[w] = n + 1
+
+            if other == 0:
+                if n == 3:
+                    # The move completes the window, and uses up the threat on cell
+                    self.winner = player
+                    self._change_threat(player, cell, -1, changes)
+                    continue
+
+                score += sign * WINDOW_GAINS[n]
+                if n == 2:
+                    # The window now has one open square left, which is a new threat
+                    for c in WINDOWS[w]:
+                        if c != cell and self.cells[c] == 0:
+                            self._change_threat(player, c, 1, changes)
+            elif n == 0:
+                # The window was the opponent's, and is now blocked
+                score += sign * WINDOW_SCORES[other]
+                if other == 3:
+                    self._change_threat(1 - player, cell, -1, changes)
+
+        self.score = score
+        self.cells[cell] = 1 if player == 0 else -1
+        self.heights[cell % 7] += 1
+
+    def undo(self, cell: int, player: int) -> None:
+        """Removes the piece added by the last call to play, which was for player at cell."""
+        self.score, self.threat_score, self.winner, changes = self._stack.pop()
+        for p, c, change in changes:
+            self.threats[p][c] -= change
+
+        counts = self.counts[player]
+        for w in CELL_WINDOWS[cell]:
+            counts[w] -= 1
+
+        self.cells[cell] = 0
+        self.heights[cell % 7] -= 1
+
+    def _change_threat(self, player: int, cell: int, change: int, changes: list) -> None:
+        threats = self.threats[player]
+        before = threats[cell]
+        threats[cell] = before + change
+        changes.append((player, cell, change))
+
+        # A square only counts once, however many windows it completes
+        if before == 0:
+            self.threat_score += self._threat_values[player][cell]
+        elif before + change == 0:
+            self.threat_score -= self._threat_values[player][cell]
+
+    def is_winning_move(self, cell: int, player: int) -> bool:
+        """Returns whether player wins by playing at cell."""
+        return self.threats[player][cell] > 0
+
+    def value(self, player: int) -> float:
+        """Returns the score of the board, with player to move, from player 0's point of view.
+
+        Returns:
+            inf or -inf if a player has four in a row, 0 for a full board, plus or minus
+            FORCED_WIN if the game will be decided on the next move, and the window and
+            threat scores otherwise.
+        """
+        if self.winner is not None:
+            return np.inf if self.winner == 0 else -np.inf
+        if sum(self.heights) == 42:
+            return 0
+
+        mover_threats, opponent_threats = self.threats[player], self.threats[1 - player]
+        sign = 1 if player == 0 else -1
+        opponent_wins = 0
+        for col, height in enumerate(self.heights):
+            if height == 6:
+                continue
+
+            cell = (5 - height) * 7 + col
+            if mover_threats[cell]:
+                return sign * FORCED_WIN
+            if opponent_threats[cell]:
+                # Blocking doesn't help if the opponent can also win on top of the block
+                stacked = cell >= 7 and opponent_threats[cell - 7]
+                opponent_wins += 2 if stacked else 1
+
+        if opponent_wins >= 2:
+            return -sign * FORCED_WIN
+
+        return self.score + self.threat_score
+
+    def child_values(self, cells: list[int], player: int) -> list[float]:
+        """Returns the score after player plays at each of cells, from player 0's point of view.
+
+        Used to order moves, so forced wins aren't looked for. Moves that win score inf or
+        -inf.
+        """
+        win = np.inf if player == 0 else -np.inf
+        threats = self.threats[player]
+        values = []
+        for cell in cells:
+            if threats[cell]:
+                values.append(win)
+                continue
+
+            self.play(cell, player)
+            values.append(self.score + self.threat_score)
+            self.undo(cell, player)
+
+        return values
@@ -0,0 +1,165 @@
+import numpy as np
+from agents.cache import EvaluationCache
+import queue
+import threading
+import time
+
+
+class _Request(object):
+    """A batch of states waiting to be evaluated by a BatchEvaluator's worker thread."""
+
+    def __init__(self, states: np.ndarray) -> None:
+        self.states = states
+        self.policies = None
+        self.values = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class BatchEvaluator(object):
+    """Evaluates game states with a model, in batches.
+
+    Each call to the model has a fixed overhead, so evaluating many states in one call
+    is much faster than one at a time. A search collects the leaves it wants evaluated
+    and passes them to evaluate together.
+
+    Once started, the evaluator also runs a worker thread that merges the requests of
+    several threads into shared batches. The worker waits for up to batch_size states,
+    or until timeout seconds have passed since the first state arrived, then evaluates
+    everything waiting in one call and hands each thread back its own results.
+
+    With a cache, states that have been evaluated before are answered from the cache,
+    and only the rest are sent to the model.
+
+    Attributes:
+        batches (int): Number of calls made to the model.
+        positions (int): Number of states evaluated by the model.
+    """
+
+    def __init__(
+        self,
+        model,
+        batch_size: int = 8,
+        timeout: float = 0.001,
+        cache: EvaluationCache = None,
+    ) -> None:
+        """Initializes the evaluator.
+
+        Args:
+            model: Model with an evaluate method, which takes an array of game states and
+                returns an array of policies and an array of values.
+            batch_size (int, optional): Number of states the worker thread waits for
+                before evaluating a batch.
+            timeout (float, optional): Longest time in seconds the worker thread waits for
+                a batch to fill up.
+            cache (EvaluationCache, optional): Cache of earlier evaluations. Defaults to
+                None, for no cache.
+        """
+        self.model = model
+        self.cache = cache
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.batches = 0
+        self.positions = 0
+
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def __enter__(self) -> "BatchEvaluator":
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def evaluate(self, states: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the policy and value of each state.
+
+        Evaluates states directly, unless the worker thread is running, in which case they
+        are queued to be evaluated along with the states of other threads.
+
+        Args:
+            states (np.ndarray): Array of game states, in the format returned by
+                AlphaFour.get_game_state.
+
+        Returns:
+            policies (np.ndarray): Prior probability of each column, for each state.
+            values (np.ndarray): Value of each state for the player to move.
+        """
+        if self._thread is None:
+            return self._run(states)
+
+        request = _Request(states)
+        self._queue.put(request)
+        request.done.wait()
+
+        if request.error is not None:
+            raise request.error
+        return request.policies, request.values
+
+    def start(self) -> None:
+        """Starts the worker thread, if it's not already running."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._serve, daemon=True)
+            self._thread.start()
+
+    def close(self) -> None:
+        """Stops the worker thread once every queued request has been evaluated."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def mean_batch_size(self) -> float:
+        """Returns the average number of states per call to the model."""
+        return self.positions / self.batches if self.batches else 0
+
+    def _run(self, states: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        if self.cache is not None:
+            return self.cache.evaluate(self._run_model, states)
+        return self._run_model(states)
+
+    def _run_model(self, states: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        policies, values = self.model.evaluate(states)
+        self.batches += 1
+        self.positions += len(states)
+        return policies, values
+
+    def _serve(self) -> None:
+        running = True
+        while running:
+            request = self._queue.get()
+            if request is None:
+                break
+
+            # Gather requests until the batch is full or the timeout runs out
+            requests = [request]
+            count = len(request.states)
+            deadline = time.monotonic() + self.timeout
+            while count < self.batch_size:
+                try:
+                    request = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if request is None:
+                    running = False
+                    break
+                requests.append(request)
+                count += len(request.states)
+
+            try:
+                policies, values = self._run(np.concatenate([r.states for r in requests]))
+            except Exception as e:
+                for r in requests:
+                    r.error = e
+                    r.done.set()
+                continue
+
+            # Scatter the results back to each request
+            start = 0
+            for r in requests:
+                end = start + len(r.states)
+                r.policies = policies[start:end]
+                r.values = values[start:end]
+                r.done.set()
+                start = end
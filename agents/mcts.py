@@ -1,162 +1,483 @@
 import numpy as np
 from agents import Agent
+from agents.position import Position
+from agents.stats import SearchStats
+from agents.tree import Tree, UNFINISHED
+from bitboard import BitBoard
 from connectboard import ConnectBoard
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import threading
 import time
 import math
-from random import choice
 
 
-class Node(object):
-    def __init__(self, game_board: np.ndarray):
-        self.state = game_board
-        self.children = None
-        self.value = 0
-        self.visits = 0
-
-    def add_children(self, children: np.ndarray):
-        self.children = [Node(gb) for gb in children]
+def rollout(
+    game_board: np.ndarray, num_rollouts: int, rng: np.random.Generator
+) -> np.ndarray:
+    """Plays random games from game_board in lockstep, and returns their results.
+
+    All games are stored in one array and advanced a move at a time, with each move
+    chosen uniformly from the columns that aren't full. Finished games are masked out
+    until every game is over.
+
+    Args:
+        game_board (np.ndarray): Starting board, with the player who made the last
+            move as 1 and the player to move as -1. Must not be a finished game.
+        num_rollouts (int): Number of games to play.
+        rng (np.random.Generator): Random number generator used to pick moves.
+
+    Returns:
+        Array with the result of each game for the player who made the last move:
+        1 for a win, -1 for a loss and 0 for a tie.
+    """
+    boards = np.repeat(game_board.reshape(1, 42), num_rollouts, axis=0)
+    heights = np.repeat((game_board != 0).sum(axis=0)[np.newaxis], num_rollouts, axis=0)
+    results = np.zeros(num_rollouts)
+    active = np.arange(num_rollouts)
+
+    piece = -1
+    for _ in range(42 - int(heights[0].sum())):
+        # Pick a random open column for each active game
+        choices = rng.random((active.size, 7))
+        choices[heights[active] == 6] = -1
+        cols = choices.argmax(axis=1)
+
+        cells = (5 - heights[active, cols]) * 7 + cols
+        boards[active, cells] = piece
+        heights[active, cols] += 1
+
+        # Check the windows through each new piece for a win
+        windows = boards[
+            active[:, np.newaxis, np.newaxis], ConnectBoard.PADDED_CELL_WINDOWS[cells]
+        ]
+        won = (windows.sum(axis=2) == 4 * piece).any(axis=1)
+
+        results[active[won]] = piece
+        active = active[~won]
+        piece = -piece
+
+        if not active.size:
+            break
+
+    return results
+
+
+def bitboard_rollout(
+    bitboard: BitBoard, num_rollouts: int, rng: np.random.Generator
+) -> np.ndarray:
+    """Plays random games from bitboard one after another, and returns their results.
+
+    The same as rollout, but each game is played on plain python ints. Every random
+    number the games need is drawn in one call up front. Faster than rollout for small
+    batches, where rollout's cost is dominated by the overhead of each numpy call.
+
+    Args:
+        bitboard (BitBoard): Starting position, from the point of view of the player to
+            move. Must not be a finished game.
+        num_rollouts (int): Number of games to play.
+        rng (np.random.Generator): Random number generator used to pick moves.
+
+    Returns:
+        Array with the result of each game for the player who made the last move:
+        1 for a win, -1 for a loss and 0 for a tie.
+    """
+    top, bottom, has_won = BitBoard.TOP, BitBoard.BOTTOM, BitBoard.has_won
+    draws = rng.random((num_rollouts, 42 - bitboard.moves)).tolist()
+    results = np.zeros(num_rollouts)
+
+    for i in range(num_rollouts):
+        current, mask = bitboard.current, bitboard.mask
+        result = -1  # Result if the next move wins, starting with the player to move
+        for r in draws[i]:
+            cols = [col for col in range(7) if not mask & top[col]]
+            col = cols[int(r * len(cols))]
+            current ^= mask
+            mask |= mask + bottom[col]
+            if has_won(current ^ mask):
+                results[i] = result
+                break
+            result = -result
+
+    return results
 
 
 class Mcts(Agent):
-    """Agent that implements Monte Carlo Tree Search to select next move."""
+    """Agent that implements Monte Carlo Tree Search to select next move.
+
+    The tree is stored in a Tree, with node values from the point of view of the player
+    who moved into the node. Boards are not stored. Each simulation plays the moves down
+    the tree on a single Position, and takes them back once the result is propagated.
+    """
 
     NUM_SIMULATIONS = 2000
     EXPLORATION_PARAMETER = np.sqrt(2)
 
-    def select(self, node):
-        path = [node]  # For storing nodes we traverse along the way
-
-        # Loop until we hit a leaf node
-        while node.children is not None:
-            children = node.children
-            max_score = -np.inf
-            new_move = []
-            for child in children:
-                uct_score = self.get_uct_score(child.value, child.visits, node.visits)
-                if uct_score > max_score:
-                    max_score = uct_score
-                    new_move = [child]
-                elif uct_score == max_score:
-                    # Add to list so we can randomly sample from tied states
-                    new_move.append(child)
-
-            # Update node and add to path
-            node = new_move[np.random.randint(0, len(new_move))]
-            path.append(node)
-
-        return node, path
-
-    def expand(self, node):
-        # Create children. Flip state after move since convention is for current player to be 1
-        # and opponent to be -1.
-        node.add_children(-node.state + ConnectBoard.get_legal_moves(node.state))
-        return choice(node.children)
-
-    def simulate(self, node):
-        board = node.state
-        turn = 0
-        while self.get_static_value(board) is None:
-            moves = ConnectBoard.get_legal_moves(board)
-            board = -board + choice(moves)
-            turn += 1
-
-        return self.get_static_value(board) * (-1) ** turn
-
-    def back_propagate(self, path, reward):
-        # Work backwards through path and propagate reward
-        for i, node in enumerate(path[::-1]):
-            node.visits += 1
-            node.value += reward * (-1) ** (i)
+    PARALLEL_MODES = ("root", "tree", "root_thread")
 
-    def get_move(self, game_board):
-        # Initialize root to the current state and populate children.
-        root = Node(game_board)
-
-        for i in range(self.NUM_SIMULATIONS):
-            leaf, path = self.select(root)
-            if self.get_static_value(leaf.state) is not None:
-                # If leaf has static value it has no children. Back prop
-                self.back_propagate(path, self.get_static_value(leaf.state))
-            else:
-                # Leaf has children. Expand and simulate
-                new_leaf = self.expand(leaf)
-                path.append(new_leaf)
+    # Leaves simulated with at least this many rollouts use the vectorized rollout, and
+    # leaves with fewer use bitboard_rollout
+    BATCH_ROLLOUTS = 32
 
-                value = self.simulate(new_leaf)
+    def __init__(
+        self,
+        num_rollouts: int = 16,
+        max_nodes: int = None,
+        reuse_tree: bool = True,
+        workers: int = 1,
+        parallel: str = "root",
+    ) -> None:
+        """Initializes the agent.
 
-                self.back_propagate(path, value)
+        Args:
+            num_rollouts (int, optional): Number of random games played from each new leaf.
+                The games are played as one batch, and the leaf gets their average result.
+            max_nodes (int, optional): Maximum size of the search tree. Defaults to None, for
+                no limit. Once full, leaves are simulated without being expanded.
+            reuse_tree (bool, optional): Whether to keep the part of the search tree that's
+                still reachable between moves. Not used with root parallelism.
+            workers (int, optional): Number of workers to search with.
+            parallel (str, optional): How to split the search between workers when there's
+                more than one. "root" runs an independent search with NUM_SIMULATIONS in each
+                worker process, and adds up their root visit counts. "tree" runs worker
+                threads on a single shared tree, splitting NUM_SIMULATIONS between them.
+                "root_thread" runs the same independent searches as "root" in worker
+                threads instead of processes, so boards and results aren't pickled. Only
+                faster than one worker on free-threaded builds of Python.
+
+        Raises:
+            ValueError: If parallel is not one of PARALLEL_MODES.
+        """
+        if parallel not in Mcts.PARALLEL_MODES:
+            raise ValueError("Unknown parallel mode: {}".format(parallel))
+
+        self.num_rollouts = num_rollouts
+        self.max_nodes = max_nodes
+        self.reuse_tree = reuse_tree
+        self.workers = workers
+        self.parallel = parallel
+        self._rng = np.random.default_rng()
+        self._pool = None  # Process pool for root parallelism, created on first use
+        self.playouts = 0  # Number of random games played during the last move
+        self._max_depth = 0  # Deepest leaf reached during the last move
+        self._phase_times = None
+
+        # Tree from the last search, and the board it was searched from
+        self._tree = None
+        self._root_board = None
+
+    def select(self, tree, position):
+        """Descends from the root to a leaf, choosing the child with the best UCT score at each node.
 
-        # Choose most visited move
-        max_visits = 0
-        max_value = None
-        move = None
+        Args:
+            tree (Tree): The search tree.
+            position (Position): Position at the root. The moves to the leaf are played on it.
 
-        for node in root.children:
-            if node.visits > max_visits:
-                move = abs(node.state + game_board)
-                max_visits = node.visits
-                max_value = node.value
+        Returns:
+            The id of the leaf.
+        """
+        node = 0
 
-        print(f"Found best move with {max_visits} visits and a value of {max_value}")
-        print(move)
+        # Loop until we hit a leaf node
+        while tree.num_children[node]:
+            children = tree.children(node)
+            scores = self.get_uct_score(
+                tree.value[children].tolist(),
+                tree.visits[children].tolist(),
+                float(tree.visits[node]),
+            )
+
+            # Randomly sample from tied children
+            best_score = max(scores)
+            best = [i for i, score in enumerate(scores) if score == best_score]
+            if len(best) > 1:
+                best = best[self._rng.integers(len(best))]
+            else:
+                best = best[0]
 
-        return move
+            node = children.start + best
+            position.play(int(tree.move[node]))
 
-    def get_uct_score(self, w, n, N):
-        """Returns the UCT score of a node with a score of w, n visits and N parent visits.
+        return node
 
-        See: https://en.wikipedia.org/wiki/Monte_Carlo_tree_search#Exploration_and_exploitation
+    def expand(self, tree, node, position):
+        """Adds the children of node to the tree, and moves to a random one.
 
         Args:
-            w (float): Current score of the node being evaluated.
-            n (int): Number of visits to current node.
-            N (int): Number of visits to parent node.
+            tree (Tree): The search tree.
+            node (int): Id of the node to expand.
+            position (Position): Position at node. The move to the chosen child is played on it.
 
         Returns:
-            UCT score as defined above.
+            The id of the chosen child, or node if the tree is full.
         """
-        if not n:
-            # If n is zero, return inf
-            return np.inf
+        moves = [col for col in range(7) if position.can_play(col)]
+        results = position.move_results(moves)
 
-        return w / float(n) + self.EXPLORATION_PARAMETER * np.sqrt(np.log(N) / float(n))
+        first = tree.add_children(node, moves, results=results)
+        if first < 0:
+            return node
 
-    def get_static_value(self, game_board):
-        """Returns the static value of game_board.
+        child = first + self._rng.integers(len(moves))
+        position.play(int(tree.move[child]))
+        return child
 
-        For each possible way to get four in a row, check if the line contains only 1 or -1.
-        If that row contains pieces from only one player, add the sum of their pieces to value.
-        If either player has 4 in a row, return +/- inf.
+    def simulate(self, tree, node, position):
+        if tree.result[node] != UNFINISHED:
+            return tree.result[node]
 
-        TODO: See if this is best? Maybe MCTS shold just use a 1 for win, 0 for tie, -1 for loss.
+        self.playouts += self.num_rollouts
+        return self.playout(position, self._rng)
 
-        Args:
-            game_board (np.ndarray): The current minimax board with maximing player as 1
-                and minimizing player as -1.
+    def playout(self, position, rng):
+        """Returns the average result of num_rollouts random games from position.
+
+        Results are from the point of view of the player who made the last move. Fewer than
+        BATCH_ROLLOUTS games are played one at a time on the position's BitBoard, and more
+        in one vectorized batch.
+        """
+        if self.num_rollouts < self.BATCH_ROLLOUTS:
+            return bitboard_rollout(position.bitboard, self.num_rollouts, rng).mean()
+
+        board = self.last_mover_board(position)
+        return rollout(board, self.num_rollouts, rng).mean()
+
+    @staticmethod
+    def last_mover_board(position):
+        """Returns the board of position with the player who made the last move as 1."""
+        return position.board if position.player == 1 else -position.board
+
+    def get_move(self, game_board):
+        """Returns the most visited move after searching from game_board.
+
+        Statistics of the search are recorded in `stats`. Phase times are only recorded by
+        single threaded searches, including each worker of a root parallel search, since
+        the phases of tree parallel workers overlap.
+        """
+        self.begin_move()
+        start = time.time()
+        root_heights = (game_board != 0).sum(axis=0)
+        self.playouts = 0
+        self._max_depth = 0
+        self._phase_times = None
+
+        if self.workers > 1 and self.parallel in ("root", "root_thread"):
+            visits, values, nodes = self.root_parallel_search(game_board)
+            pv = None
+        else:
+            tree = self.get_tree(game_board)
+            if self.workers > 1:
+                self.tree_parallel_search(tree, game_board)
+            else:
+                self.search(tree, game_board, self.NUM_SIMULATIONS)
+            visits, values = self.root_statistics(tree)
+            nodes = len(tree)
+            pv = tree.principal_variation()
+
+        # Choose most visited move
+        col = int(np.argmax(visits))
+
+        move = np.zeros((6, 7))
+        move[5 - root_heights[col], col] = 1
+
+        self.end_move(
+            SearchStats(
+                "Mcts",
+                move=col,
+                value=values[col] / visits[col],
+                time=time.time() - start,
+                nodes=nodes,
+                depth=self._max_depth,
+                simulations=self.NUM_SIMULATIONS * (self.workers if pv is None else 1),
+                playouts=self.playouts,
+                phase_times=self._phase_times,
+                pv=pv,
+            )
+        )
+        return move
+
+    def search(self, tree, game_board, num_simulations):
+        """Runs num_simulations iterations of MCTS on tree, which is rooted at game_board."""
+        position = Position(game_board)
+        phase_times = {"select": 0.0, "expand": 0.0, "simulate": 0.0, "backprop": 0.0}
+
+        for i in range(num_simulations):
+            t0 = time.perf_counter()
+            leaf = self.select(tree, position)
+            t1 = time.perf_counter()
+            if tree.result[leaf] == UNFINISHED:
+                # Game isn't over at leaf. Expand and simulate
+                leaf = self.expand(tree, leaf, position)
+            t2 = time.perf_counter()
+
+            value = self.simulate(tree, leaf, position)
+            t3 = time.perf_counter()
+            tree.back_propagate(leaf, value)
+            t4 = time.perf_counter()
+
+            phase_times["select"] += t1 - t0
+            phase_times["expand"] += t2 - t1
+            phase_times["simulate"] += t3 - t2
+            phase_times["backprop"] += t4 - t3
+            self._max_depth = max(self._max_depth, len(position.history))
+            position.rewind()
+
+        self._phase_times = phase_times
+
+    def tree_parallel_search(self, tree, game_board):
+        """Runs NUM_SIMULATIONS iterations of MCTS on tree, split between worker threads.
+
+        Selection, expansion and backpropagation happen under a lock, while rollouts run
+        concurrently. A virtual loss is added along the path to each leaf being simulated,
+        so other workers are steered towards different leaves until the result is in.
+        """
+        lock = threading.Lock()
+
+        def work(num_simulations, seed):
+            rng = np.random.default_rng(seed)
+            position = Position(game_board)  # Each worker moves its own position
+
+            for i in range(num_simulations):
+                with lock:
+                    leaf = self.select(tree, position)
+                    if tree.result[leaf] == UNFINISHED:
+                        leaf = self.expand(tree, leaf, position)
+                    result = tree.result[leaf]
+                    tree.add_virtual_loss(leaf)
+                    self._max_depth = max(self._max_depth, len(position.history))
+
+                if result != UNFINISHED:
+                    value = result
+                else:
+                    value = self.playout(position, rng)
+                position.rewind()
+
+                with lock:
+                    tree.remove_virtual_loss(leaf)
+                    tree.back_propagate(leaf, value)
+                    if result == UNFINISHED:
+                        self.playouts += self.num_rollouts
+
+        counts = np.full(self.workers, self.NUM_SIMULATIONS // self.workers)
+        counts[: self.NUM_SIMULATIONS % self.workers] += 1
+        seeds = self._rng.integers(2 ** 32, size=self.workers)
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            for future in [pool.submit(work, *args) for args in zip(counts, seeds)]:
+                future.result()
+
+    def root_parallel_search(self, game_board):
+        """Runs an independent search in each worker, and merges their root statistics.
+
+        Workers are processes, or threads with the "root_thread" parallel mode.
 
         Returns:
-            value (float): The static value of the current position.
+            visits (np.ndarray): Total visits of each column over all searches.
+            values (np.ndarray): Total value of each column over all searches.
+            nodes (int): Total size of the search trees.
         """
-        if (game_board == 0).all():
-            return None
+        if self._pool is None:
+            if self.parallel == "root_thread":
+                self._pool = ThreadPoolExecutor(self.workers)
+            else:
+                self._pool = ProcessPoolExecutor(self.workers)
+
+        seeds = self._rng.integers(2 ** 32, size=self.workers)
+        futures = [
+            self._pool.submit(
+                _root_search, game_board, self.NUM_SIMULATIONS, self.num_rollouts, seed
+            )
+            for seed in seeds
+        ]
+
+        visits = np.zeros(7)
+        values = np.zeros(7)
+        nodes = 0
+        self._phase_times = {}
+        for future in futures:
+            worker_visits, worker_values, stats = future.result()
+            visits += worker_visits
+            values += worker_values
+            nodes += stats.nodes
+            self.playouts += stats.playouts
+            self._max_depth = max(self._max_depth, stats.depth)
+            for phase, seconds in stats.phase_times.items():
+                self._phase_times[phase] = self._phase_times.get(phase, 0.0) + seconds
+
+        return visits, values, nodes
+
+    def root_statistics(self, tree):
+        """Returns the visits and total value of each column at the root of tree, 0 for full columns."""
+        children = tree.children(0)
+        visits = np.zeros(7)
+        values = np.zeros(7)
+        visits[tree.move[children]] = tree.visits[children]
+        values[tree.move[children]] = tree.value[children]
+
+        return visits, values
+
+    def get_tree(self, game_board):
+        """Returns the tree to search game_board with.
+
+        If game_board is one or two moves on from the last search, and those moves are in
+        the last search tree, the subtree they lead to is reused. Otherwise a new tree is
+        started.
+        """
+        moves = None
+        if self.reuse_tree and self._tree is not None:
+            moves = ConnectBoard.find_moves(self._root_board, game_board)
+
+        if moves is None or not self._tree.advance(moves):
+            self._tree = Tree(max_nodes=self.max_nodes)
+        self._root_board = game_board.copy()
 
-        windows = game_board.flatten()[ConnectBoard.WINDOW_INDICES].reshape(-1, 4)
-        uncontested_windows = windows[windows.min(axis=1) != -windows.max(axis=1)]
-        if uncontested_windows.size == 0:
-            return 0
+        return self._tree
 
-        window_sums = uncontested_windows.sum(axis=1)
+    def get_uct_score(self, w, n, N):
+        """Returns the UCT score of nodes with scores w, n visits and N parent visits.
+
+        See: https://en.wikipedia.org/wiki/Monte_Carlo_tree_search#Exploration_and_exploitation
 
-        if window_sums.max() == 4:
-            return 1
-        elif window_sums.min() == -4:
-            return -1
-        elif ConnectBoard.get_legal_moves(game_board).size == 0:
-            return 0
+        Args:
+            w (list[float]): Current score of each node being evaluated.
+            n (list[float]): Number of visits to each node.
+            N (float): Number of visits to parent node.
 
-        return None
+        Returns:
+            List with the UCT score of each node as defined above, and inf for unvisited nodes.
+        """
+        c = self.EXPLORATION_PARAMETER
+        log_N = math.log(N) if N > 0 else 0.0
+        return [
+            w_i / n_i + c * math.sqrt(log_N / n_i) if n_i > 0 else math.inf
+            for w_i, n_i in zip(w, n)
+        ]
 
     def handle_invalid_move(self):
         # Throw exception during development
         # TODO: Add some nice handler later on
         raise Exception
+
+
+def _root_search(game_board, num_simulations, num_rollouts, seed):
+    """Runs a single threaded search in a worker process.
+
+    Returns:
+        The root statistics of the search, and a SearchStats with the size of the tree,
+        the deepest leaf, the number of random games played and the phase times.
+    """
+    agent = Mcts(num_rollouts=num_rollouts, reuse_tree=False)
+    agent._rng = np.random.default_rng(seed)
+
+    tree = agent.get_tree(game_board)
+    agent.search(tree, game_board, num_simulations)
+
+    visits, values = agent.root_statistics(tree)
+    stats = SearchStats(
+        "Mcts",
+        nodes=len(tree),
+        depth=agent._max_depth,
+        simulations=num_simulations,
+        playouts=agent.playouts,
+        phase_times=agent._phase_times,
+    )
+    return visits, values, stats
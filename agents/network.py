@@ -0,0 +1,235 @@
+import numpy as np
+import os
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Epsilon added to the batch norm variance
+BN_EPSILON = 1e-5
+
+
+class Network(object):
+    """Residual convolutional policy/value network, run with plain NumPy on the CPU.
+
+    The architecture is a smaller version of the AlphaGo Zero network:
+        - stem: 3x3 conv, batch norm, relu
+        - blocks.i: residual blocks of two 3x3 convs with batch norm, and a skip
+          connection before the final relu
+        - policy: 1x1 conv, batch norm, relu, then a fully connected layer to 7 logits
+        - value: 1x1 conv, batch norm, relu, then fully connected layers to a hidden
+          layer with relu, and a single output with tanh
+
+    Weights are stored by name, e.g. "blocks.0.conv1.weight", in the same layout as
+    PyTorch: conv weights are (out, in, k, k) and linear weights are (out, in). Convs
+    may have a bias, and their batch norm is stored as ".bn.gamma", ".bn.beta",
+    ".bn.mean" and ".bn.var". Batch norm is folded into the conv weights on load, so
+    inference is just matrix multiplies, adds and relus.
+
+    Activations are kept in (batch, row, col, channel) order, so a 3x3 conv is one
+    matrix multiply of the 3x3 patch around every cell (im2col) with the weights.
+    """
+
+    def __init__(self, weights: dict) -> None:
+        """Initializes the network from a dict of weights. Batch norms are fused if present."""
+        weights = Network.fuse(weights)
+
+        self.num_blocks = 0
+        while "blocks.{}.conv1.weight".format(self.num_blocks) in weights:
+            self.num_blocks += 1
+
+        # View every weight as an (in * k * k, out) matrix. This is a transposed view
+        # rather than a copy, so memory mapped weights stay memory mapped.
+        self._layers = {}
+        for name in [n[: -len(".weight")] for n in weights if n.endswith(".weight")]:
+            weight = np.asarray(weights[name + ".weight"], dtype=np.float32)
+            bias = weights.get(name + ".bias")
+            self._layers[name] = (
+                weight.reshape(weight.shape[0], -1).T,
+                None if bias is None else np.asarray(bias, dtype=np.float32),
+            )
+
+    def evaluate(self, states: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the policy and value of each of a batch of game states.
+
+        Args:
+            states (np.ndarray): Array of shape (N, 2, 6, 7) of game states, in the format
+                returned by AlphaFour.get_game_state.
+
+        Returns:
+            policies (np.ndarray): Array of shape (N, 7), the probability of each move.
+            values (np.ndarray): Array of shape (N,), the value of each state for the
+                player to move, between -1 and 1.
+        """
+        x = np.asarray(states, dtype=np.float32).transpose(0, 2, 3, 1)
+
+        x = relu(self.conv("stem", x))
+        for i in range(self.num_blocks):
+            block = "blocks.{}.".format(i)
+            y = relu(self.conv(block + "conv1", x))
+            x = relu(self.conv(block + "conv2", y) + x)
+
+        policy = relu(self.conv("policy.conv", x))
+        logits = self.linear("policy.fc", flatten(policy))
+
+        value = relu(self.conv("value.conv", x))
+        value = relu(self.linear("value.fc1", flatten(value)))
+        value = np.tanh(self.linear("value.fc2", value))
+
+        return softmax(logits), value[:, 0]
+
+    def conv(self, name: str, x: np.ndarray) -> np.ndarray:
+        """Applies the conv layer called name to x, with zero padding to keep the board size."""
+        weight, bias = self._layers[name]
+        n, h, w, c = x.shape
+        k = int(round(np.sqrt(weight.shape[0] // c)))
+
+        if k == 1:
+            cols = x.reshape(-1, c)
+        else:
+            p = k // 2
+            padded = np.pad(x, ((0, 0), (p, p), (p, p), (0, 0)))
+            # (n, h, w, c, k, k) view of every patch, copied to (n * h * w, c * k * k)
+            patches = sliding_window_view(padded, (k, k), axis=(1, 2))
+            cols = patches.reshape(n * h * w, -1)
+
+        out = cols @ weight
+        if bias is not None:
+            out += bias
+
+        return out.reshape(n, h, w, -1)
+
+    def linear(self, name: str, x: np.ndarray) -> np.ndarray:
+        """Applies the fully connected layer called name to x."""
+        weight, bias = self._layers[name]
+        out = x @ weight
+        if bias is not None:
+            out += bias
+
+        return out
+
+    @staticmethod
+    def fuse(weights: dict) -> dict:
+        """Returns weights with each batch norm folded into the conv before it.
+
+        For a conv with weight W and bias b followed by batch norm, the fused conv has
+        weight W * s and bias (b - mean) * s + beta, where s = gamma / sqrt(var + eps).
+        Weights without batch norm are returned unchanged, without copying.
+        """
+        fused = {}
+        for name, value in weights.items():
+            if ".bn." in name:
+                continue
+
+            layer = name.rsplit(".", 1)[0]
+            if layer + ".bn.gamma" not in weights:
+                fused[name] = value
+                continue
+
+            gamma = weights[layer + ".bn.gamma"]
+            scale = gamma / np.sqrt(weights[layer + ".bn.var"] + BN_EPSILON)
+
+            if name.endswith(".weight"):
+                fused[name] = value * scale[:, np.newaxis, np.newaxis, np.newaxis]
+                bias = weights.get(layer + ".bias", np.zeros_like(scale))
+                fused[layer + ".bias"] = (bias - weights[layer + ".bn.mean"]) * scale + (
+                    weights[layer + ".bn.beta"]
+                )
+
+        return fused
+
+    @staticmethod
+    def load(path: str) -> "Network":
+        """Loads a network saved by save.
+
+        Args:
+            path (str): Either a .npz file, or a directory with one .npy file per weight.
+                Weights in a directory are memory mapped, so processes loading the same
+                weights share them through the page cache instead of each keeping a copy.
+        """
+        if os.path.isdir(path):
+            weights = {
+                f[: -len(".npy")]: np.load(os.path.join(path, f), mmap_mode="r")
+                for f in os.listdir(path)
+                if f.endswith(".npy")
+            }
+        else:
+            with np.load(path) as f:
+                weights = dict(f)
+
+        return Network(weights)
+
+    @staticmethod
+    def save(path: str, weights: dict) -> None:
+        """Saves weights with batch norm fused, to a .npz file or a directory of .npy files.
+
+        Paths ending in .npz are saved as a single compressed file, anything else as a
+        directory that load will memory map.
+        """
+        weights = {
+            k: np.asarray(v, dtype=np.float32) for k, v in Network.fuse(weights).items()
+        }
+
+        if path.endswith(".npz"):
+            np.savez_compressed(path, **weights)
+        else:
+            os.makedirs(path, exist_ok=True)
+            for name, value in weights.items():
+                np.save(os.path.join(path, name + ".npy"), value)
+
+    @staticmethod
+    def init_weights(
+        channels: int = 32,
+        num_blocks: int = 4,
+        value_hidden: int = 64,
+        rng: np.random.Generator = None,
+    ) -> dict:
+        """Returns randomly initialized weights for a network of the given size.
+
+        Args:
+            channels (int, optional): Number of channels in the stem and residual blocks.
+            num_blocks (int, optional): Number of residual blocks.
+            value_hidden (int, optional): Size of the hidden layer of the value head.
+            rng (np.random.Generator, optional): Random number generator to use.
+
+        Returns:
+            Dict of weights by name, with batch norm at its initial identity.
+        """
+        rng = rng if rng is not None else np.random.default_rng()
+        weights = {}
+
+        def conv(name, c_in, c_out, k):
+            std = np.sqrt(2 / (c_in * k * k))
+            weights[name + ".weight"] = rng.normal(0, std, (c_out, c_in, k, k))
+            weights[name + ".bn.gamma"] = np.ones(c_out)
+            weights[name + ".bn.beta"] = np.zeros(c_out)
+            weights[name + ".bn.mean"] = np.zeros(c_out)
+            weights[name + ".bn.var"] = np.ones(c_out)
+
+        def linear(name, n_in, n_out):
+            weights[name + ".weight"] = rng.normal(0, np.sqrt(1 / n_in), (n_out, n_in))
+            weights[name + ".bias"] = np.zeros(n_out)
+
+        conv("stem", 2, channels, 3)
+        for i in range(num_blocks):
+            conv("blocks.{}.conv1".format(i), channels, channels, 3)
+            conv("blocks.{}.conv2".format(i), channels, channels, 3)
+
+        conv("policy.conv", channels, 2, 1)
+        linear("policy.fc", 2 * 42, 7)
+        conv("value.conv", channels, 1, 1)
+        linear("value.fc1", 42, value_hidden)
+        linear("value.fc2", value_hidden, 1)
+
+        return weights
+
+
+def relu(x: np.ndarray) -> np.ndarray:
+    return np.maximum(x, 0, out=x)
+
+
+def flatten(x: np.ndarray) -> np.ndarray:
+    """Flattens (batch, row, col, channel) activations in PyTorch's (channel, row, col) order."""
+    return x.transpose(0, 3, 1, 2).reshape(len(x), -1)
+
+
+def softmax(logits: np.ndarray) -> np.ndarray:
+    e = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return e / e.sum(axis=1, keepdims=True)
@@ -0,0 +1,123 @@
+import numpy as np
+from agents.transposition import ZOBRIST, ZOBRIST_SIDE, zobrist_hash
+from agents.tree import UNFINISHED
+from bitboard import BitBoard
+from symmetry import MIRROR_CELLS
+
+_MIRROR_CELLS = MIRROR_CELLS.tolist()
+
+
+class Position(object):
+    """A position that searches play moves on and take them back, instead of copying boards.
+
+    The position is kept in several forms, all updated in place by play and undo: a 6x7
+    board, the height of each column, a BitBoard for fast win checks, and the Zobrist
+    hashes of the board and its mirror image. Moves are kept on a stack, so undo takes
+    back the last one.
+
+    Pieces are stored by player rather than by whose turn it is: player 0, who is to move
+    in the starting position, has pieces of 1 and player 1 has pieces of -1.
+
+    Attributes:
+        board (np.ndarray): The 6x7 board. Shares memory with the position, so copy it
+            before keeping it.
+        heights (list[int]): Number of pieces in each column.
+        bitboard (BitBoard): The board as a BitBoard, from the point of view of the
+            player to move.
+        key (int): Zobrist hash of the board, see transposition.zobrist_hash.
+        mirror_key (int): Zobrist hash of the mirror image of the board.
+        history (list[int]): Columns played since the starting position.
+    """
+
+    def __init__(self, game_board: np.ndarray) -> None:
+        """Starts from game_board, with 1 for the player to move and -1 for the opponent."""
+        self.board = np.array(game_board, dtype=float)
+        self._flat = self.board.reshape(42)
+        self.heights = [int(h) for h in (self.board != 0).sum(axis=0)]
+        self.bitboard = BitBoard.from_array(self.board)
+        self.key = zobrist_hash(self.board, True)
+        self.mirror_key = zobrist_hash(self.board[:, ::-1], True)
+        self.history = []
+        self.start_ply = sum(self.heights)
+
+    @property
+    def player(self) -> int:
+        """Player to move, 0 or 1."""
+        return len(self.history) % 2
+
+    @property
+    def ply(self) -> int:
+        """Number of pieces on the board."""
+        return self.start_ply + len(self.history)
+
+    def can_play(self, col: int) -> bool:
+        return self.heights[col] < 6
+
+    def legal_moves(self) -> list[int]:
+        """Returns the columns that aren't full, in descending order like ConnectBoard.get_legal_moves."""
+        return [col for col in range(6, -1, -1) if self.heights[col] < 6]
+
+    def cell(self, col: int) -> int:
+        """Returns the flat board index of the square a piece played in col lands on."""
+        return (5 - self.heights[col]) * 7 + col
+
+    def is_winning_move(self, col: int) -> bool:
+        """Returns True if the player to move wins by playing in col."""
+        return self.bitboard.is_winning_move(col)
+
+    def move_results(self, moves: list[int]) -> list[int]:
+        """Returns the result of each of moves for the player to move, as stored in Tree.result.
+
+        Returns:
+            1 for each move that wins the game, 0 for each that fills the board, and
+            UNFINISHED for the rest.
+        """
+        full = self.ply == 41
+        return [
+            1 if self.bitboard.is_winning_move(col) else 0 if full else UNFINISHED
+            for col in moves
+        ]
+
+    def winner(self) -> int:
+        """Returns the player who won with the last move, -1 for a full board, and None otherwise."""
+        result = self.bitboard.winner()
+        if result is None:
+            return None
+        return 1 - self.player if result else -1
+
+    def play(self, col: int) -> int:
+        """Plays col for the player to move, and returns the flat index of the new piece."""
+        player = len(self.history) % 2
+        cell = (5 - self.heights[col]) * 7 + col
+
+        self._flat[cell] = 1 if player == 0 else -1
+        self.heights[col] += 1
+        self.bitboard.play(col)
+        self.key ^= ZOBRIST[player][cell] ^ ZOBRIST_SIDE
+        self.mirror_key ^= ZOBRIST[player][_MIRROR_CELLS[cell]] ^ ZOBRIST_SIDE
+        self.history.append(col)
+
+        return cell
+
+    def undo(self) -> int:
+        """Takes back the last move, and returns its column."""
+        col = self.history.pop()
+        player = len(self.history) % 2
+        self.heights[col] -= 1
+        cell = (5 - self.heights[col]) * 7 + col
+
+        self._flat[cell] = 0
+        self.bitboard.undo(col)
+        self.key ^= ZOBRIST[player][cell] ^ ZOBRIST_SIDE
+        self.mirror_key ^= ZOBRIST[player][_MIRROR_CELLS[cell]] ^ ZOBRIST_SIDE
+
+        return col
+
+    def rewind(self, length: int = 0) -> None:
+        """Takes back moves until only the first length moves of history are left."""
+        while len(self.history) > length:
+            self.undo()
+
+    def state(self) -> np.ndarray:
+        """Returns a copy of the board with 1 for the player to move and -1 for the opponent."""
+        return self.board * (1 if len(self.history) % 2 == 0 else -1)
@@ -0,0 +1,237 @@
+import numpy as np
+from agents import Agent
+from agents.book import OpeningBook
+from agents.stats import SearchStats
+from agents.transposition import LOWER, UPPER, TranspositionTable
+from bitboard import BitBoard, WIDTH, HEIGHT
+import time
+
+
+class Solver(Agent):
+    """Agent that plays perfectly by solving the game from the current position.
+
+    Positions are scored from the point of view of the player to move. A drawn position
+    scores 0. A position the player to move wins scores 22 minus the number of pieces
+    they'll have played when they win, so quicker wins score higher. A lost position
+    scores the negative of the opponent's winning score.
+
+    The search is negamax with alpha-beta pruning on bitboards, using null-window
+    searches to narrow down the exact score and a transposition table to store bounds.
+    An opening book of precomputed scores can be loaded to skip the slowest early game
+    positions, see generate_book.py.
+    """
+
+    # Columns in the order they're searched, center first
+    COLUMN_ORDER = [3, 2, 4, 1, 5, 0, 6]
+
+    def __init__(self, book_path: str = None, tt_size_mb: float = 64) -> None:
+        """Initializes the agent.
+
+        Args:
+            book_path (str, optional): Path to an opening book. Defaults to None, for no book.
+            tt_size_mb (float, optional): Memory budget of the transposition table in megabytes.
+        """
+        self.book = OpeningBook.load(book_path) if book_path else None
+        self.tt = TranspositionTable(tt_size_mb)
+        self.nodes = 0
+
+    def get_move(self, game_board: np.ndarray) -> np.ndarray:
+        """Returns the best move from the current position.
+
+        Solves the position after each legal move and plays the one with the best score.
+        Ties are broken in favour of the center column.
+
+        Args:
+            game_board (np.ndarray): current board with a 1 for current player, -1 for
+                opponent, and 0 for open space
+
+        Returns:
+            An ndarray representing the move, with a 1 in the row,col of the new
+            piece, and all other entries zero.
+        """
+        self.begin_move()
+        self.nodes = 0
+        start = time.time()
+
+        scores = self.analyze(BitBoard.from_array(game_board))
+        col = max(
+            (c for c in Solver.COLUMN_ORDER if scores[c] is not None),
+            key=lambda c: scores[c],
+        )
+
+        self.end_move(
+            SearchStats(
+                "Solver",
+                move=col,
+                value=scores[col],
+                time=time.time() - start,
+                nodes=self.nodes,
+                pv=[col],
+            )
+        )
+
+        move = np.zeros((6, 7))
+        move[np.flatnonzero(game_board[:, col] == 0)[-1], col] = 1
+        return move
+
+    def analyze(self, position: BitBoard) -> list[int]:
+        """Returns the score of each move from position.
+
+        Args:
+            position (BitBoard): Position to analyze. Must not be a finished game.
+
+        Returns:
+            A list with the score of playing in each column, from the point of view of
+            the player making the move, and None for full columns.
+        """
+        scores = [None] * WIDTH
+
+        for col in range(WIDTH):
+            if not position.can_play(col):
+                continue
+            elif position.is_winning_move(col):
+                scores[col] = (WIDTH * HEIGHT + 1 - position.moves) // 2
+            else:
+                position.play(col)
+                scores[col] = -self.solve(position)
+                position.undo(col)
+
+        return scores
+
+    def solve(self, position: BitBoard) -> int:
+        """Returns the exact score of position.
+
+        Repeatedly runs null-window searches, which only determine whether the score is
+        above or below a guess, to binary search for the exact score.
+
+        Args:
+            position (BitBoard): Position to solve. Must not be a finished game.
+
+        Returns:
+            The score of position for the player to move.
+        """
+        if position.can_win_next():
+            return (WIDTH * HEIGHT + 1 - position.moves) // 2
+
+        if self.book is not None:
+            score = self.book.get(position)
+            if score is not None:
+                return score
+
+        low = -((WIDTH * HEIGHT - position.moves) // 2)
+        high = (WIDTH * HEIGHT + 1 - position.moves) // 2
+
+        while low < high:
+            # Search near 0 first, since that's where most scores are
+            med = low + (high - low) // 2
+            if med <= 0 and int(low / 2) < med:
+                med = int(low / 2)
+            elif med >= 0 and high // 2 > med:
+                med = high // 2
+
+            score = self.negamax(position, med, med + 1)
+            if score <= med:
+                high = score
+            else:
+                low = score
+
+        return low
+
+    def negamax(self, position: BitBoard, alpha: int, beta: int) -> int:
+        """Returns a bound on the score of position within the window alpha, beta.
+
+        If the true score is within the window, it's returned exactly. If it's at most
+        alpha, an upper bound that's at most alpha is returned, and if it's at least
+        beta a lower bound that's at least beta is returned.
+
+        Args:
+            position (BitBoard): Position to search. The player to move must not be able
+                to win immediately.
+            alpha (int): Lower end of the window.
+            beta (int): Upper end of the window.
+
+        Returns:
+            The score of position, or a bound on it as described above.
+        """
+        self.nodes += 1
+        moves = position.moves
+
+        possible = position.possible_non_losing_moves()
+        if not possible:
+            # Every move lets the opponent win next turn
+            return -((WIDTH * HEIGHT - moves) // 2)
+
+        # Draw if the board will be full before anyone can win
+        if moves >= WIDTH * HEIGHT - 2:
+            return 0
+
+        # We can't win next turn, and won't lose next turn either
+        lower = -((WIDTH * HEIGHT - 2 - moves) // 2)
+        if alpha < lower:
+            alpha = lower
+            if alpha >= beta:
+                return alpha
+
+        upper = (WIDTH * HEIGHT - 1 - moves) // 2
+        if beta > upper:
+            beta = upper
+            if alpha >= beta:
+                return beta
+
+        if self.book is not None and moves <= self.book.plies:
+            score = self.book.get(position)
+            if score is not None:
+                return score
+
+        key = Solver.hash_key(position.key())
+        entry = self.tt.probe(key)
+        if entry is not None:
+            value, _, bound, _ = entry
+            if bound == LOWER and value > alpha:
+                alpha = int(value)
+            elif bound == UPPER and value < beta:
+                beta = int(value)
+
+            if alpha >= beta:
+                return alpha if bound == LOWER else beta
+
+        # Search moves that create the most new threats first, then closest to center
+        moves_to_search = []
+        for col in Solver.COLUMN_ORDER:
+            move = possible & BitBoard.COLUMN[col]
+            if move:
+                threats = BitBoard.open_winning_squares(
+                    position.current | move, position.mask
+                ).bit_count()
+                moves_to_search.append((-threats, len(moves_to_search), move))
+        moves_to_search.sort()
+
+        for _, _, move in moves_to_search:
+            position.play_move(move)
+            score = -self.negamax(position, -beta, -alpha)
+            position.undo_move(move)
+
+            if score >= beta:
+                self.tt.store(key, score, 0, LOWER, -1)
+                return score
+            if score > alpha:
+                alpha = score
+
+        self.tt.store(key, alpha, 0, UPPER, -1)
+        return alpha
+
+    @staticmethod
+    def hash_key(key: int) -> int:
+        """Mixes the bits of a position key so the low bits vary between positions.
+
+        Position keys only differ in their low bits between positions with different
+        pieces in the first column, so they make poor table indices on their own. This
+        mapping is a bijection, so distinct positions keep distinct keys.
+        """
+        h = (key * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        return ((h >> 32) | (h << 32)) & 0xFFFFFFFFFFFFFFFF
+
+    def handle_invalid_move(self) -> None:
+        # Throw exception during development
+        # TODO: Add some nice handler later on
+        raise Exception
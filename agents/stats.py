@@ -0,0 +1,99 @@
+class SearchStats(object):
+    """Statistics of the search an agent ran to choose a move.
+
+    Fields an agent doesn't track are None.
+
+    Attributes:
+        agent (str): Name of the agent's class.
+        move (int): Column that was chosen.
+        value (float): Value of the move for the agent, in the agent's own units.
+        time (float): Seconds spent choosing the move.
+        nodes (int): Number of nodes visited, or the size of the tree for tree searches.
+        depth (int): Depth of the last completed search, or the deepest leaf reached by
+            tree searches.
+        cutoffs (int): Number of beta cutoffs.
+        simulations (int): Number of tree search simulations.
+        playouts (int): Number of random games played.
+        tt_hit_rate (float): Fraction of transposition table probes that found an entry.
+        cache_hit_rate (float): Fraction of network evaluations answered from the cache.
+        phase_times (dict): Seconds spent in each phase of the search, by phase name.
+        pv (list[int]): Columns of the principal variation, starting with move.
+    """
+
+    def __init__(
+        self,
+        agent: str,
+        move: int = None,
+        value: float = None,
+        time: float = 0.0,
+        nodes: int = 0,
+        depth: int = 0,
+        cutoffs: int = None,
+        simulations: int = None,
+        playouts: int = None,
+        tt_hit_rate: float = None,
+        cache_hit_rate: float = None,
+        phase_times: dict = None,
+        pv: list[int] = None,
+    ) -> None:
+        self.agent = agent
+        self.move = move
+        self.value = value
+        self.time = time
+        self.nodes = nodes
+        self.depth = depth
+        self.cutoffs = cutoffs
+        self.simulations = simulations
+        self.playouts = playouts
+        self.tt_hit_rate = tt_hit_rate
+        self.cache_hit_rate = cache_hit_rate
+        self.phase_times = phase_times
+        self.pv = pv
+
+    @property
+    def nodes_per_second(self) -> float:
+        return self.nodes / self.time if self.time > 0 else 0.0
+
+    @property
+    def branching_factor(self) -> float:
+        """Effective branching factor b, the branching of a uniform tree of depth with nodes nodes."""
+        if not self.depth or not self.nodes:
+            return None
+        return self.nodes ** (1 / self.depth)
+
+    def to_dict(self) -> dict:
+        """Returns the statistics as a dict, e.g. to log as JSON."""
+        stats = dict(vars(self))
+        stats["value"] = None if self.value is None else float(self.value)
+        stats["nodes_per_second"] = self.nodes_per_second
+        stats["branching_factor"] = self.branching_factor
+        return stats
+
+    def __str__(self) -> str:
+        parts = [
+            "{}: column {}".format(self.agent, self.move),
+            "value {}".format(self.value),
+            "depth {}".format(self.depth),
+            "{} nodes in {:.3f}s ({:.0f} nodes/s)".format(
+                self.nodes, self.time, self.nodes_per_second
+            ),
+        ]
+        if self.cutoffs is not None:
+            parts.append("{} cutoffs".format(self.cutoffs))
+        if self.simulations is not None:
+            parts.append("{} simulations".format(self.simulations))
+        if self.playouts is not None:
+            parts.append("{} playouts".format(self.playouts))
+        if self.tt_hit_rate is not None:
+            parts.append("TT hits {:.1%}".format(self.tt_hit_rate))
+        if self.cache_hit_rate is not None:
+            parts.append("cache hits {:.1%}".format(self.cache_hit_rate))
+        if self.phase_times:
+            parts.append(
+                "phases "
+                + " ".join("{} {:.3f}s".format(k, v) for k, v in self.phase_times.items())
+            )
+        if self.pv:
+            parts.append("PV " + " ".join(str(col) for col in self.pv))
+
+        return ", ".join(parts)
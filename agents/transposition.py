@@ -0,0 +1,188 @@
+import numpy as np
+import math
+
+
+# Bound types stored with each entry
+EXACT = 0
+LOWER = 1  # Stored value is a lower bound on the true value (search failed high)
+UPPER = 2  # Stored value is an upper bound on the true value (search failed low)
+
+# Random keys for each (player, square) pair, plus one for the side to move. A fixed
+# seed keeps hashes stable between runs. Stored as python ints since they're
+# combined one at a time during search.
+_rng = np.random.default_rng(0xC4)
+ZOBRIST = [
+    [int(k) for k in _rng.integers(0, 2 ** 63, size=42, dtype=np.int64)]
+    for _ in range(2)
+]
+ZOBRIST_SIDE = int(_rng.integers(0, 2 ** 63, dtype=np.int64))
+
+
+def zobrist_hash(game_board: np.ndarray, max_player: bool = True) -> int:
+    """Returns the Zobrist hash of a position.
+
+    Args:
+        game_board (np.ndarray): 6x7 board with 1 for the maximizing player and -1
+            for the minimizing player.
+        max_player (bool, optional): Whether the maximizing player is to move.
+
+    Returns:
+        The hash as a non-negative python int.
+    """
+    key = 0 if max_player else ZOBRIST_SIDE
+    flat_board = game_board.ravel()
+
+    for cell in np.flatnonzero(flat_board):
+        key ^= ZOBRIST[0 if flat_board[cell] > 0 else 1][cell]
+
+    return key
+
+
+class TranspositionTable(object):
+    """Fixed size hash table of previously searched positions.
+
+    Entries are kept in two preallocated numpy arrays of 64 bit ints, so memory use is
+    fixed when the table is created. They're read and written through memoryviews, so
+    lookups work on plain python ints rather than numpy scalars. Each entry's value,
+    depth, bound, move and generation are packed into one data word, and the slot's key
+    word holds the position's hash XORed with the data. A probe only matches if the two
+    words agree, so a slot that another thread is halfway through overwriting reads as a
+    miss rather than a mix of two entries, and the table can be shared between threads
+    searching at once without a lock. The counters may miss updates when it is.
+
+    Each position maps to a single slot. On a collision, the new entry replaces the old
+    one if the old entry is from a previous search or was searched to a shallower depth.
+    Values are stored as integers, with inf and -inf.
+    """
+
+    # Bytes per entry: key and data words
+    ENTRY_SIZE = 8 + 8
+
+    # Layout of the data word, from the low bits: a used flag, the move plus 1 (4 bits),
+    # the bound (2 bits), the depth (7 bits), the generation (8 bits) and the value
+    # (42 bits, offset so it's non-negative)
+    _MOVE_SHIFT = 1
+    _BOUND_SHIFT = 5
+    _DEPTH_SHIFT = 7
+    _GENERATION_SHIFT = 14
+    _VALUE_SHIFT = 22
+    _VALUE_OFFSET = 1 << 40
+    _VALUE_INF = (1 << 42) - 1  # Value of a stored inf, with 0 for -inf
+
+    def __init__(self, size_mb: float = 16) -> None:
+        """Allocates a table using at most size_mb megabytes."""
+        num_entries = max(1, int(size_mb * 2 ** 20) // self.ENTRY_SIZE)
+        self.size = 1 << (num_entries.bit_length() - 1)  # Round down to power of 2
+
+        self._keys = self._allocate(self.size)
+        self._data = self._allocate(self.size)
+
+        self._generation = 0
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.replacements = 0
+
+    def new_search(self) -> None:
+        """Marks all existing entries as belonging to a previous search."""
+        self._generation = (self._generation + 1) % 256
+
+    def probe(self, key: int) -> tuple[float, int, int, int]:
+        """Looks up a position.
+
+        Args:
+            key (int): Zobrist hash of the position.
+
+        Returns:
+            A tuple of (value, depth, bound, move) if the position is stored, where
+            move is the column of the best move or -1 if unknown. None otherwise.
+        """
+        self.probes += 1
+        idx = key & (self.size - 1)
+        data = self._data[idx]
+
+        if not data & 1 or self._keys[idx] ^ data != key:
+            return None
+
+        self.hits += 1
+        value = data >> self._VALUE_SHIFT
+        if value == self._VALUE_INF:
+            value = math.inf
+        elif value == 0:
+            value = -math.inf
+        else:
+            value -= self._VALUE_OFFSET
+
+        return (
+            value,
+            (data >> self._DEPTH_SHIFT) & 0x7F,
+            (data >> self._BOUND_SHIFT) & 0x3,
+            ((data >> self._MOVE_SHIFT) & 0xF) - 1,
+        )
+
+    def store(self, key: int, value: float, depth: int, bound: int, move: int) -> None:
+        """Stores the result of searching a position, subject to the replacement policy.
+
+        Args:
+            key (int): Zobrist hash of the position.
+            value (float): Value found by the search. Must be a whole number smaller
+                than 2 ** 40 in size, or inf or -inf.
+            depth (int): Remaining depth the position was searched to.
+            bound (int): One of EXACT, LOWER or UPPER.
+            move (int): Column of the best move found, or -1 if none.
+        """
+        idx = key & (self.size - 1)
+        depth = min(depth, 127)
+        old = self._data[idx]
+
+        if old & 1 and self._keys[idx] ^ old != key:
+            same_search = (old >> self._GENERATION_SHIFT) & 0xFF == self._generation
+            if same_search and (old >> self._DEPTH_SHIFT) & 0x7F > depth:
+                return
+            self.replacements += 1
+
+        if value == math.inf:
+            value = self._VALUE_INF
+        elif value == -math.inf:
+            value = 0
+        else:
+            value = int(value) + self._VALUE_OFFSET
+
+        data = (
+            1
+            | (move + 1) << self._MOVE_SHIFT
+            | bound << self._BOUND_SHIFT
+            | depth << self._DEPTH_SHIFT
+            | self._generation << self._GENERATION_SHIFT
+            | value << self._VALUE_SHIFT
+        )
+
+        self.stores += 1
+        self._data[idx] = data
+        self._keys[idx] = key ^ data
+
+    def hit_rate(self) -> float:
+        """Returns the fraction of probes that found their position."""
+        return self.hits / self.probes if self.probes else 0.0
+
+    def stats(self) -> dict:
+        """Returns the table's usage counters."""
+        return {
+            "size": self.size,
+            "probes": self.probes,
+            "hits": self.hits,
+            "hit_rate": self.hit_rate(),
+            "stores": self.stores,
+            "replacements": self.replacements,
+        }
+
+    def clear(self) -> None:
+        """Removes all entries and resets the counters."""
+        self._keys = self._allocate(self.size)
+        self._data = self._allocate(self.size)
+        self.probes = self.hits = self.stores = self.replacements = 0
+
+    @staticmethod
+    def _allocate(size: int) -> memoryview:
+        # Zeroed numpy arrays are allocated lazily, so a large table is free to create
+        return memoryview(np.zeros(size, dtype=np.uint64)).cast("B").cast("Q")
@@ -0,0 +1,252 @@
+import numpy as np
+
+# Value of Tree.result for nodes where the game is not over
+UNFINISHED = -128
+
+
+class Tree(object):
+    """Search tree stored as a set of preallocated numpy arrays indexed by node id.
+
+    Nodes don't store a board. Each node stores the column of the move that led to
+    it, so the board at any node can be rebuilt by replaying moves on the way down
+    from the root. The children of a node are stored next to each other, starting at
+    first_child, so their statistics can be read as array slices.
+
+    The arrays grow geometrically as nodes are added, up to max_nodes. Node 0 is the
+    root.
+
+    Attributes:
+        parent (np.ndarray): Id of each node's parent, -1 for the root.
+        move (np.ndarray): Column of the move leading to each node, -1 for the root.
+        first_child (np.ndarray): Id of each node's first child.
+        num_children (np.ndarray): Number of children of each node, 0 if not expanded.
+        visits (np.ndarray): Number of times each node was visited.
+        value (np.ndarray): Total value of each node over all visits.
+        prior (np.ndarray): Prior probability of the move leading to each node.
+        result (np.ndarray): Result of the game at each node if it's over, otherwise
+            UNFINISHED. Agents choose the point of view the result is stored from.
+    """
+
+    _FIELDS = (
+        "parent",
+        "move",
+        "first_child",
+        "num_children",
+        "visits",
+        "value",
+        "prior",
+        "result",
+    )
+
+    def __init__(self, capacity: int = 1024, max_nodes: int = None) -> None:
+        """Initializes a tree with only a root.
+
+        Args:
+            capacity (int, optional): Number of nodes to allocate space for up front.
+            max_nodes (int, optional): Maximum number of nodes. Defaults to None, for no
+                limit. Once reached, add_children stops adding nodes.
+        """
+        self.max_nodes = max_nodes
+        self.parent = np.empty(capacity, dtype=np.int32)
+        self.move = np.empty(capacity, dtype=np.int8)
+        self.first_child = np.empty(capacity, dtype=np.int32)
+        self.num_children = np.empty(capacity, dtype=np.int8)
+        self.visits = np.empty(capacity, dtype=np.float64)
+        self.value = np.empty(capacity, dtype=np.float64)
+        self.prior = np.empty(capacity, dtype=np.float32)
+        self.result = np.empty(capacity, dtype=np.int8)
+
+        self.size = 0
+        self._add_nodes(-1, [-1])
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def capacity(self) -> int:
+        return self.parent.size
+
+    def children(self, node: int) -> slice:
+        """Returns the slice of node ids holding the children of node."""
+        first = self.first_child[node]
+        return slice(first, first + self.num_children[node])
+
+    def add_children(
+        self,
+        node: int,
+        moves: list[int],
+        priors: np.ndarray = None,
+        results: list[int] = None,
+    ) -> int:
+        """Expands node by adding a child for each of the given moves.
+
+        Args:
+            node (int): Id of the node to expand.
+            moves (list[int]): Column of each child's move.
+            priors (np.ndarray, optional): Prior probability of each move.
+            results (list[int], optional): Result of the game after each move, or
+                UNFINISHED if it's not over.
+
+        Returns:
+            The id of the first child, or -1 if the tree is full and node was not expanded.
+        """
+        if self.max_nodes is not None and self.size + len(moves) > self.max_nodes:
+            return -1
+
+        first = self._add_nodes(node, moves, priors, results)
+        self.first_child[node] = first
+        self.num_children[node] = len(moves)
+
+        return first
+
+    def find_child(self, node: int, move: int) -> int:
+        """Returns the id of the child of node reached by move, or -1 if there isn't one."""
+        children = self.children(node)
+        idx = np.flatnonzero(self.move[children] == move)
+
+        return children.start + int(idx[0]) if idx.size else -1
+
+    def principal_variation(self) -> list[int]:
+        """Returns the columns of the line of play that follows the most visited child from the root."""
+        pv = []
+        node = 0
+        while self.num_children[node]:
+            children = self.children(node)
+            node = children.start + int(self.visits[children].argmax())
+            if self.visits[node] <= 0:
+                break
+            pv.append(int(self.move[node]))
+
+        return pv
+
+    def advance(self, moves: list[int]) -> bool:
+        """Follows moves down from the root, and makes the node reached the new root.
+
+        Args:
+            moves (list[int]): Columns of the moves to follow.
+
+        Returns:
+            True if the tree was rerooted, or False and the tree is unchanged if the moves
+            lead outside of the tree.
+        """
+        node = 0
+        for move in moves:
+            node = self.find_child(node, move)
+            if node < 0:
+                return False
+
+        self.reroot(node)
+        return True
+
+    def reroot(self, node: int) -> None:
+        """Makes node the root, discarding every node that isn't in its subtree.
+
+        The subtree is copied to the start of the arrays in breadth first order, which
+        keeps the children of each node next to each other. Statistics of the kept nodes
+        are unchanged.
+        """
+        # Collect the subtree one level at a time
+        levels = [np.array([node])]
+        while True:
+            frontier = levels[-1]
+            frontier = frontier[self.num_children[frontier] > 0]
+            if not frontier.size:
+                break
+
+            counts = self.num_children[frontier].astype(np.int64)
+            starts = self.first_child[frontier].astype(np.int64)
+
+            # Concatenate the ranges first_child[i]:first_child[i] + counts[i]
+            offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+            levels.append(offsets + np.arange(counts.sum()))
+
+        old_ids = np.concatenate(levels)
+        new_ids = np.full(self.size, -1, dtype=np.int32)
+        new_ids[old_ids] = np.arange(old_ids.size)
+
+        for name in Tree._FIELDS:
+            getattr(self, name)[: old_ids.size] = getattr(self, name)[old_ids]
+
+        self.size = old_ids.size
+
+        # Translate the links between nodes to the new ids
+        first_child = self.first_child[: self.size]
+        expanded = self.num_children[: self.size] > 0
+        first_child[expanded] = new_ids[first_child[expanded]]
+        first_child[~expanded] = -1
+
+        self.parent[1 : self.size] = new_ids[self.parent[1 : self.size]]
+        self.parent[0] = -1
+        self.move[0] = -1
+
+    def _add_nodes(
+        self,
+        parent: int,
+        moves: list[int],
+        priors: np.ndarray = None,
+        results: list[int] = None,
+    ) -> int:
+        """Appends nodes with the given parent and returns the id of the first."""
+        first = self.size
+        end = first + len(moves)
+        if end > self.capacity:
+            self._grow(end)
+
+        self.parent[first:end] = parent
+        self.move[first:end] = moves
+        self.first_child[first:end] = -1
+        self.num_children[first:end] = 0
+        self.visits[first:end] = 0
+        self.value[first:end] = 0
+        self.prior[first:end] = 0 if priors is None else priors
+        self.result[first:end] = UNFINISHED if results is None else results
+
+        self.size = end
+        return first
+
+    def _grow(self, min_capacity: int) -> None:
+        """Reallocates every array with at least double the capacity."""
+        capacity = max(2 * self.capacity, min_capacity)
+        if self.max_nodes is not None:
+            capacity = max(min(capacity, self.max_nodes), min_capacity)
+
+        for name in Tree._FIELDS:
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[: self.size] = old[: self.size]
+            setattr(self, name, new)
+
+    def back_propagate(self, node: int, reward: float) -> None:
+        """Adds a visit with the given reward to node and each of its ancestors.
+
+        The reward is from the point of view of the player who moved into node, and
+        alternates sign at each level up the tree, so every node's value is from the
+        point of view of the player who moved into it.
+        """
+        while node >= 0:
+            self.visits[node] += 1
+            self.value[node] += reward
+            reward = -reward
+            node = self.parent[node]
+
+    def add_virtual_loss(self, node: int, loss: float = 1) -> None:
+        """Adds a visit with a loss to node and each of its ancestors, for a pending simulation.
+
+        Used by parallel searches, so other workers avoid the path until the simulation
+        finishes and the loss is removed with remove_virtual_loss.
+        """
+        while node >= 0:
+            self.visits[node] += 1
+            self.value[node] -= loss
+            node = self.parent[node]
+
+    def remove_virtual_loss(self, node: int, loss: float = 1) -> None:
+        """Removes a virtual loss added with add_virtual_loss."""
+        while node >= 0:
+            self.visits[node] -= 1
+            self.value[node] += loss
+            node = self.parent[node]
+
+    def nbytes(self) -> int:
+        """Returns the memory allocated by the tree, in bytes."""
+        return sum(getattr(self, name).nbytes for name in Tree._FIELDS)
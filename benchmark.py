@@ -0,0 +1,261 @@
+from agents import AlphaBeta, Mcts, AlphaFour
+from connectboard import ConnectBoard
+from vector_env import VectorEnv, random_policy
+import numpy as np
+import argparse
+import json
+import platform
+import sys
+import time
+
+# Test positions, as the columns played from the empty board. None of them are over,
+# and the player to move can't win immediately.
+POSITIONS = {
+    "opening": ["", "31", "5421", "536562"],
+    "midgame": ["41565323454124", "630625330551623226", "1233241631105160626426"],
+    "endgame": [
+        "536465016511251663501232524106",
+        "1363440653666442611150110033244302",
+        "64416114630536430361652115544302553000",
+    ],
+}
+
+
+def get_board(moves: str) -> np.ndarray:
+    """Returns the board after moves, from the point of view of the player to move."""
+    board = ConnectBoard()
+    for i, col in enumerate(moves):
+        col = int(col)
+        move = np.zeros((6, 7))
+        move[np.flatnonzero(board.current_state()[:, col] == 0)[-1], col] = 1
+        board.make_move(move if i % 2 == 0 else -move)
+
+    return board.current_state() * (1 if len(moves) % 2 == 0 else -1)
+
+
+def corpus() -> list[np.ndarray]:
+    """Returns the board of every test position."""
+    return [get_board(moves) for phase in POSITIONS.values() for moves in phase]
+
+
+def rate(func, min_time: float) -> float:
+    """Returns how many times per second func runs, calling it for at least min_time seconds."""
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        func()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return calls / elapsed
+
+
+def bench_legal_moves(boards: list[np.ndarray], min_time: float) -> float:
+    def run():
+        for board in boards:
+            ConnectBoard.get_legal_moves(board)
+
+    return rate(run, min_time) * len(boards)
+
+
+def bench_get_winner(boards: list[np.ndarray], min_time: float) -> float:
+    def run():
+        for board in boards:
+            ConnectBoard.get_winner(board)
+
+    return rate(run, min_time) * len(boards)
+
+
+def bench_vector_env(num_envs: int, min_time: float) -> float:
+    env = VectorEnv(num_envs)
+    rng = np.random.default_rng(0)
+    states, legal = env.reset()
+
+    def run():
+        nonlocal states, legal
+        states, legal, _, _ = env.step(random_policy(states, legal, rng))
+
+    return rate(run, min_time) * num_envs
+
+
+def bench_alphabeta(boards: list[np.ndarray], depth: int) -> float:
+    nodes = 0
+    start = time.perf_counter()
+    for board in boards:
+        agent = AlphaBeta(max_depth=depth)
+        agent.get_move(board)
+        nodes += agent.nodes
+
+    return nodes / (time.perf_counter() - start)
+
+
+def bench_mcts(boards: list[np.ndarray], simulations: int) -> float:
+    playouts = 0
+    start = time.perf_counter()
+    for board in boards:
+        agent = Mcts(reuse_tree=False)
+        agent.NUM_SIMULATIONS = simulations
+        agent.get_move(board)
+        playouts += agent.playouts
+
+    return playouts / (time.perf_counter() - start)
+
+
+def bench_alphafour(boards: list[np.ndarray], simulations: int) -> float:
+    start = time.perf_counter()
+    for board in boards:
+        agent = AlphaFour(reuse_tree=False)
+        agent._NUM_MCTS = simulations
+        agent.get_move(board)
+
+    return simulations * len(boards) / (time.perf_counter() - start)
+
+
+# Name, unit, and function of each benchmark, given the corpus and whether to run quickly
+BENCHMARKS = [
+    (
+        "board.get_legal_moves",
+        "calls/s",
+        lambda boards, quick: bench_legal_moves(boards, 0.2 if quick else 1),
+    ),
+    (
+        "board.get_winner",
+        "calls/s",
+        lambda boards, quick: bench_get_winner(boards, 0.2 if quick else 1),
+    ),
+    (
+        "vector_env.moves",
+        "moves/s",
+        lambda boards, quick: bench_vector_env(1024, 0.2 if quick else 1),
+    ),
+    (
+        "alphabeta.nodes",
+        "nodes/s",
+        lambda boards, quick: bench_alphabeta(boards, 3 if quick else 5),
+    ),
+    (
+        "mcts.playouts",
+        "playouts/s",
+        lambda boards, quick: bench_mcts(boards, 100 if quick else 500),
+    ),
+    (
+        "alphafour.simulations",
+        "simulations/s",
+        lambda boards, quick: bench_alphafour(boards, 50 if quick else 200),
+    ),
+]
+
+
+def run(names: list[str] = None, repeat: int = 3, quick: bool = False) -> dict:
+    """Runs the benchmarks and returns their results.
+
+    Each benchmark runs repeat times over every test position, and the best rate is kept,
+    since slower runs are slowed down by something other than the code being measured.
+
+    Args:
+        names (list[str], optional): Benchmarks to run. Defaults to all of them.
+        repeat (int, optional): Number of times to run each benchmark.
+        quick (bool, optional): Whether to run shorter, noisier versions of each benchmark.
+
+    Returns:
+        Dict with the rate of each benchmark by name, and the environment they ran in.
+    """
+    boards = corpus()
+    results = {}
+
+    for name, unit, bench in BENCHMARKS:
+        if names and name not in names:
+            continue
+
+        rates = [bench(boards, quick) for _ in range(repeat)]
+
+        results[name] = {"value": max(rates), "unit": unit}
+        print("{:<24}{:>16,.0f} {}".format(name, max(rates), unit))
+
+    return {
+        "benchmarks": results,
+        "quick": quick,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Compares results to a baseline, and returns the benchmarks that got slower.
+
+    Args:
+        results (dict): Results from run.
+        baseline (dict): Earlier results from run.
+        tolerance (float): Fraction a benchmark's rate can drop by before it counts as a
+            regression, to allow for noise.
+
+    Returns:
+        The names of the benchmarks that regressed.
+    """
+    regressions = []
+    print()
+    if results["quick"] != baseline["quick"]:
+        print("Warning: comparing quick and full benchmark runs")
+    print("{:<24}{:>16}{:>16}{:>10}".format("Benchmark", "Baseline", "Current", "Change"))
+
+    for name, result in results["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            continue
+
+        old = baseline["benchmarks"][name]["value"]
+        new = result["value"]
+        change = new / old - 1
+        regressed = change < -tolerance
+        if regressed:
+            regressions.append(name)
+
+        print(
+            "{:<24}{:>16,.0f}{:>16,.0f}{:>+10.1%}{}".format(
+                name, old, new, change, "  REGRESSION" if regressed else ""
+            )
+        )
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark board operations and search throughput."
+    )
+    parser.add_argument(
+        "-b",
+        "--benchmark",
+        action="append",
+        choices=[name for name, _, _ in BENCHMARKS],
+        help="Benchmark to run. Can be given more than once. Defaults to all",
+    )
+    parser.add_argument("-o", "--output", default=None, help="File to write results to")
+    parser.add_argument(
+        "--baseline", default=None, help="Results to compare against, from --output"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Fraction a benchmark can slow down by before failing",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--quick", action="store_true", help="Run shorter benchmarks")
+
+    args = parser.parse_args()
+
+    results = run(args.benchmark, args.repeat, args.quick)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\n{} benchmark(s) regressed".format(len(regressions)))
+            sys.exit(1)
@@ -0,0 +1,220 @@
+import numpy as np
+
+WIDTH = 7
+HEIGHT = 6
+H1 = HEIGHT + 1  # Bits per column, including the sentinel row
+
+
+class BitBoard(object):
+    """Integer bitboard implementation of a Connect Four position.
+
+    The position is stored as two integers: `current`, with a bit set for every
+    piece belonging to the player whose turn it is, and `mask`, with a bit set
+    for every occupied square. Each column uses 7 bits (6 playable rows plus an
+    empty sentinel row on top), with bit `col * 7 + row` for the square in
+    column `col` and row `row`, counting rows from the bottom of the board.
+
+    Unlike the 6x7 arrays used by ConnectBoard, every operation here is a handful
+    of integer ops with no allocation, which makes it suitable for search.
+    """
+
+    __slots__ = ("current", "mask", "moves")
+
+    # Bit of the bottom square in each column, and of the top playable square
+    BOTTOM = [1 << (col * H1) for col in range(WIDTH)]
+    TOP = [1 << (HEIGHT - 1 + col * H1) for col in range(WIDTH)]
+    COLUMN = [((1 << HEIGHT) - 1) << (col * H1) for col in range(WIDTH)]
+
+    BOTTOM_MASK = sum(BOTTOM)
+    BOARD_MASK = BOTTOM_MASK * ((1 << HEIGHT) - 1)
+
+    def __init__(self, current: int = 0, mask: int = 0, moves: int = 0) -> None:
+        """Initializes a position. Defaults to the empty board."""
+        self.current = current
+        self.mask = mask
+        self.moves = moves
+
+    def copy(self) -> "BitBoard":
+        """Returns an independent copy of this position."""
+        return BitBoard(self.current, self.mask, self.moves)
+
+    def can_play(self, col: int) -> bool:
+        """Returns True if col is not full."""
+        return not self.mask & BitBoard.TOP[col]
+
+    def play(self, col: int) -> None:
+        """Drops a piece for the current player in col, then switches players.
+
+        The column is assumed to be playable, see can_play.
+        """
+        self.current ^= self.mask
+        self.mask |= self.mask + BitBoard.BOTTOM[col]
+        self.moves += 1
+
+    def play_move(self, move: int) -> None:
+        """Plays the move given as a single bit on the square the piece lands on."""
+        self.current ^= self.mask
+        self.mask |= move
+        self.moves += 1
+
+    def undo(self, col: int) -> None:
+        """Takes back the last move, which must have been played in col."""
+        column = self.mask & BitBoard.COLUMN[col]
+        self.undo_move((column + BitBoard.BOTTOM[col]) >> 1)
+
+    def undo_move(self, move: int) -> None:
+        """Takes back the last move, given as a single bit on the square it was played on."""
+        self.mask ^= move
+        self.current ^= self.mask
+        self.moves -= 1
+
+    def possible(self) -> int:
+        """Returns a bitmask with a bit set on the square each legal move lands on."""
+        return (self.mask + BitBoard.BOTTOM_MASK) & BitBoard.BOARD_MASK
+
+    def legal_moves(self) -> list[int]:
+        """Returns the list of columns that are not full."""
+        possible = self.possible()
+        return [col for col in range(WIDTH) if possible & BitBoard.COLUMN[col]]
+
+    def is_winning_move(self, col: int) -> bool:
+        """Returns True if the current player wins by playing in col."""
+        move = (self.mask + BitBoard.BOTTOM[col]) & BitBoard.COLUMN[col]
+        return BitBoard.has_won(self.current | move)
+
+    def can_win_next(self) -> bool:
+        """Returns True if the current player has a winning move."""
+        return bool(self.winning_positions() & self.possible())
+
+    def winning_positions(self) -> int:
+        """Returns a bitmask of the open squares that would complete four for the current player."""
+        return BitBoard.open_winning_squares(self.current, self.mask)
+
+    def opponent_winning_positions(self) -> int:
+        """Returns a bitmask of the open squares that would complete four for the opponent."""
+        return BitBoard.open_winning_squares(self.current ^ self.mask, self.mask)
+
+    def possible_non_losing_moves(self) -> int:
+        """Returns a bitmask of the legal moves that don't let the opponent win next turn.
+
+        Assumes the current player can't win immediately. If the opponent threatens
+        to win, the only non-losing move is to block, and if they have two threats
+        every move loses. Moves directly below an opponent threat are never safe.
+        """
+        possible = self.possible()
+        opponent_win = self.opponent_winning_positions()
+        forced_moves = possible & opponent_win
+
+        if forced_moves:
+            if forced_moves & (forced_moves - 1):
+                return 0
+            possible = forced_moves
+
+        return possible & ~(opponent_win >> 1)
+
+    def winner(self) -> int:
+        """Returns the result of the game from the point of view of the current player.
+
+        Returns:
+            -1 if the previous player completed four in a row, 0 for a full board
+            and None if the game is still in progress. The current player can
+            never have won, since the opponent made the last move.
+        """
+        if BitBoard.has_won(self.current ^ self.mask):
+            return -1
+        elif self.moves == WIDTH * HEIGHT:
+            return 0
+
+        return None
+
+    def key(self) -> int:
+        """Returns a unique integer key for this position."""
+        return self.current + self.mask
+
+    def to_array(self) -> np.ndarray:
+        """Returns the 6x7 board with a 1 for the current player and -1 for the opponent."""
+        game_board = np.zeros((HEIGHT, WIDTH))
+        opponent = self.current ^ self.mask
+
+        for col in range(WIDTH):
+            for row in range(HEIGHT):
+                bit = 1 << (col * H1 + row)
+                if self.current & bit:
+                    game_board[HEIGHT - 1 - row, col] = 1
+                elif opponent & bit:
+                    game_board[HEIGHT - 1 - row, col] = -1
+
+        return game_board
+
+    @staticmethod
+    def from_array(game_board: np.ndarray) -> "BitBoard":
+        """Builds a position from a 6x7 board.
+
+        Args:
+            game_board (np.ndarray): Board with a 1 for the player to move, -1 for
+                the opponent and 0 for open spaces. Row 0 is the top of the board.
+
+        Returns:
+            The equivalent BitBoard.
+        """
+        current, mask, moves = 0, 0, 0
+
+        for col in range(WIDTH):
+            for row in range(HEIGHT):
+                value = game_board[HEIGHT - 1 - row, col]
+                if value:
+                    bit = 1 << (col * H1 + row)
+                    mask |= bit
+                    moves += 1
+                    if value > 0:
+                        current |= bit
+
+        return BitBoard(current, mask, moves)
+
+    @staticmethod
+    def open_winning_squares(position: int, mask: int) -> int:
+        """Returns a bitmask of the open squares that would complete four for position.
+
+        Args:
+            position (int): Bitmask of one player's pieces.
+            mask (int): Bitmask of all occupied squares.
+
+        Returns:
+            Bitmask of the unoccupied squares, playable or not, that complete four in a
+            row with the pieces in position.
+        """
+        # Vertical, only possible with three pieces directly below
+        r = (position << 1) & (position << 2) & (position << 3)
+
+        # Horizontal, then both diagonals. Checks for a gap at either end of three
+        # pieces, and in either of the two inner spots.
+        for shift in (H1, H1 - 1, H1 + 1):
+            p = (position << shift) & (position << 2 * shift)
+            r |= p & (position << 3 * shift)
+            r |= p & (position >> shift)
+            p = (position >> shift) & (position >> 2 * shift)
+            r |= p & (position << shift)
+            r |= p & (position >> 3 * shift)
+
+        return r & (BitBoard.BOARD_MASK ^ mask)
+
+    @staticmethod
+    def has_won(position: int) -> bool:
+        """Returns True if the given single player bitmask contains four in a row."""
+        # Horizontal, diagonal (both directions) and vertical, in that order
+        for shift in (H1, H1 - 1, H1 + 1, 1):
+            pairs = position & (position >> shift)
+            if pairs & (pairs >> (2 * shift)):
+                return True
+
+        return False
+
+    def __eq__(self, other: object) -> bool:
+        return (
+            isinstance(other, BitBoard)
+            and self.current == other.current
+            and self.mask == other.mask
+        )
+
+    def __hash__(self) -> int:
+        return self.key()
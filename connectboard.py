@@ -1,6 +1,4 @@
-from os import stat
 import numpy as np
-from agents import Agent, Human
 
 
 class InvalidMoveException(Exception):
@@ -9,6 +7,38 @@ class InvalidMoveException(Exception):
     pass
 
 
+def _windows_by_cell(window_indices: np.ndarray) -> list[np.ndarray]:
+    """Groups the 4-in-a-row windows by the cells they pass through.
+
+    Args:
+        window_indices (np.ndarray): Flat array of window indices, four per window.
+
+    Returns:
+        A list with one entry per cell of the flattened board. Each entry is an
+        array of shape (n, 4) holding the windows that include that cell.
+    """
+    windows = window_indices.reshape(-1, 4)
+    return [windows[(windows == cell).any(axis=1)] for cell in range(42)]
+
+
+def _pad_windows(cell_windows: list[np.ndarray]) -> np.ndarray:
+    """Pads each cell's windows to the same length by repeating its first window.
+
+    Args:
+        cell_windows (list[np.ndarray]): Windows through each cell.
+
+    Returns:
+        An array of shape (42, n, 4), where n is the most windows through any one cell.
+    """
+    length = max(len(w) for w in cell_windows)
+    return np.array(
+        [
+            np.concatenate([w, np.repeat(w[:1], length - len(w), axis=0)])
+            for w in cell_windows
+        ]
+    )
+
+
 class ConnectBoard(object):
     """An instance of a Connect Four game board.
 
@@ -43,6 +73,15 @@ class ConnectBoard(object):
         7,15,23,31,    8,16,24,32,    9,17,25,33,    10,18,26,34, # Row 2-5
         14,22,30,38,   15,23,31,39,   16,24,32,40,   17,25,33,41  # Row 3-6
     ])
+    # fmt: on
+
+    # Windows through each cell, so a new piece only has to check the (at most 13)
+    # windows it can complete rather than all 69.
+    CELL_WINDOWS = _windows_by_cell(WINDOW_INDICES)
+
+    # CELL_WINDOWS padded to the same length by repeating each cell's first window, so
+    # win checks can be vectorized across boards with different last moves.
+    PADDED_CELL_WINDOWS = _pad_windows(CELL_WINDOWS)
 
 
     def __init__(self) -> None:
@@ -51,6 +90,9 @@ class ConnectBoard(object):
         # Store game state. Board stores 1 for player1 and -1 for player 2
         self._game_board = np.zeros((6,7))
 
+        # Result of the game, updated after every move
+        self._winner = None
+
 
     def current_state(self) -> np.ndarray:
         """Returns the current game board."""
@@ -64,6 +106,9 @@ class ConnectBoard(object):
 
         self._game_board += move
 
+        row, col = divmod(int(np.argmax(abs(move))), 7)
+        self._winner = ConnectBoard.winner_after_move(self._game_board, row, col)
+
 
     def winner(self) -> int:
         """Returns the winner/value of the game board.
@@ -76,7 +121,7 @@ class ConnectBoard(object):
             1 if player1 has won, 2 if player2 has won, 0 for a tie, and None for
             a state that doesn't end the game.
         """
-        return ConnectBoard.get_winner(self.current_state())
+        return self._winner
 
 
     def _validate_move(self, move: np.ndarray) -> bool:
@@ -137,19 +182,82 @@ class ConnectBoard(object):
                 game_board. Each move is a 2D game board with the location 
                 of the new piece as a 1, and all other squares as 0.
         """
-        legal_moves = np.ndarray(0)
-
-        rows = (5 - abs(game_board).sum(axis=0)).astype(int)
-        for col in range(7):
-            if rows[col] >= 0:
-                move = np.zeros((6,7))
-                move[rows[col], col] = 1
-                legal_moves = np.append(move, legal_moves)
+        # Height of each column, and the open columns from right to left
+        heights = np.count_nonzero(game_board, axis=0)
+        cols = np.flatnonzero(heights < 6)[::-1]
 
-        legal_moves = legal_moves.reshape((-1,6,7))
+        legal_moves = np.zeros((len(cols), 6, 7))
+        legal_moves[np.arange(len(cols)), 5 - heights[cols], cols] = 1
 
         return legal_moves
         
+    @staticmethod
+    def find_moves(before: np.ndarray, after: np.ndarray) -> list[int]:
+        """Returns the columns played to get from one board to another, for up to two moves.
+
+        Both boards are from the point of view of the player to move, with that player as
+        1 and their opponent as -1. The order of play is known since the players alternate.
+
+        Args:
+            before (np.ndarray): The earlier board.
+            after (np.ndarray): The later board, one or two moves after before.
+
+        Returns:
+            The list of columns played, in order, or None if after can't be reached from
+            before in one or two moves.
+        """
+        plies = np.count_nonzero(after) - np.count_nonzero(before)
+
+        # Put the difference in pieces from the point of view of the player to move in before
+        if plies == 1:
+            diff = -after - before
+        elif plies == 2:
+            diff = after - before
+        else:
+            return None
+
+        if np.count_nonzero(diff) != plies:
+            return None
+
+        first = np.flatnonzero(diff == 1)
+        second = np.flatnonzero(diff == -1)
+        if first.size != 1 or second.size != plies - 1:
+            return None
+
+        moves = [int(first[0]) % 7]
+        if second.size:
+            moves.append(int(second[0]) % 7)
+
+        return moves
+
+    @staticmethod
+    def winner_after_move(game_board: np.ndarray, row: int, col: int) -> int:
+        """Returns the winner of game_board, given that the last piece was placed at row, col.
+
+        Only the windows passing through the new piece can have changed, so only
+        those are checked. The board is assumed to have no winner before the move.
+
+        Args:
+            game_board (np.ndarray): A ConnectFour game board with 1 and -1 for the
+                two players, and 0 for open spaces.
+            row (int): Row of the last piece placed.
+            col (int): Column of the last piece placed.
+
+        Returns:
+            1 if the player with pieces of value 1 has won, 2 if the player with pieces
+            of value -1 has won, 0 for a tie, and None if the game is not over.
+        """
+        piece = game_board[row, col]
+        windows = game_board.ravel()[ConnectBoard.CELL_WINDOWS[row * 7 + col]]
+
+        if (windows.sum(axis=1) == 4 * piece).any():
+            return 1 if piece > 0 else 2
+        # The board is full once the top row is
+        elif game_board[0].all():
+            return 0
+
+        return None
+
     @staticmethod
     def get_winner(game_board: np.ndarray) -> int:
         flat_board = game_board.flatten()
@@ -0,0 +1,289 @@
+import numpy as np
+import argparse
+import json
+import os
+import struct
+
+# Chunk headers. A tag chunk defines a set of tags under an id, and a game chunk holds
+# one game, with the id of its tags.
+_TAG = struct.Struct("<cHH")  # b"T", tag id, length of the JSON that follows
+_GAME = struct.Struct("<cHbB")  # b"G", tag id, result, number of moves
+
+
+class GameRecord(object):
+    """A finished game: its moves, its result, and tags describing it.
+
+    Attributes:
+        moves (list[int]): Column of each move, starting with player one's first move.
+        result (int): 1 or 2 for the player who won, or 0 for a tie. Games can be won by
+            forfeit, so the moves don't always end the game.
+        tags (dict): Metadata of the game, like the agents that played it.
+    """
+
+    def __init__(self, moves: list[int], result: int, tags: dict = None) -> None:
+        self.moves = list(moves)
+        self.result = result
+        self.tags = tags or {}
+
+    def __eq__(self, other: object) -> bool:
+        return (
+            isinstance(other, GameRecord)
+            and self.moves == other.moves
+            and self.result == other.result
+            and self.tags == other.tags
+        )
+
+    def __repr__(self) -> str:
+        return "GameRecord({!r}, {}, {!r})".format(
+            "".join(str(col) for col in self.moves), self.result, self.tags
+        )
+
+    def positions(self):
+        """Replays the game, yielding each position before a move.
+
+        Yields:
+            board (np.ndarray): 6x7 int8 board with 1 for the player to move, -1 for their
+                opponent and 0 for open squares. A new array for each position.
+            col (int): Column played from the position.
+            outcome (int): Result of the game for the player to move: 1 for a win, -1 for
+                a loss and 0 for a tie.
+        """
+        board = np.zeros((6, 7), dtype=np.int8)
+        heights = [0] * 7
+
+        for ply, col in enumerate(self.moves):
+            player = ply % 2 + 1
+            if self.result == 0:
+                outcome = 0
+            else:
+                outcome = 1 if self.result == player else -1
+
+            yield board.copy(), col, outcome
+
+            board[5 - heights[col], col] = 1
+            heights[col] += 1
+            board *= -1
+
+
+class GameWriter(object):
+    """Appends games to a game record file.
+
+    The file starts with MAGIC and a version byte, followed by a stream of chunks. Each
+    game is a 6 byte header followed by its moves packed 3 bits each, so a typical game
+    takes about 14 bytes. Tags are stored once per writer in tag chunks, written the first
+    time a set of tags is used, and each game refers to its tags by id. A later tag chunk
+    with the same id replaces the earlier one, so writers appending to the same file
+    don't need to know each other's ids.
+
+    Files are only ever appended to. If a writer is interrupted partway through a chunk,
+    readers stop at the last complete chunk, and the next writer to open the file cuts
+    the partial chunk off before appending. Only one writer should append to a file at
+    once.
+    """
+
+    MAGIC = b"C4GR"
+    VERSION = 1
+
+    # Tag ids are 16 bit, so the table starts again once it has this many sets of tags
+    MAX_TAGS = 2 ** 16
+
+    def __init__(self, path: str) -> None:
+        """Opens path for appending, creating it if needed.
+
+        Raises:
+            ValueError: If path exists and is not a game record file.
+        """
+        self.path = path
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as f:
+                _read_header(f, path)
+                for _ in _read_chunks(f, path):
+                    pass
+                end = f.tell()
+
+            self._file = open(path, "ab")
+            if end < os.path.getsize(path):
+                self._file.truncate(end)
+        else:
+            self._file = open(path, "wb")
+            self._file.write(GameWriter.MAGIC + bytes([GameWriter.VERSION]))
+
+        self._tag_ids = {}
+        self.games = 0  # Number of games written by this writer
+
+    def write(self, moves: list[int], result: int, tags: dict = None) -> None:
+        """Appends a game.
+
+        Args:
+            moves (list[int]): Column of each move, at most 42 of them.
+            result (int): 1 or 2 for the player who won, or 0 for a tie.
+            tags (dict, optional): Metadata of the game. Must be JSON serializable.
+
+        Raises:
+            ValueError: If a move isn't a column, or there are too many moves.
+        """
+        if len(moves) > 42 or any(not 0 <= col < 7 for col in moves):
+            raise ValueError("Invalid moves: {}".format(moves))
+
+        key = json.dumps(tags or {}, sort_keys=True)
+        tag_id = self._tag_ids.get(key)
+        if tag_id is None:
+            if len(self._tag_ids) == GameWriter.MAX_TAGS:
+                self._tag_ids.clear()
+            tag_id = len(self._tag_ids)
+            self._tag_ids[key] = tag_id
+
+            data = key.encode()
+            self._file.write(_TAG.pack(b"T", tag_id, len(data)) + data)
+
+        self._file.write(_GAME.pack(b"G", tag_id, result, len(moves)) + pack_moves(moves))
+        self.games += 1
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> "GameWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def read_games(path: str):
+    """Yields the games in a game record file one at a time, in the order they were written.
+
+    The file is read in a single buffered pass, so it can be much larger than memory. A
+    chunk cut off at the end of the file, by a writer that was interrupted, is ignored.
+
+    Yields:
+        A GameRecord for each game. Games with the same tags share the same dict.
+
+    Raises:
+        ValueError: If the file is not a game record file, or is corrupt.
+    """
+    with open(path, "rb") as f:
+        _read_header(f, path)
+        tags = {}
+
+        for start, kind, tag_id, result, num_moves, data in _read_chunks(f, path):
+            if kind == b"T":
+                tags[tag_id] = json.loads(data)
+            elif tag_id not in tags:
+                raise ValueError(
+                    "Corrupt game record file: {} (game at byte {} uses unknown tags {})"
+                    .format(path, start, tag_id)
+                )
+            else:
+                yield GameRecord(unpack_moves(data, num_moves), result, tags[tag_id])
+
+
+def iter_positions(paths: list[str]):
+    """Replays every game in the given files, yielding one position at a time.
+
+    Games are read and replayed lazily, so millions of games can be turned into training
+    positions without holding more than one of them in memory.
+
+    Args:
+        paths (list[str]): Game record files, or a single file.
+
+    Yields:
+        (board, col, outcome) for each move of each game, see GameRecord.positions.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+
+    for path in paths:
+        for game in read_games(path):
+            yield from game.positions()
+
+
+def pack_moves(moves: list[int]) -> bytes:
+    """Packs columns into 3 bits each, with the first move in the lowest bits."""
+    packed = 0
+    for i, col in enumerate(moves):
+        packed |= col << (3 * i)
+    return packed.to_bytes((3 * len(moves) + 7) // 8, "little")
+
+
+def unpack_moves(data: bytes, num_moves: int) -> list[int]:
+    """Unpacks num_moves columns packed by pack_moves."""
+    packed = int.from_bytes(data, "little")
+    return [(packed >> (3 * i)) & 7 for i in range(num_moves)]
+
+
+def _read_chunks(f, path: str):
+    """Yields (offset, kind, tag id, result, number of moves, data) for each chunk in f.
+
+    The offset is where the chunk starts in the file. Tag chunks have a result and number
+    of moves of None, and their JSON as data. Stops at the end of the file, or at a
+    chunk that was cut off, leaving f at the end of the last complete chunk.
+    """
+    while True:
+        start = f.tell()
+        kind = f.read(1)
+
+        if kind == b"T":
+            header = f.read(_TAG.size - 1)
+            if len(header) == _TAG.size - 1:
+                _, tag_id, length = _TAG.unpack(kind + header)
+                data = f.read(length)
+                if len(data) == length:
+                    yield start, kind, tag_id, None, None, data
+                    continue
+
+        elif kind == b"G":
+            header = f.read(_GAME.size - 1)
+            if len(header) == _GAME.size - 1:
+                _, tag_id, result, num_moves = _GAME.unpack(kind + header)
+                length = (3 * num_moves + 7) // 8
+                data = f.read(length)
+                if len(data) == length:
+                    yield start, kind, tag_id, result, num_moves, data
+                    continue
+
+        elif kind:
+            raise ValueError("Corrupt game record file: {}".format(path))
+
+        f.seek(start)
+        return
+
+
+def _read_header(f, path: str) -> None:
+    header = f.read(len(GameWriter.MAGIC) + 1)
+    if header != GameWriter.MAGIC + bytes([GameWriter.VERSION]):
+        raise ValueError("{} is not a valid game record file".format(path))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize or print game record files.")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument(
+        "--show", type=int, default=0, help="Print the first SHOW games of each file"
+    )
+
+    args = parser.parse_args()
+
+    for path in args.files:
+        results = [0, 0, 0]  # Ties, player one wins, player two wins
+        games = moves = 0
+        for game in read_games(path):
+            if games < args.show:
+                print(game)
+            results[game.result] += 1
+            games += 1
+            moves += len(game.moves)
+
+        print(
+            "{}: {} games, {} moves, {} bytes, P1 {} / tie {} / P2 {}".format(
+                path,
+                games,
+                moves,
+                os.path.getsize(path),
+                results[1],
+                results[0],
+                results[2],
+            )
+        )
@@ -0,0 +1,367 @@
+from agents import Agent
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from connectboard import ConnectBoard
+from tournament import parse_spec
+from play_game import agents
+from vector_env import greedy_policy
+import numpy as np
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import time
+
+# Fraction of the move budget given to agents that take a time limit, leaving the rest
+# for queueing and sending the board to and from the worker process
+SEARCH_FRACTION = 0.8
+
+_agents = {}  # Agents created by each worker process, by spec and time budget
+
+
+def _get_agent(spec: str, max_time: float) -> Agent:
+    """Returns the agent for spec, creating it the first time it's used.
+
+    Agents with a max_time setting, like AlphaBeta, have it capped at max_time when
+    they're created, so each time budget gets its own agent.
+    """
+    if (spec, max_time) not in _agents:
+        name, kwargs = parse_spec(spec)
+        agent = agents[name](**kwargs)
+        if hasattr(agent, "max_time"):
+            agent.max_time = min(kwargs.get("max_time") or np.inf, max_time)
+        _agents[spec, max_time] = agent
+    return _agents[spec, max_time]
+
+
+def _search(spec: str, game_board: np.ndarray, max_time: float) -> int:
+    """Returns the column an agent plays on game_board, in a worker process.
+
+    Agents with a max_time setting finish within max_time. Other agents are only
+    stopped by the server's timeout.
+    """
+    move = _get_agent(spec, max_time).get_move(game_board)
+    return int(np.argmax(move)) % 7
+
+
+class Session(object):
+    """A game between a client and an agent."""
+
+    def __init__(self, game_id: int, spec: str, agent_player: int) -> None:
+        """Starts a game.
+
+        Args:
+            game_id (int): Id of the game.
+            spec (str): Spec of the agent, see tournament.parse_spec.
+            agent_player (int): 1 if the agent moves first, 2 if the client does.
+        """
+        self.id = game_id
+        self.spec = spec
+        self.agent_player = agent_player
+        self.board = ConnectBoard()
+        self.moves = []
+
+    @property
+    def to_move(self) -> int:
+        """Player to move, 1 or 2."""
+        return len(self.moves) % 2 + 1
+
+    def state(self) -> np.ndarray:
+        """Returns the board from the point of view of the player to move."""
+        return self.board.current_state() * (1 if self.to_move == 1 else -1)
+
+    def play(self, col: int) -> None:
+        """Plays col for the player to move.
+
+        Raises:
+            ValueError: If the game is over or col is full or off the board.
+        """
+        state = self.board.current_state()
+        if self.board.winner() is not None:
+            raise ValueError("Game {} is over".format(self.id))
+        if not isinstance(col, int) or not 0 <= col < 7 or state[0, col] != 0:
+            raise ValueError("Invalid move: {}".format(col))
+
+        move = np.zeros((6, 7))
+        move[np.flatnonzero(state[:, col] == 0)[-1], col] = 1 if self.to_move == 1 else -1
+        self.board.make_move(move)
+        self.moves.append(col)
+
+    def to_dict(self) -> dict:
+        return {
+            "game": self.id,
+            "moves": self.moves,
+            "board": self.board.current_state().astype(int).tolist(),
+            "winner": self.board.winner(),
+        }
+
+
+class GameServer(object):
+    """Hosts games between clients and agents, over a line delimited JSON protocol.
+
+    Each line a client sends is a JSON request with an "op", and the server answers each
+    with one JSON line, with "ok" set to false and an "error" message if it failed:
+
+        {"op": "new", "agent": "AlphaBeta:max_depth=6", "first": "client"}
+            Starts a game against an agent. "first" is "client" or "agent".
+        {"op": "move", "game": 1, "column": 3}
+            Plays a move, and answers with the agent's reply.
+        {"op": "close", "game": 1}
+            Ends a game early.
+        {"op": "stats"}
+            Returns the number of games and moves, and move latency percentiles.
+
+    Game responses hold the game id, the columns played, the board with player one as 1
+    and player two as -1, the winner (1 or 2, 0 for a tie, or null), and for agent moves
+    the "column" played and whether the agent ran out of time.
+
+    Searches run in a pool of worker processes, so the event loop only handles messages
+    and many games can be played at once. Each agent move has a time budget, covering
+    queueing for a worker as well as the search. If the search isn't done in time, a
+    greedy move is played instead. A search still waiting for a worker is cancelled,
+    but one that has started can't be stopped, and the worker finishes it in the
+    background. While every worker is busy with abandoned searches, agent moves are
+    played greedily right away rather than queued behind them.
+    """
+
+    def __init__(
+        self, workers: int = None, move_time: float = 1.0, latency_window: int = 10000
+    ) -> None:
+        """Initializes the server.
+
+        Args:
+            workers (int, optional): Number of worker processes. Defaults to one per CPU.
+            move_time (float, optional): Time budget of each agent move in seconds.
+            latency_window (int, optional): Number of recent agent moves to compute latency
+                percentiles over.
+        """
+        self.move_time = move_time
+        self.games = 0
+        self.moves = 0
+        self.timeouts = 0
+        self.latencies = deque(maxlen=latency_window)
+
+        self._workers = workers or os.cpu_count()
+        self._abandoned = 0  # Searches still running after their move timed out
+        self._pool = ProcessPoolExecutor(self._workers)
+        self._ids = itertools.count(1)
+        self._rng = np.random.default_rng()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 4000) -> None:
+        """Accepts clients on host and port until cancelled."""
+        server = await asyncio.start_server(self.handle_client, host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def handle_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Answers the requests of one client. Its games end when it disconnects."""
+        sessions = {}
+        try:
+            while line := await reader.readline():
+                try:
+                    response = await self.handle_request(json.loads(line), sessions)
+                    response["ok"] = True
+                except Exception as e:
+                    response = {"ok": False, "error": str(e)}
+
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, request: dict, sessions: dict) -> dict:
+        """Returns the response to a request.
+
+        Args:
+            request (dict): Request from a client.
+            sessions (dict): The client's games, by id.
+
+        Raises:
+            ValueError: If the request is malformed, or not allowed in its game.
+        """
+        op = request.get("op")
+
+        if op == "new":
+            spec = request.get("agent", "AlphaBeta")
+            parse_spec(spec)
+            first = request.get("first", "client")
+            if first not in ("client", "agent"):
+                raise ValueError("Unknown first player: {}".format(first))
+
+            session = Session(next(self._ids), spec, 1 if first == "agent" else 2)
+            sessions[session.id] = session
+            self.games += 1
+
+            if first == "agent":
+                return await self.agent_move(session)
+            return session.to_dict()
+
+        elif op == "move":
+            session = sessions.get(request.get("game"))
+            if session is None:
+                raise ValueError("Unknown game: {}".format(request.get("game")))
+            if session.to_move == session.agent_player:
+                raise ValueError("Not your turn")
+
+            session.play(request.get("column"))
+            if session.board.winner() is not None:
+                return session.to_dict()
+            return await self.agent_move(session)
+
+        elif op == "close":
+            if sessions.pop(request.get("game"), None) is None:
+                raise ValueError("Unknown game: {}".format(request.get("game")))
+            return {}
+
+        elif op == "stats":
+            return self.stats()
+
+        raise ValueError("Unknown op: {}".format(op))
+
+    async def agent_move(self, session: Session) -> dict:
+        """Plays the agent's move in session, and returns the game."""
+        start = time.perf_counter()
+        state = session.state()
+        timed_out = False
+
+        col = None
+        if self._abandoned < self._workers:
+            loop = asyncio.get_running_loop()
+            search = self._pool.submit(
+                _search, session.spec, state, SEARCH_FRACTION * self.move_time
+            )
+            try:
+                col = await asyncio.wait_for(asyncio.wrap_future(search), self.move_time)
+            except asyncio.TimeoutError:
+                if not search.cancel():
+                    # Already running, so it holds its worker until it finishes
+                    self._abandoned += 1
+                    search.add_done_callback(
+                        lambda _: loop.call_soon_threadsafe(self._release_worker)
+                    )
+
+        if col is None:
+            timed_out = True
+            self.timeouts += 1
+            legal = (state[0] == 0)[np.newaxis]
+            col = int(greedy_policy(state[np.newaxis], legal, self._rng)[0])
+
+        session.play(col)
+        self.moves += 1
+        self.latencies.append(time.perf_counter() - start)
+
+        response = session.to_dict()
+        response["column"] = col
+        response["timed_out"] = timed_out
+        return response
+
+    def _release_worker(self) -> None:
+        self._abandoned -= 1
+
+    def stats(self) -> dict:
+        """Returns the number of games and agent moves, and agent move latency percentiles."""
+        latencies = np.array(self.latencies) * 1000
+        p50, p99 = np.percentile(latencies, [50, 99]) if latencies.size else (0, 0)
+        return {
+            "games": self.games,
+            "moves": self.moves,
+            "timeouts": self.timeouts,
+            "p50_ms": float(p50),
+            "p99_ms": float(p99),
+        }
+
+    def close(self) -> None:
+        """Stops the worker processes, without waiting for searches still running."""
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def run_client(
+    host: str, port: int, num_games: int, spec: str, seed: int = 0
+) -> dict:
+    """Plays num_games concurrent games against the server with random moves.
+
+    A local load test. Each game uses its own connection.
+
+    Returns:
+        The server's stats once every game is over, with the latency of each request
+        measured by the clients added as "client_p50_ms" and "client_p99_ms".
+    """
+    rng = np.random.default_rng(seed)
+    latencies = []
+
+    async def request(reader, writer, **message):
+        start = time.perf_counter()
+        writer.write(json.dumps(message).encode() + b"\n")
+        await writer.drain()
+        response = json.loads(await reader.readline())
+        latencies.append(time.perf_counter() - start)
+        if not response["ok"]:
+            raise RuntimeError(response["error"])
+        return response
+
+    async def play(first):
+        reader, writer = await asyncio.open_connection(host, port)
+        game = await request(reader, writer, op="new", agent=spec, first=first)
+        while game["winner"] is None:
+            legal = np.flatnonzero(np.array(game["board"])[0] == 0)
+            col = int(rng.choice(legal))
+            game = await request(reader, writer, op="move", game=game["game"], column=col)
+
+        writer.close()
+        return game["winner"]
+
+    await asyncio.gather(
+        *(play("client" if i % 2 == 0 else "agent") for i in range(num_games))
+    )
+
+    reader, writer = await asyncio.open_connection(host, port)
+    stats = await request(reader, writer, op="stats")
+    writer.close()
+
+    del stats["ok"]
+    p50, p99 = np.percentile(np.array(latencies) * 1000, [50, 99])
+    stats["client_p50_ms"] = float(p50)
+    stats["client_p99_ms"] = float(p99)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve games against agents over a line delimited JSON protocol."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4000)
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    parser.add_argument(
+        "--move-time", type=float, default=1.0, help="Time budget per agent move in seconds"
+    )
+    parser.add_argument(
+        "--client",
+        action="store_true",
+        help="Instead of serving, load test a running server with random moves",
+    )
+    parser.add_argument("-n", "--games", type=int, default=16, help="Games for --client")
+    parser.add_argument(
+        "--agent", default="AlphaBeta", help="Agent spec for --client games"
+    )
+
+    args = parser.parse_args()
+
+    if args.client:
+        stats = asyncio.run(run_client(args.host, args.port, args.games, args.agent))
+        print(json.dumps(stats, indent=2))
+    else:
+        server = GameServer(args.workers, args.move_time)
+        print("Serving on {}:{}".format(args.host, args.port))
+        try:
+            asyncio.run(server.serve(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            print(json.dumps(server.stats(), indent=2))
+            server.close()
@@ -0,0 +1,117 @@
+from agents.book import OpeningBook
+from agents.solver import Solver
+from bitboard import BitBoard, WIDTH, HEIGHT
+from multiprocessing import Pool
+from symmetry import canonical_key
+import argparse
+import time
+
+_solver = None  # Solver used by each worker process
+
+
+def positions_by_ply(plies: int, root: BitBoard = None) -> list[dict]:
+    """Lists every unfinished position reachable within the given number of plies.
+
+    Positions that are mirror images of each other are only listed once.
+
+    Args:
+        plies (int): Number of moves to play from root.
+        root (BitBoard, optional): Position to start from. Defaults to the empty board.
+
+    Returns:
+        A list of plies + 1 dicts, where entry i maps the canonical key of each position
+        i moves after root to the position.
+    """
+    root = root if root is not None else BitBoard()
+    layers = [{canonical_key(root.key())[0]: root}]
+
+    for _ in range(plies):
+        layer = {}
+        for position in layers[-1].values():
+            for col in position.legal_moves():
+                if position.is_winning_move(col) or position.moves + 1 == WIDTH * HEIGHT:
+                    continue
+                child = position.copy()
+                child.play(col)
+                layer[canonical_key(child.key())[0]] = child
+        layers.append(layer)
+
+    return layers
+
+
+def _init_worker(tt_size_mb: float) -> None:
+    global _solver
+    _solver = Solver(tt_size_mb=tt_size_mb)
+
+
+def _solve_position(position: tuple[int, int, int]) -> tuple[int, int]:
+    current, mask, moves = position
+    board = BitBoard(current, mask, moves)
+    return canonical_key(board.key())[0], _solver.solve(board)
+
+
+def generate(plies: int, workers: int = None, tt_size_mb: float = 64) -> dict:
+    """Solves every position in the first plies moves of the game.
+
+    Only the positions at the deepest ply are searched, spread over a pool of worker
+    processes. Scores for earlier positions are then backed up from their children.
+
+    Args:
+        plies (int): Number of plies covered by the book.
+        workers (int, optional): Number of worker processes. Defaults to one per CPU.
+        tt_size_mb (float, optional): Transposition table size of each worker.
+
+    Returns:
+        Dict mapping canonical position keys to scores.
+    """
+    layers = positions_by_ply(plies)
+    book = {}
+
+    deepest = [(p.current, p.mask, p.moves) for p in layers[-1].values()]
+    print("Solving {} positions at ply {}".format(len(deepest), plies))
+
+    start = time.time()
+    with Pool(workers, initializer=_init_worker, initargs=(tt_size_mb,)) as pool:
+        results = pool.imap_unordered(_solve_position, deepest, chunksize=16)
+        for i, (key, score) in enumerate(results, 1):
+            book[key] = score
+            if i % 1000 == 0 or i == len(deepest):
+                elapsed = time.time() - start
+                print(
+                    "{}/{} solved in {:.0f}s ({:.1f} positions/s)".format(
+                        i, len(deepest), elapsed, i / elapsed
+                    )
+                )
+
+    # Back up scores to shallower positions. The best move either wins immediately,
+    # or leads to a position in the next layer.
+    for layer in reversed(layers[:-1]):
+        for key, position in layer.items():
+            scores = []
+            for col in position.legal_moves():
+                if position.is_winning_move(col):
+                    scores.append((WIDTH * HEIGHT + 1 - position.moves) // 2)
+                else:
+                    child = position.copy()
+                    child.play(col)
+                    scores.append(-book[canonical_key(child.key())[0]])
+            book[key] = max(scores)
+
+    return book
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate an opening book for the Solver agent."
+    )
+    parser.add_argument("-o", "--output", default="opening_book.bin")
+    parser.add_argument("-n", "--plies", type=int, default=8)
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    parser.add_argument("--tt-size", type=float, default=64, help="Megabytes per worker")
+
+    args = parser.parse_args()
+
+    book = generate(args.plies, args.workers, args.tt_size)
+    OpeningBook.save(args.output, book, args.plies)
+
+    print("Wrote {} positions to {}".format(len(book), args.output))
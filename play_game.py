@@ -1,13 +1,30 @@
-from agents import Agent, Human, AlphaBeta, Mcts, AlphaFour
+from agents import Agent, Human, AlphaBeta, Mcts, AlphaFour, Solver
 from connectboard import ConnectBoard
+from game_records import GameWriter
+import numpy as np
 import argparse
-
-agents = {"Human": Human, "AlphaBeta": AlphaBeta, "Mcts": Mcts, "AlphaFour": AlphaFour}
-
-
-def play(p1: Agent, p2: Agent) -> None:
-    """Plays a game of ConnectFour between two agents."""
+import json
+
+agents = {
+    "Human": Human,
+    "AlphaBeta": AlphaBeta,
+    "Mcts": Mcts,
+    "AlphaFour": AlphaFour,
+    "Solver": Solver,
+}
+
+
+def play(p1: Agent, p2: Agent, record: GameWriter = None, tags: dict = None) -> None:
+    """Plays a game of ConnectFour between two agents.
+
+    Args:
+        p1 (Agent): Player one, who moves first.
+        p2 (Agent): Player two.
+        record (GameWriter, optional): Writer to append the finished game to.
+        tags (dict, optional): Tags to record the game with.
+    """
     board = ConnectBoard()
+    moves = []
     turn = 0
 
     while board.winner() is None:
@@ -25,6 +42,7 @@ def play(p1: Agent, p2: Agent) -> None:
 
         try:
             board.make_move(move)
+            moves.append(int(np.argmax(np.abs(move))) % 7)
             turn += 1
         except:
             if turn % 2 == 0:
@@ -35,6 +53,9 @@ def play(p1: Agent, p2: Agent) -> None:
     print(board)
 
     winner = board.winner()
+    if record is not None:
+        record.write(moves, winner, tags)
+
     if winner:
         print("P{} wins!".format(winner))
     else:
@@ -47,6 +68,64 @@ if __name__ == "__main__":
     )
     parser.add_argument("-p1", "--player1", default="Human")
     parser.add_argument("-p2", "--player2", default="AlphaBeta")
+    parser.add_argument(
+        "--max-time",
+        type=float,
+        default=None,
+        help="Time budget per move in seconds for AlphaBeta agents",
+    )
+    parser.add_argument(
+        "--max-depth",
+        type=int,
+        default=None,
+        help="Maximum search depth for AlphaBeta agents",
+    )
+    parser.add_argument(
+        "--rollouts",
+        type=int,
+        default=16,
+        help="Random games played from each new leaf by Mcts agents",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of workers searching in parallel for AlphaBeta and Mcts agents",
+    )
+    parser.add_argument(
+        "--parallel",
+        choices=Mcts.PARALLEL_MODES,
+        default="root",
+        help="Parallel search mode for Mcts agents with more than one worker",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=8,
+        help="Leaves evaluated by the network in each batch by AlphaFour agents",
+    )
+    parser.add_argument(
+        "--weights",
+        default=None,
+        help="Network weights for AlphaFour agents, a .npz file or a directory of .npy files",
+    )
+    parser.add_argument(
+        "--book",
+        default=None,
+        help="Opening book for Solver agents, see generate_book.py",
+    )
+    parser.add_argument(
+        "--stats",
+        choices=("text", "json", "none"),
+        default="text",
+        help="How to print the search statistics of each move",
+    )
+
+    parser.add_argument(
+        "--record",
+        default=None,
+        help="Game record file to append the game to, see game_records.py",
+    )
 
     args = parser.parse_args()
 
@@ -62,7 +141,33 @@ if __name__ == "__main__":
         print(f"Unknown Agent: {p2_type}")
         exit(1)
 
-    p1 = agents[p1_type]()
-    p2 = agents[p2_type]()
-
-    play(p1, p2)
+    # Options passed to the constructor of each agent type
+    agent_options = {
+        "AlphaBeta": {
+            "max_time": args.max_time,
+            "max_depth": args.max_depth,
+            "workers": args.workers,
+        },
+        "Mcts": {
+            "num_rollouts": args.rollouts,
+            "workers": args.workers,
+            "parallel": args.parallel,
+        },
+        "AlphaFour": {"batch_size": args.batch_size, "weights_path": args.weights},
+        "Solver": {"book_path": args.book},
+    }
+
+    p1 = agents[p1_type](**agent_options.get(p1_type, {}))
+    p2 = agents[p2_type](**agent_options.get(p2_type, {}))
+
+    for p in (p1, p2):
+        if args.stats == "text":
+            p.on_stats = print
+        elif args.stats == "json":
+            p.on_stats = lambda stats: print(json.dumps(stats.to_dict()))
+
+    if args.record:
+        with GameWriter(args.record) as record:
+            play(p1, p2, record, {"player1": p1_type, "player2": p2_type})
+    else:
+        play(p1, p2)
@@ -0,0 +1,183 @@
+import numpy as np
+import argparse
+import os
+
+# Bit of each cell in a packed plane, with cells in row major order
+_CELL_BITS = np.uint64(1) << np.arange(42, dtype=np.uint64)
+
+
+class ReplayBuffer(object):
+    """Fixed size ring buffer of training positions, stored in a memory mapped file.
+
+    Each position takes 31 bytes: the two planes of the game state packed into the low
+    42 bits of a uint64 each, the policy as 7 float16s, and the outcome as an int8. Once
+    the buffer is full, new positions overwrite the oldest ones.
+
+    The file starts with a header holding the capacity and the total number of positions
+    ever added, followed by the records. Since the file is memory mapped, only the pages
+    that are sampled are read from disk, and several processes can open the same buffer:
+    one adding self-play games while others sample from it for training.
+    """
+
+    MAGIC = b"C4RB"
+    VERSION = 1
+    HEADER_DTYPE = np.dtype(
+        [("magic", "S4"), ("version", "<u4"), ("capacity", "<u8"), ("total", "<u8")]
+    )
+    RECORD_DTYPE = np.dtype(
+        [("planes", "<u8", 2), ("policy", "<f2", 7), ("outcome", "i1")]
+    )
+
+    def __init__(self, path: str, readonly: bool = False) -> None:
+        """Opens an existing buffer created with create.
+
+        Raises:
+            ValueError: If the file is not a replay buffer.
+        """
+        mode = "r" if readonly else "r+"
+        self.path = path
+        self._header = np.memmap(
+            path, dtype=ReplayBuffer.HEADER_DTYPE, mode=mode, shape=(1,)
+        )
+
+        header = self._header[0]
+        if (
+            header["magic"] != ReplayBuffer.MAGIC
+            or header["version"] != ReplayBuffer.VERSION
+        ):
+            raise ValueError("{} is not a valid replay buffer".format(path))
+
+        self.capacity = int(header["capacity"])
+        self._records = np.memmap(
+            path,
+            dtype=ReplayBuffer.RECORD_DTYPE,
+            mode=mode,
+            offset=ReplayBuffer.HEADER_DTYPE.itemsize,
+            shape=(self.capacity,),
+        )
+
+    def __len__(self) -> int:
+        return min(self.total, self.capacity)
+
+    @property
+    def total(self) -> int:
+        """Number of positions ever added, including ones that have been overwritten."""
+        return int(self._header[0]["total"])
+
+    def add(self, states: np.ndarray, policies: np.ndarray, outcomes: np.ndarray) -> None:
+        """Appends positions to the buffer, overwriting the oldest if it's full.
+
+        Args:
+            states (np.ndarray): Array of shape (N, 2, 6, 7), in the format returned by
+                AlphaFour.get_game_state.
+            policies (np.ndarray): Array of shape (N, 7) of move probabilities.
+            outcomes (np.ndarray): Array of shape (N,), the result for the player to move.
+        """
+        records = np.empty(len(states), dtype=ReplayBuffer.RECORD_DTYPE)
+        records["planes"] = ReplayBuffer.pack_states(states)
+        records["policy"] = policies
+        records["outcome"] = outcomes
+
+        # Only the last capacity positions would survive anyway
+        total = self.total + len(records)
+        records = records[-self.capacity :]
+        idx = (total - len(records) + np.arange(len(records))) % self.capacity
+        self._records[idx] = records
+
+        # Publish the new positions to readers only once they're written
+        self._header[0]["total"] = total
+
+    def sample(
+        self, batch_size: int, rng: np.random.Generator = None, mirror: bool = True
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Returns a uniformly random minibatch of positions.
+
+        Args:
+            batch_size (int): Number of positions to sample, with replacement.
+            rng (np.random.Generator, optional): Random number generator to use.
+            mirror (bool, optional): Whether to flip each position left to right with
+                probability 1/2. Connect four is symmetric, so the flipped position with the
+                flipped policy and the same outcome is just as valid a training example.
+
+        Returns:
+            states (np.ndarray): float32 array of shape (batch_size, 2, 6, 7).
+            policies (np.ndarray): float32 array of shape (batch_size, 7).
+            outcomes (np.ndarray): float32 array of shape (batch_size,).
+        """
+        rng = rng if rng is not None else np.random.default_rng()
+        size = len(self)
+        if size == 0:
+            raise ValueError("Can't sample from an empty replay buffer")
+
+        # Sorted indices make reads from the memory map more sequential
+        records = self._records[np.sort(rng.integers(size, size=batch_size))]
+
+        states = ReplayBuffer.unpack_states(records["planes"]).astype(np.float32)
+        policies = records["policy"].astype(np.float32)
+        outcomes = records["outcome"].astype(np.float32)
+
+        if mirror:
+            flip = rng.random(batch_size) < 0.5
+            states[flip] = states[flip, :, :, ::-1]
+            policies[flip] = policies[flip, ::-1]
+
+        return states, policies, outcomes
+
+    def flush(self) -> None:
+        """Writes any changes still in memory to disk."""
+        self._records.flush()
+        self._header.flush()
+
+    @staticmethod
+    def create(path: str, capacity: int) -> "ReplayBuffer":
+        """Creates an empty buffer at path with room for capacity positions, and opens it."""
+        header = np.zeros(1, dtype=ReplayBuffer.HEADER_DTYPE)
+        header["magic"] = ReplayBuffer.MAGIC
+        header["version"] = ReplayBuffer.VERSION
+        header["capacity"] = capacity
+
+        with open(path, "wb") as f:
+            f.write(header.tobytes())
+            f.truncate(header.nbytes + capacity * ReplayBuffer.RECORD_DTYPE.itemsize)
+
+        return ReplayBuffer(path)
+
+    @staticmethod
+    def pack_states(states: np.ndarray) -> np.ndarray:
+        """Packs (N, 2, 6, 7) game states into an (N, 2) array of 42 bit planes."""
+        cells = np.asarray(states).reshape(-1, 2, 42).astype(bool)
+        return np.where(cells, _CELL_BITS, np.uint64(0)).sum(axis=2, dtype=np.uint64)
+
+    @staticmethod
+    def unpack_states(planes: np.ndarray) -> np.ndarray:
+        """Unpacks an (N, 2) array of planes from pack_states into (N, 2, 6, 7) game states."""
+        cells = (planes[:, :, np.newaxis] & _CELL_BITS) != 0
+        return cells.astype(np.uint8).reshape(-1, 2, 6, 7)
+
+
+if __name__ == "__main__":
+    from self_play import load_shards
+
+    parser = argparse.ArgumentParser(
+        description="Add self-play games to a replay buffer, creating it if needed."
+    )
+    parser.add_argument("buffer")
+    parser.add_argument("shards", help="Directory of self-play shards, see self_play.py")
+    parser.add_argument("-c", "--capacity", type=int, default=1_000_000)
+
+    args = parser.parse_args()
+
+    if os.path.exists(args.buffer):
+        buffer = ReplayBuffer(args.buffer)
+    else:
+        buffer = ReplayBuffer.create(args.buffer, args.capacity)
+
+    states, policies, outcomes = load_shards(args.shards)
+    buffer.add(states, policies, outcomes)
+    buffer.flush()
+
+    print(
+        "Added {} positions, buffer holds {}/{}".format(
+            len(states), len(buffer), buffer.capacity
+        )
+    )
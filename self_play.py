@@ -0,0 +1,325 @@
+from agents import AlphaFour
+from agents.alphafour import Model
+from agents.cache import EvaluationCache
+from agents.evaluator import BatchEvaluator
+from connectboard import ConnectBoard
+from multiprocessing import Pool
+import numpy as np
+import argparse
+import os
+import time
+
+_agent = None  # AlphaFour agent used by each worker process
+_config = None  # Settings shared by every shard, set in each worker process
+
+
+def shard_path(output_dir: str, shard: int) -> str:
+    return os.path.join(output_dir, "shard_{:05d}.npz".format(shard))
+
+
+def checkpoint_path(output_dir: str, shard: int) -> str:
+    return os.path.join(output_dir, ".shard_{:05d}.partial.npz".format(shard))
+
+
+def game_path(output_dir: str, shard: int, game: int) -> str:
+    return os.path.join(output_dir, ".shard_{:05d}.game_{:05d}.npz".format(shard, game))
+
+
+def _save(path: str, **arrays) -> None:
+    """Saves arrays to path, replacing it in one step so it's never left half written."""
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+
+
+def play_game(
+    agent: AlphaFour,
+    rng: np.random.Generator,
+    temperature_moves: int = 10,
+    moves: list[int] = None,
+    states: list[np.ndarray] = None,
+    policies: list[np.ndarray] = None,
+    on_move=None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Plays a game of agent against itself and returns a training record of every move.
+
+    For the first temperature_moves moves, the move is sampled in proportion to the
+    search's visit counts so games don't all start the same way. After that the most
+    visited move is played.
+
+    A game can be resumed by passing the moves, states and policies recorded so far.
+
+    Args:
+        agent (AlphaFour): Agent playing both sides.
+        rng (np.random.Generator): Random number generator for sampling moves.
+        temperature_moves (int, optional): Number of moves to sample.
+        moves (list[int], optional): Columns played so far. Updated in place.
+        states (list[np.ndarray], optional): Recorded states so far. Updated in place.
+        policies (list[np.ndarray], optional): Recorded policies so far. Updated in place.
+        on_move (optional): Function called with moves, states and policies after each move.
+
+    Returns:
+        states (np.ndarray): The game state before each move, from the point of view of
+            the player to move, in the format of AlphaFour.get_game_state.
+        policies (np.ndarray): The search's visit probabilities of each column.
+        outcomes (np.ndarray): The result of the game for the player to move: 1 for a
+            win, -1 for a loss and 0 for a tie.
+    """
+    moves = moves if moves is not None else []
+    states = states if states is not None else []
+    policies = policies if policies is not None else []
+
+    # Replay the moves so far. The board is kept with the player to move as 1
+    board = np.zeros((6, 7))
+    heights = np.zeros(7, dtype=int)
+    for col in moves:
+        board[5 - heights[col], col] = 1
+        heights[col] += 1
+        board *= -1
+
+    result = None
+    while result is None:
+        _, probs = agent.get_move_with_prob(AlphaFour.get_game_state(board))
+        if len(moves) < temperature_moves:
+            col = int(rng.choice(7, p=probs))
+        else:
+            col = int(np.argmax(probs))
+
+        states.append(AlphaFour.get_game_state(board).astype(np.uint8))
+        policies.append(probs.astype(np.float32))
+        moves.append(col)
+
+        row = 5 - heights[col]
+        board[row, col] = 1
+        heights[col] += 1
+        result = ConnectBoard.winner_after_move(board, row, col)
+        board *= -1
+
+        if on_move is not None:
+            on_move(moves, states, policies)
+
+    # The last player to move won, unless it was a tie
+    outcomes = np.zeros(len(moves), dtype=np.int8)
+    if result != 0:
+        outcomes[::-1][0::2] = 1
+        outcomes[::-1][1::2] = -1
+
+    return np.array(states), np.array(policies), outcomes
+
+
+def _init_worker(config: dict) -> None:
+    global _agent, _config
+    _config = config
+
+    if config["cache_name"] is None:
+        _agent = AlphaFour(weights_path=config["weights_path"])
+    else:
+        cache = EvaluationCache(name=config["cache_name"])
+        model = Model(config["weights_path"])
+        _agent = AlphaFour(evaluator=BatchEvaluator(model, cache=cache))
+
+
+def _play_shard(shard: int) -> tuple[int, int, float]:
+    """Plays the games of a shard and writes them to disk.
+
+    Each finished game is saved to its own file, and the game being played is
+    checkpointed after every move, so a shard that was interrupted picks up in the
+    middle of the game it was playing. Checkpoints only hold the game in progress, so
+    they stay small however many games the shard has. Once every game is done they are
+    gathered into the shard.
+
+    Returns:
+        The number of games and positions played, and the time taken in seconds.
+    """
+    output_dir = _config["output_dir"]
+    checkpoint = checkpoint_path(output_dir, shard)
+    rng = np.random.default_rng([_config["seed"], shard])
+
+    games = 0
+    while os.path.exists(game_path(output_dir, shard, games)):
+        games += 1
+
+    game = {"moves": [], "states": [], "policies": []}
+    if os.path.exists(checkpoint):
+        with np.load(checkpoint) as f:
+            # The checkpoint may be of a game that was saved just before being stopped
+            if int(f["games"]) == games:
+                game["moves"] = list(f["moves"])
+                game["states"] = list(f["states"])
+                game["policies"] = list(f["policies"])
+
+    def save_checkpoint(moves, states, policies):
+        _save(
+            checkpoint,
+            games=games,
+            moves=np.array(moves, dtype=np.int8),
+            states=np.array(states, dtype=np.uint8).reshape(-1, 2, 6, 7),
+            policies=np.array(policies, dtype=np.float32).reshape(-1, 7),
+        )
+
+    start = time.time()
+    positions = 0
+    while games < _config["games_per_shard"]:
+        states, policies, outcomes = play_game(
+            _agent,
+            rng,
+            _config["temperature_moves"],
+            on_move=save_checkpoint,
+            **game,
+        )
+        _save(
+            game_path(output_dir, shard, games),
+            states=states,
+            policies=policies,
+            outcomes=outcomes,
+        )
+        game = {"moves": [], "states": [], "policies": []}
+        games += 1
+        positions += len(states)
+
+    records = {"states": [], "policies": [], "outcomes": []}
+    for i in range(games):
+        with np.load(game_path(output_dir, shard, i)) as f:
+            for name in records:
+                records[name].append(f[name])
+
+    _save(
+        shard_path(output_dir, shard),
+        states=np.concatenate(records["states"]).astype(np.uint8),
+        policies=np.concatenate(records["policies"]).astype(np.float32),
+        outcomes=np.concatenate(records["outcomes"]).astype(np.int8),
+    )
+    for i in range(games):
+        os.remove(game_path(output_dir, shard, i))
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    return games, positions, time.time() - start
+
+
+def generate(
+    output_dir: str,
+    num_games: int,
+    workers: int = None,
+    games_per_shard: int = 16,
+    weights_path: str = None,
+    temperature_moves: int = 10,
+    seed: int = 0,
+    shared_cache_size: int = 0,
+) -> None:
+    """Plays self-play games in a pool of worker processes, and saves them in shards.
+
+    Each shard is an .npz file of the states, policies and outcomes of games_per_shard
+    games, see play_game. Shards are only written once complete, so a run that's stopped
+    can be resumed by running it again with the same arguments: finished shards are
+    skipped, and unfinished ones continue from their last checkpoint.
+
+    Args:
+        output_dir (str): Directory to write shards to.
+        num_games (int): Number of games to play, rounded up to a whole number of shards.
+        workers (int, optional): Number of worker processes. Defaults to one per CPU.
+        games_per_shard (int, optional): Number of games in each shard.
+        weights_path (str, optional): Network weights for the agent, see Network.load.
+        temperature_moves (int, optional): Number of moves sampled at the start of each game.
+        seed (int, optional): Seed for sampling moves. Each shard gets its own stream.
+        shared_cache_size (int, optional): Size of a network evaluation cache in shared
+            memory used by every worker. Defaults to 0, where each worker has its own cache.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    num_shards = -(-num_games // games_per_shard)
+    shards = [
+        s for s in range(num_shards) if not os.path.exists(shard_path(output_dir, s))
+    ]
+    print(
+        "Playing {} shards of {} games ({} already done)".format(
+            len(shards), games_per_shard, num_shards - len(shards)
+        )
+    )
+
+    cache = None
+    if shared_cache_size:
+        cache = EvaluationCache.create_shared(shared_cache_size)
+
+    config = {
+        "cache_name": cache.name if cache is not None else None,
+        "output_dir": output_dir,
+        "games_per_shard": games_per_shard,
+        "weights_path": weights_path,
+        "temperature_moves": temperature_moves,
+        "seed": seed,
+    }
+
+    start = time.time()
+    games = positions = 0
+    try:
+        with Pool(workers, initializer=_init_worker, initargs=(config,)) as pool:
+            for i, (shard_games, shard_positions, _) in enumerate(
+                pool.imap_unordered(_play_shard, shards), 1
+            ):
+                games += shard_games
+                positions += shard_positions
+                elapsed = time.time() - start
+                print(
+                    "{}/{} shards in {:.0f}s ({:.2f} games/s, {:.1f} positions/s)".format(
+                        i, len(shards), elapsed, games / elapsed, positions / elapsed
+                    )
+                )
+    finally:
+        if cache is not None:
+            print("Shared cache: {} entries".format(len(cache)))
+            cache.close()
+            cache.unlink()
+
+
+def load_shards(output_dir: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the states, policies and outcomes of every finished shard in output_dir."""
+    names = sorted(
+        f for f in os.listdir(output_dir) if f.startswith("shard_") and f.endswith(".npz")
+    )
+
+    states, policies, outcomes = [], [], []
+    for name in names:
+        with np.load(os.path.join(output_dir, name)) as f:
+            states.append(f["states"])
+            policies.append(f["policies"])
+            outcomes.append(f["outcomes"])
+
+    if not names:
+        return (
+            np.zeros((0, 2, 6, 7), np.uint8),
+            np.zeros((0, 7), np.float32),
+            np.zeros(0, np.int8),
+        )
+    return np.concatenate(states), np.concatenate(policies), np.concatenate(outcomes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate AlphaFour training data by self-play."
+    )
+    parser.add_argument("-o", "--output", default="self_play")
+    parser.add_argument("-n", "--games", type=int, default=1024)
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    parser.add_argument("--games-per-shard", type=int, default=16)
+    parser.add_argument("--weights", default=None)
+    parser.add_argument("--temperature-moves", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--shared-cache",
+        type=int,
+        default=0,
+        help="Entries in a network evaluation cache shared by all workers",
+    )
+
+    args = parser.parse_args()
+
+    generate(
+        args.output,
+        args.games,
+        args.workers,
+        args.games_per_shard,
+        args.weights,
+        args.temperature_moves,
+        args.seed,
+        args.shared_cache,
+    )
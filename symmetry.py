@@ -0,0 +1,100 @@
+import numpy as np
+from bitboard import WIDTH, HEIGHT, H1
+
+# Flat index of the mirror image of each cell of a 6x7 board
+MIRROR_CELLS = np.arange(42).reshape(6, 7)[:, ::-1].ravel()
+
+# Bit of each cell of a 6x7 board in a BitBoard key. Row 0 is the top of the board
+_KEY_BITS = np.array(
+    [
+        [1 << (col * H1 + HEIGHT - 1 - row) for col in range(WIDTH)]
+        for row in range(HEIGHT)
+    ],
+    dtype=np.uint64,
+)
+
+_COLUMN_BITS = (1 << H1) - 1
+
+
+def mirror_column(col: int) -> int:
+    """Returns the column col is reflected onto."""
+    return WIDTH - 1 - col
+
+
+def mirror_key(key: int) -> int:
+    """Returns the key of the mirror image of the position with BitBoard key key.
+
+    Each column takes its own 7 bits of the key, so mirroring just reverses the order
+    of the 7 bit groups.
+    """
+    mirrored = 0
+    for col in range(WIDTH):
+        mirrored |= ((key >> (col * H1)) & _COLUMN_BITS) << ((WIDTH - 1 - col) * H1)
+    return mirrored
+
+
+def canonical_key(key: int) -> tuple[int, bool]:
+    """Returns the smaller of a BitBoard key and its mirror image's key.
+
+    Returns:
+        key (int): The canonical key, which is the same for a position and its mirror.
+        mirrored (bool): Whether the canonical key is the mirror image's, in which case
+            moves and policies looked up with it have to be mirrored back.
+    """
+    mirrored = mirror_key(key)
+    if mirrored < key:
+        return mirrored, True
+    return key, False
+
+
+def canonical_hash(key: int, mirror_key: int) -> tuple[int, bool]:
+    """Returns the smaller of a position's hash and its mirror image's hash.
+
+    Like canonical_key, for hashes such as Zobrist hashes which are kept up to date for
+    both the position and its mirror image during search.
+    """
+    if mirror_key < key:
+        return mirror_key, True
+    return key, False
+
+
+def canonical_state(state: np.ndarray) -> tuple[np.ndarray, bool]:
+    """Returns a board array or its mirror image, picking the same one for both.
+
+    Args:
+        state (np.ndarray): A 6x7 board, or any array with columns on its last axis such
+            as the output of AlphaFour.get_game_state.
+
+    Returns:
+        state (np.ndarray): The canonical board, as a view if it's the mirror image.
+        mirrored (bool): Whether state was mirrored.
+    """
+    mirrored = state[..., ::-1]
+    if mirrored.tobytes() < state.tobytes():
+        return mirrored, True
+    return state, False
+
+
+def canonical_state_keys(states: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the canonical BitBoard key of each of a batch of game states.
+
+    Vectorized version of canonical_key, for states in the format returned by
+    AlphaFour.get_game_state, where the first plane holds the pieces of the player to
+    move.
+
+    Returns:
+        keys (np.ndarray): uint64 array of the canonical key of each state.
+        mirrored (np.ndarray): Whether each key is the mirror image's.
+    """
+    # key = current + mask, and each cell is in at most one of the two planes
+    cells = (2 * states[:, 0] + states[:, 1]).astype(np.uint64)
+    keys = (cells * _KEY_BITS).sum(axis=(1, 2), dtype=np.uint64)
+    mirror_keys = (cells[:, :, ::-1] * _KEY_BITS).sum(axis=(1, 2), dtype=np.uint64)
+
+    mirrored = mirror_keys < keys
+    return np.where(mirrored, mirror_keys, keys), mirrored
+
+
+def mirror_policy(policy: np.ndarray, mirrored: bool = True) -> np.ndarray:
+    """Translates a policy over columns between a position and its mirror image."""
+    return policy[..., ::-1] if mirrored else policy
@@ -0,0 +1,342 @@
+from agents import Agent
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from connectboard import ConnectBoard, InvalidMoveException
+from game_records import GameWriter
+from itertools import combinations
+from play_game import agents
+import numpy as np
+import argparse
+import ast
+import json
+import time
+
+_agents = {}  # Agents created by each worker process, by player index
+
+
+def parse_spec(spec: str) -> tuple[str, dict]:
+    """Splits a player spec into its agent name and constructor arguments.
+
+    Specs are an agent name from play_game.agents, optionally followed by a colon and
+    comma separated settings, e.g. "AlphaBeta:max_depth=4,killer_moves=False". Values are
+    parsed as Python literals.
+
+    Raises:
+        ValueError: If the agent is unknown, or a setting is malformed.
+    """
+    name, _, settings = spec.partition(":")
+    if name not in agents or name == "Human":
+        raise ValueError("Unknown Agent: {}".format(name))
+
+    kwargs = {}
+    for setting in filter(None, settings.split(",")):
+        key, sep, value = setting.partition("=")
+        if not sep:
+            raise ValueError("Expected key=value, got: {}".format(setting))
+        kwargs[key.strip()] = ast.literal_eval(value.strip())
+
+    return name, kwargs
+
+
+def random_opening(num_moves: int, rng: np.random.Generator) -> list[int]:
+    """Returns the columns of num_moves random moves, none of which end the game."""
+    board = ConnectBoard()
+    opening = []
+
+    while len(opening) < num_moves:
+        state = board.current_state() * (1 if len(opening) % 2 == 0 else -1)
+        moves = ConnectBoard.get_legal_moves(state)
+        candidates = []
+        for move in moves:
+            row, col = divmod(int(np.argmax(move)), 7)
+            if ConnectBoard.winner_after_move(state + move, row, col) is None:
+                candidates.append(move)
+
+        if not candidates:
+            # Every move ends the game, start again
+            return random_opening(num_moves, rng)
+
+        move = candidates[rng.integers(len(candidates))]
+        opening.append(int(np.argmax(move)) % 7)
+        board.make_move(move if len(opening) % 2 == 1 else -move)
+
+    return opening
+
+
+def play_match(
+    p1: Agent, p2: Agent, opening: list[int] = ()
+) -> tuple[int, list, list, list]:
+    """Plays a game between two agents without printing, after the given opening moves.
+
+    A player that makes an invalid move loses the game. Any other error raised by an
+    agent is a bug rather than a bad move, and propagates to the caller.
+
+    Returns:
+        winner (int): 1 or 2 for the winning player, 0 for a tie.
+        p1_times (list): Seconds taken by p1 for each move.
+        p2_times (list): Seconds taken by p2 for each move.
+        moves (list): Column of each move, including the opening.
+    """
+    board = ConnectBoard()
+    times = ([], [])
+    moves = list(opening)
+    turn = 0
+
+    for col in opening:
+        state = board.current_state()
+        move = np.zeros((6, 7))
+        move[np.flatnonzero(state[:, col] == 0)[-1], col] = 1 if turn % 2 == 0 else -1
+        board.make_move(move)
+        turn += 1
+
+    while board.winner() is None:
+        player = turn % 2
+        agent = p1 if player == 0 else p2
+        sign = 1 if player == 0 else -1
+
+        start = time.perf_counter()
+        move = sign * agent.get_move(sign * board.current_state())
+        times[player].append(time.perf_counter() - start)
+        try:
+            board.make_move(move)
+        except InvalidMoveException:
+            return 2 - player, times[0], times[1], moves
+
+        moves.append(int(np.argmax(np.abs(move))) % 7)
+        turn += 1
+
+    return board.winner(), times[0], times[1], moves
+
+
+def _get_agent(player: int, spec: str) -> Agent:
+    if player not in _agents:
+        name, kwargs = parse_spec(spec)
+        _agents[player] = agents[name](**kwargs)
+    return _agents[player]
+
+
+def _play_game(game: tuple) -> tuple:
+    """Plays one tournament game in a worker process."""
+    i, j, specs, opening, seed = game
+    np.random.seed(seed)
+
+    winner, p1_times, p2_times, moves = play_match(
+        _get_agent(i, specs[0]), _get_agent(j, specs[1]), opening
+    )
+
+    return i, j, winner, p1_times, p2_times, moves
+
+
+def elo_ratings(
+    points: np.ndarray, games: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Fits Elo ratings to the results between each pair of players.
+
+    Fits a Bradley-Terry model by maximum likelihood, with a draw counting as half a win.
+    Each pair is given one extra virtual draw, so players that won or lost every game
+    still get finite ratings. Ratings are centered on 0.
+
+    Args:
+        points (np.ndarray): points[i, j] is the score of player i against player j, with
+            1 per win and 0.5 per draw.
+        games (np.ndarray): games[i, j] is the number of games between i and j.
+
+    Returns:
+        ratings (np.ndarray): Elo rating of each player.
+        errors (np.ndarray): Half width of the 95% confidence interval of each rating.
+    """
+    played = games > 0
+    points = points + 0.5 * played
+    games = games + 1.0 * played
+
+    # Minorization-maximization updates of each player's strength
+    strength = np.ones(len(points))
+    for _ in range(10000):
+        denominator = (games / (strength[:, np.newaxis] + strength)).sum(axis=1)
+        new_strength = points.sum(axis=1) / denominator
+        new_strength /= np.exp(np.log(new_strength).mean())
+        converged = np.allclose(new_strength, strength, rtol=1e-10)
+        strength = new_strength
+        if converged:
+            break
+
+    # Covariance of the log strengths, from the inverse of the Fisher information
+    p = strength[:, np.newaxis] / (strength[:, np.newaxis] + strength)
+    information = -games * p * p.T
+    information[np.diag_indices_from(information)] = -information.sum(axis=1)
+    covariance = np.linalg.pinv(information)
+
+    scale = 400 / np.log(10)
+    ratings = scale * np.log(strength)
+    errors = 1.96 * scale * np.sqrt(np.maximum(np.diag(covariance), 0))
+
+    return ratings, errors
+
+
+def run(
+    specs: list[str],
+    games_per_pair: int = 100,
+    workers: int = None,
+    opening_moves: int = 0,
+    seed: int = 0,
+    record: str = None,
+) -> dict:
+    """Plays every pair of players against each other, and returns the results.
+
+    Each pair plays games_per_pair games, rounded up to an even number, split into pairs
+    of games with the same opening and colors swapped.
+
+    Args:
+        specs (list[str]): Player specs, see parse_spec.
+        games_per_pair (int, optional): Number of games between each pair of players.
+        workers (int, optional): Number of worker processes. Defaults to one per CPU.
+        opening_moves (int, optional): Number of random moves at the start of each game.
+        seed (int, optional): Seed for the openings, and for agents using numpy's global
+            random state.
+        record (str, optional): Game record file to append every game to, tagged with its
+            players and number of opening moves. See game_records.py.
+
+    Returns:
+        Dict with the players, their win/draw/loss matrices, Elo ratings with the half
+        width of their 95% confidence intervals, and average seconds per move.
+    """
+    for spec in specs:
+        parse_spec(spec)
+
+    rng = np.random.default_rng(seed)
+    games = []
+    for i, j in combinations(range(len(specs)), 2):
+        for _ in range(-(-games_per_pair // 2)):
+            opening = random_opening(opening_moves, rng)
+            game_seed = int(rng.integers(2 ** 32))
+            games.append((i, j, (specs[i], specs[j]), opening, game_seed))
+            games.append((j, i, (specs[j], specs[i]), opening, game_seed))
+
+    n = len(specs)
+    wins, draws, losses = np.zeros((3, n, n), dtype=int)
+    move_times = [[] for _ in specs]
+
+    writer = GameWriter(record) if record else None
+    start = time.time()
+    # Workers of a ProcessPoolExecutor aren't daemons, so agents can start their own
+    # worker processes, like Mcts with workers > 1
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(_play_game, game) for game in games]
+        for k, future in enumerate(as_completed(futures), 1):
+            i, j, winner, p1_times, p2_times, moves = future.result()
+            if writer is not None:
+                tags = {
+                    "player1": specs[i],
+                    "player2": specs[j],
+                    "opening_moves": opening_moves,
+                }
+                writer.write(moves, winner, tags)
+
+            if winner == 0:
+                draws[i, j] += 1
+                draws[j, i] += 1
+            else:
+                w, l = (i, j) if winner == 1 else (j, i)
+                wins[w, l] += 1
+                losses[l, w] += 1
+            move_times[i].extend(p1_times)
+            move_times[j].extend(p2_times)
+
+            if k % 100 == 0 or k == len(games):
+                elapsed = time.time() - start
+                print("{}/{} games in {:.0f}s".format(k, len(games), elapsed))
+                if writer is not None:
+                    writer.flush()
+
+    if writer is not None:
+        writer.close()
+
+    ratings, errors = elo_ratings(wins + 0.5 * draws, wins + draws + losses)
+
+    return {
+        "players": specs,
+        "wins": wins.tolist(),
+        "draws": draws.tolist(),
+        "losses": losses.tolist(),
+        "elo": ratings.tolist(),
+        "elo_error": errors.tolist(),
+        "seconds_per_move": [float(np.mean(t)) if t else 0.0 for t in move_times],
+    }
+
+
+def print_results(results: dict) -> None:
+    """Prints the win/draw/loss matrix and the ratings of a tournament."""
+    specs = results["players"]
+    width = max(len(s) for s in specs) + 2
+    wins, draws, losses = (np.array(results[k]) for k in ("wins", "draws", "losses"))
+
+    print()
+    print("W-D-L of row against column")
+    header = ["P{}".format(j) for j in range(len(specs))]
+    print(" " * (width + 3) + "".join("{:>14}".format(h) for h in header))
+    for i, spec in enumerate(specs):
+        cells = [
+            "{}-{}-{}".format(wins[i, j], draws[i, j], losses[i, j]) if i != j else "-"
+            for j in range(len(specs))
+        ]
+        label = "P{} {}".format(i, spec).ljust(width + 3)
+        print(label + "".join("{:>14}".format(c) for c in cells))
+
+    print()
+    print(
+        "{}{:>14}{:>10}{:>14}".format("Player".ljust(width + 3), "Elo", "Games", "ms/move")
+    )
+    order = np.argsort(results["elo"])[::-1]
+    for i in order:
+        print(
+            "{}{:>14}{:>10}{:>14.1f}".format(
+                "P{} {}".format(i, specs[i]).ljust(width + 3),
+                "{:+.0f} ± {:.0f}".format(results["elo"][i], results["elo_error"][i]),
+                wins[i].sum() + draws[i].sum() + losses[i].sum(),
+                1000 * results["seconds_per_move"][i],
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Play a round robin tournament between agents, and rate them."
+    )
+    parser.add_argument(
+        "players",
+        nargs="+",
+        help='Agents to play, optionally with settings, e.g. "AlphaBeta:max_depth=4"',
+    )
+    parser.add_argument("-n", "--games", type=int, default=100, help="Games per pair")
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    parser.add_argument(
+        "--opening-moves",
+        type=int,
+        default=0,
+        help="Random moves played at the start of each game",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="File to write the results to")
+    parser.add_argument(
+        "--record",
+        default=None,
+        help="Game record file to append every game to, see game_records.py",
+    )
+
+    args = parser.parse_args()
+
+    if len(args.players) < 2:
+        parser.error("At least two players are needed")
+
+    results = run(
+        args.players,
+        args.games,
+        args.workers,
+        args.opening_moves,
+        args.seed,
+        args.record,
+    )
+    print_results(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
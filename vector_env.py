@@ -0,0 +1,242 @@
+from connectboard import ConnectBoard
+import numpy as np
+import argparse
+import time
+
+
+class VectorEnv(object):
+    """Many games of Connect Four, stepped together.
+
+    Boards are stored in one (num_envs, 6, 7) int8 array, always from the point of view
+    of the player to move in each game: 1 for their pieces, -1 for their opponent's.
+    Actions are columns, one per game, and a step plays every game's move with a few
+    vectorized operations rather than a Python loop per game.
+
+    Games that finish are reset straight away, so every game always has a move to play.
+    A move into a full column, or outside the board, loses the game for the player who
+    made it.
+
+    Attributes:
+        boards (np.ndarray): Board of each game, from the point of view of the player to move.
+        heights (np.ndarray): Number of pieces in each column of each game.
+        turns (np.ndarray): Number of moves played in each game.
+        final_boards (np.ndarray): Boards of the games that finished in the last step,
+            before they were reset, from the point of view of the player who moved last.
+    """
+
+    def __init__(self, num_envs: int) -> None:
+        self.num_envs = num_envs
+        self.boards = np.zeros((num_envs, 6, 7), dtype=np.int8)
+        self.heights = np.zeros((num_envs, 7), dtype=np.int8)
+        self.turns = np.zeros(num_envs, dtype=np.int8)
+        self.final_boards = np.zeros((0, 6, 7), dtype=np.int8)
+        self._index = np.arange(num_envs)
+
+    @property
+    def players(self) -> np.ndarray:
+        """Player to move in each game: 0 for the player who moved first, 1 for the other."""
+        return self.turns % 2
+
+    def reset(self) -> tuple[np.ndarray, np.ndarray]:
+        """Starts every game again, and returns the boards and legal moves."""
+        self.boards[:] = 0
+        self.heights[:] = 0
+        self.turns[:] = 0
+        return self.states(), self.legal_moves()
+
+    def states(self) -> np.ndarray:
+        """Returns a copy of the boards, with the player to move as 1."""
+        return self.boards.copy()
+
+    def planes(self) -> np.ndarray:
+        """Returns the boards as network inputs, in the format of AlphaFour.get_game_state."""
+        return np.stack([self.boards == 1, self.boards == -1], axis=1).astype(np.uint8)
+
+    def legal_moves(self) -> np.ndarray:
+        """Returns a (num_envs, 7) mask of the columns that aren't full in each game."""
+        return self.heights < 6
+
+    def step(
+        self, actions: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Plays a move in every game.
+
+        Args:
+            actions (np.ndarray): Column to play in each game.
+
+        Returns:
+            states (np.ndarray): Board of each game after the move, with the next player to
+                move as 1. Games that finished have been reset to the empty board.
+            legal (np.ndarray): Mask of the legal moves of the next player in each game.
+            rewards (np.ndarray): Reward of the player who moved: 1 for winning, -1 for an
+                illegal move, and 0 otherwise.
+            dones (np.ndarray): Whether each game finished with this move.
+        """
+        actions = np.asarray(actions)
+        rewards = np.zeros(self.num_envs, dtype=np.float32)
+
+        cols = np.clip(actions, 0, 6).astype(np.intp)
+        legal = (actions == cols) & (self.heights[self._index, cols] < 6)
+        rewards[~legal] = -1
+
+        # Drop each legal move's piece, and check the windows through it for a win
+        idx = self._index[legal]
+        cols = cols[legal]
+        cells = (5 - self.heights[idx, cols].astype(np.intp)) * 7 + cols
+        flat = self.boards.reshape(self.num_envs, 42)
+        flat[idx, cells] = 1
+        self.heights[idx, cols] += 1
+
+        windows = flat[
+            idx[:, np.newaxis, np.newaxis], ConnectBoard.PADDED_CELL_WINDOWS[cells]
+        ]
+        won = (windows.sum(axis=2) == 4).any(axis=1)
+        rewards[idx[won]] = 1
+
+        self.turns += 1
+        dones = ~legal | (rewards == 1) | (self.turns == 42)
+
+        self.final_boards = self.boards[dones]
+        self.boards *= -1
+
+        # Start the finished games again
+        self.boards[dones] = 0
+        self.heights[dones] = 0
+        self.turns[dones] = 0
+
+        return self.states(), self.legal_moves(), rewards, dones
+
+
+def winning_moves(states: np.ndarray, piece: int = 1) -> np.ndarray:
+    """Returns a (n, 7) mask of the columns where piece would complete four in a row.
+
+    Args:
+        states (np.ndarray): Array of boards, with 0 for open squares.
+        piece (int, optional): Piece to check, 1 or -1.
+    """
+    n = len(states)
+    heights = (states != 0).sum(axis=1)
+    cells = (5 - np.minimum(heights, 5)) * 7 + np.arange(7)
+
+    windows = states.reshape(n, 42)[
+        np.arange(n)[:, np.newaxis, np.newaxis, np.newaxis],
+        ConnectBoard.PADDED_CELL_WINDOWS[cells],
+    ]
+
+    # The open square counts as 0, so the other three have to be piece
+    return (heights < 6) & (windows.sum(axis=3) == 3 * piece).any(axis=2)
+
+
+def random_policy(
+    states: np.ndarray, legal: np.ndarray, rng: np.random.Generator
+) -> np.ndarray:
+    """Returns a random legal column for each board."""
+    scores = rng.random(legal.shape)
+    scores[~legal] = -1
+    return scores.argmax(axis=1)
+
+
+def greedy_policy(
+    states: np.ndarray, legal: np.ndarray, rng: np.random.Generator
+) -> np.ndarray:
+    """Returns a winning column for each board if there is one, else a column that
+    blocks the opponent from winning, else a random legal column."""
+    scores = rng.random(legal.shape)
+    scores += 2 * winning_moves(states, -1) + 4 * winning_moves(states, 1)
+    scores[~legal] = -1
+    return scores.argmax(axis=1)
+
+
+# Policies by name. Each takes the boards, legal move masks and a random number
+# generator, and returns the column to play on each board.
+policies = {
+    "random": random_policy,
+    "greedy": greedy_policy,
+}
+
+
+def play_games(
+    policy1, policy2, num_games: int, num_envs: int = 1024, seed: int = 0
+) -> tuple[int, int, int]:
+    """Plays games between two policies, and returns the results.
+
+    Each environment swaps which policy moves first every game, so both get the first
+    move equally often.
+
+    Args:
+        policy1: Policy of the first player, see policies.
+        policy2: Policy of the second player.
+        num_games (int): Number of games to play.
+        num_envs (int, optional): Number of games to play at once.
+        seed (int, optional): Seed for the policies' random number generator.
+
+    Returns:
+        The number of wins of policy1, draws, and wins of policy2.
+    """
+    rng = np.random.default_rng(seed)
+    env = VectorEnv(min(num_envs, num_games))
+    states, legal = env.reset()
+
+    # Which policy moved first in each game, and each game's number. Games numbered
+    # num_games or more are extra games started while the last ones finish, and aren't
+    # counted, so short games aren't overrepresented.
+    swapped = env._index % 2 == 1
+    game_ids = env._index.copy()
+    next_id = env.num_envs
+    results = np.zeros(3, dtype=int)  # policy1 wins, draws, policy2 wins
+
+    while results.sum() < num_games:
+        movers = env.players ^ swapped  # 0 where policy1 moves
+        actions = np.empty(env.num_envs, dtype=np.intp)
+        for policy, mask in ((policy1, movers == 0), (policy2, movers == 1)):
+            if mask.any():
+                actions[mask] = policy(states[mask], legal[mask], rng)
+
+        states, legal, rewards, dones = env.step(actions)
+
+        counted = dones & (game_ids < num_games)
+        winners = np.where(rewards > 0, movers, 1 - movers)
+        results[1] += np.count_nonzero(counted & (rewards == 0))
+        results[0] += np.count_nonzero(counted & (rewards != 0) & (winners == 0))
+        results[2] += np.count_nonzero(counted & (rewards != 0) & (winners == 1))
+
+        finished = np.flatnonzero(dones)
+        swapped[finished] ^= True
+        game_ids[finished] = next_id + np.arange(finished.size)
+        next_id += finished.size
+
+    return tuple(int(r) for r in results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Play many games between two simple policies at once."
+    )
+    parser.add_argument("-p1", "--player1", choices=policies, default="random")
+    parser.add_argument("-p2", "--player2", choices=policies, default="greedy")
+    parser.add_argument("-n", "--games", type=int, default=100000)
+    parser.add_argument("--envs", type=int, default=1024, help="Games to play at once")
+    parser.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+
+    start = time.time()
+    wins, draws, losses = play_games(
+        policies[args.player1],
+        policies[args.player2],
+        args.games,
+        args.envs,
+        args.seed,
+    )
+    elapsed = time.time() - start
+
+    print(
+        "{} vs {}: {} wins, {} draws, {} losses".format(
+            args.player1, args.player2, wins, draws, losses
+        )
+    )
+    print(
+        "{} games in {:.1f}s ({:.0f} games/s)".format(
+            args.games, elapsed, args.games / elapsed
+        )
+    )